@@ -78,7 +78,7 @@ class NetworkOnDisk:
 
     def read_hash(self):
         if not self.hash:
-            self.set_hash(hashes.sha256(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors) or '')
+            self.set_hash(hashes.sha256_in_background(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors, on_done=lambda x: self.set_hash(x or '')) or '')
 
     def get_alias(self):
         import networks
@@ -69,8 +69,9 @@ function randomId() {
     return "task(" + Math.random().toString(36).slice(2, 7) + Math.random().toString(36).slice(2, 7) + Math.random().toString(36).slice(2, 7) + ")";
 }
 
-// starts sending progress requests to "/internal/progress" uri, creating progressbar above progressbarContainer element and
-// preview inside gallery element. Cleans up all created stuff when the task is over and calls atEnd.
+// listens to progress events from "/internal/progress/stream" uri (or, without EventSource, polls "/internal/progress"),
+// creating progressbar above progressbarContainer element and preview inside gallery element.
+// Cleans up all created stuff when the task is over and calls atEnd.
 // calls onProgress every time there is a progress update
 function requestProgress(id_task, progressbarContainer, gallery, atEnd, onProgress, inactivityTimeout = 40) {
     var dateStart = new Date();
@@ -120,51 +121,85 @@ function requestProgress(id_task, progressbarContainer, gallery, atEnd, onProgre
         divProgress = null;
     };
 
-    var funProgress = function(id_task) {
-        requestWakeLock();
-        request("./internal/progress", {id_task: id_task, live_preview: false}, function(res) {
-            if (res.completed) {
-                removeProgressBar();
-                return;
-            }
+    // updates the progressbar; returns false when the task is over
+    var showProgress = function(res) {
+        if (!divProgress) {
+            return false;
+        }
 
-            let progressText = "";
+        if (res.completed) {
+            removeProgressBar();
+            return false;
+        }
 
-            divInner.style.width = ((res.progress || 0) * 100.0) + '%';
-            divInner.style.background = res.progress ? "" : "transparent";
+        let progressText = "";
 
-            if (res.progress > 0) {
-                progressText = ((res.progress || 0) * 100.0).toFixed(0) + '%';
-            }
+        divInner.style.width = ((res.progress || 0) * 100.0) + '%';
+        divInner.style.background = res.progress ? "" : "transparent";
 
-            if (res.eta) {
-                progressText += " ETA: " + formatTime(res.eta);
-            }
+        if (res.progress > 0) {
+            progressText = ((res.progress || 0) * 100.0).toFixed(0) + '%';
+        }
 
-            setTitle(progressText);
+        if (res.eta) {
+            progressText += " ETA: " + formatTime(res.eta);
+        }
 
-            if (res.textinfo && res.textinfo.indexOf("\n") == -1) {
-                progressText = res.textinfo + " " + progressText;
-            }
+        setTitle(progressText);
 
-            divInner.textContent = progressText;
+        if (res.textinfo && res.textinfo.indexOf("\n") == -1) {
+            progressText = res.textinfo + " " + progressText;
+        }
 
-            var elapsedFromStart = (new Date() - dateStart) / 1000;
+        divInner.textContent = progressText;
 
-            if (res.active) wasEverActive = true;
+        var elapsedFromStart = (new Date() - dateStart) / 1000;
 
-            if (!res.active && wasEverActive) {
-                removeProgressBar();
-                return;
+        if (res.active) wasEverActive = true;
+
+        if (!res.active && wasEverActive) {
+            removeProgressBar();
+            return false;
+        }
+
+        if (elapsedFromStart > inactivityTimeout && !res.queued && !res.active) {
+            removeProgressBar();
+            return false;
+        }
+
+        if (onProgress) {
+            onProgress(res);
+        }
+
+        return true;
+    };
+
+    var showLivePreview = function(res) {
+        if (!res.live_preview || !gallery || !divProgress) {
+            return;
+        }
+
+        var img = new Image();
+        img.onload = function() {
+            if (!livePreview) {
+                livePreview = document.createElement('div');
+                livePreview.className = 'livePreview';
+                gallery.insertBefore(livePreview, gallery.firstElementChild);
             }
 
-            if (elapsedFromStart > inactivityTimeout && !res.queued && !res.active) {
-                removeProgressBar();
-                return;
+            livePreview.appendChild(img);
+            if (livePreview.childElementCount > 2) {
+                livePreview.removeChild(livePreview.firstElementChild);
             }
+        };
+        img.src = res.live_preview;
+    };
 
-            if (onProgress) {
-                onProgress(res);
+    var funProgress = function(id_task) {
+        requestWakeLock();
+        request("./internal/progress", {id_task: id_task, live_preview: false}, function(res) {
+            if (!showProgress(res)) {
+                return;
             }
 
             setTimeout(() => {
@@ -181,22 +216,7 @@ function requestProgress(id_task, progressbarContainer, gallery, atEnd, onProgre
                 return;
             }
 
-            if (res.live_preview && gallery) {
-                var img = new Image();
-                img.onload = function() {
-                    if (!livePreview) {
-                        livePreview = document.createElement('div');
-                        livePreview.className = 'livePreview';
-                        gallery.insertBefore(livePreview, gallery.firstElementChild);
-                    }
-
-                    livePreview.appendChild(img);
-                    if (livePreview.childElementCount > 2) {
-                        livePreview.removeChild(livePreview.firstElementChild);
-                    }
-                };
-                img.src = res.live_preview;
-            }
+            showLivePreview(res);
 
             setTimeout(() => {
                 funLivePreview(id_task, res.id_live_preview);
@@ -206,6 +226,24 @@ function requestProgress(id_task, progressbarContainer, gallery, atEnd, onProgre
         });
     };
 
+    if (window.EventSource) {
+        requestWakeLock();
+
+        var source = new EventSource("./internal/progress/stream?id_task=" + encodeURIComponent(id_task) + "&live_preview=" + (gallery ? "true" : "false") + "&inactivity_timeout=" + inactivityTimeout);
+        source.onmessage = function(event) {
+            var res = JSON.parse(event.data);
+            showLivePreview(res);
+            if (!showProgress(res)) {
+                source.close();
+            }
+        };
+        source.onerror = function() {
+            source.close();
+            removeProgressBar();
+        };
+        return;
+    }
+
     funProgress(id_task, 0);
 
     if (gallery) {
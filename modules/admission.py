@@ -0,0 +1,173 @@
+import contextlib
+import math
+import threading
+import time
+
+import torch
+
+from modules import job_scheduler, shared
+
+
+class AdmissionError(Exception):
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = message
+        self.headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after is not None else None
+
+
+attention_matrix_share = {
+    "xformers": 0.0,
+    "sdp": 0.0,
+    "sub-quadratic": 0.0,
+    "sdp-no-mem": 0.5,
+    "Doggettx": 0.25,
+    "InvokeAI": 0.25,
+    "V1": 0.25,
+}
+"""how much of the full attention matrix each cross attention optimization (sd_hijack_optimizations) keeps in memory
+at once: memory-efficient kernels never build it, sliced ones build it in parts; no optimization builds all of it"""
+
+unet_bytes_per_token = 120 * 1024
+"""UNet activations for one latent pixel of one image, for the cond and uncond halves of the batch together"""
+
+attention_heads = 8
+
+vae_bytes_per_pixel = 4 * 1024
+"""VAE decoder activations per output pixel; images of a batch are decoded one at a time"""
+
+
+def estimate_peak_memory(width, height, batch_size=1, optimizer=None):
+    """Rough number of bytes a generation at this size needs on top of the loaded model, before calibration"""
+
+    tokens = (width // 8) * (height // 8)
+    share = attention_matrix_share.get(optimizer, 1.0)
+
+    per_image = unet_bytes_per_token * tokens + share * attention_heads * tokens * tokens * 2 * 2
+    vae = vae_bytes_per_pixel * width * height
+
+    return batch_size * per_image + vae
+
+
+def request_passes(req):
+    """(width, height) of every pass of a txt2img/img2img API request; hires fix adds a second, larger one"""
+
+    passes = [(req.width, req.height)]
+
+    if getattr(req, "enable_hr", False):
+        if req.hr_resize_x or req.hr_resize_y:
+            hr_width = req.hr_resize_x or req.hr_resize_y * req.width // req.height
+            hr_height = req.hr_resize_y or req.hr_resize_x * req.height // req.width
+        else:
+            hr_width, hr_height = int(req.width * req.hr_scale), int(req.height * req.hr_scale)
+
+        passes.append((hr_width, hr_height))
+
+    return passes
+
+
+class AdmissionController:
+    """Decides whether the API takes a generation request, before it waits in the queue or touches the GPU.
+
+    Requests are turned away with 503 when the queue is full and with 429 when their client already has its share of
+    waiting jobs, both with a Retry-After computed from the queue length and how long jobs have been taking; requests
+    whose estimated memory use can never fit in the GPU get 413 instead of failing with an out of memory error later.
+
+    The memory estimate comes from resolution, batch size, hires fix and the attention optimization in use, and is
+    scaled by how far off it was for earlier jobs, using the peaks seen by the memory monitor."""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.lock = threading.Lock()
+
+        self.scale = 1.0
+        """measured peak / estimate, averaged over past jobs"""
+
+        self.job_seconds = 10.0
+        """duration of a job, averaged over past jobs"""
+
+        self.observations = 0
+
+        self.baseline = None
+        """GPU memory in use when the last job started"""
+
+    def enabled(self):
+        return getattr(shared.opts, "api_admission_control", False)
+
+    def optimizer(self):
+        from modules import sd_hijack
+
+        return sd_hijack.current_optimizer.name if sd_hijack.current_optimizer is not None else None
+
+    def estimate(self, req):
+        optimizer = self.optimizer()
+        batch_size = req.batch_size if isinstance(req.prompt, str) else max(req.batch_size, len(req.prompt))
+        estimate = max(estimate_peak_memory(width, height, batch_size, optimizer) for width, height in request_passes(req))
+
+        return estimate * self.scale
+
+    def budget(self):
+        """Bytes left for generation on the GPU within api_admission_vram_fraction, or None without CUDA"""
+        if shared.mem_mon is None or shared.mem_mon.disabled:
+            return None
+
+        free, total = shared.mem_mon.cuda_mem_get_info()
+
+        # the memory in use before the last job started is the model; right now it may also hold a running job
+        in_use = self.baseline if self.baseline is not None else torch.cuda.memory_allocated(shared.mem_mon.device)
+
+        return total * getattr(shared.opts, "api_admission_vram_fraction", 0.9) - in_use
+
+    def retry_after(self, waiting):
+        return (waiting + 1) * self.job_seconds
+
+    def check(self, req, memory=True):
+        """Raises AdmissionError if req should not be queued; memory=False skips the memory check, for jobs that
+        run in worker processes"""
+        if not self.enabled():
+            return
+
+        waiting = self.queue.queue_info()
+        client = job_scheduler.current_client.get()
+
+        max_depth = self.queue.get_max_depth()
+        if max_depth and len(waiting) >= max_depth:
+            raise AdmissionError(f"The queue is full: {len(waiting)} jobs are already waiting", 503, self.retry_after(len(waiting)))
+
+        per_client = getattr(shared.opts, "api_admission_client_jobs", 0)
+        own = sum(1 for x in waiting if x["client"] == client)
+        if per_client and own >= per_client:
+            raise AdmissionError(f"Too many jobs: {own} of your jobs are already waiting", 429, self.retry_after(len(waiting)))
+
+        if not memory:
+            return
+
+        estimate = self.estimate(req)
+        budget = self.budget()
+        if budget is not None and estimate > budget:
+            raise AdmissionError(f"Not enough GPU memory: the request needs about {estimate / 2**20:.0f} MB, {budget / 2**20:.0f} MB is available; use a lower resolution or batch size", 413)
+
+    def observe(self, estimate, peak, seconds):
+        """Updates the calibration with the uncalibrated memory estimate of a finished job, its measured peak and duration"""
+        with self.lock:
+            self.job_seconds = seconds if self.observations == 0 else 0.8 * self.job_seconds + 0.2 * seconds
+
+            if peak > 0:
+                ratio = min(max(peak / estimate, 0.25), 4.0)
+                self.scale = ratio if self.observations == 0 else 0.8 * self.scale + 0.2 * ratio
+
+            self.observations += 1
+
+    @contextlib.contextmanager
+    def measure(self, req):
+        """Records the memory peak and duration of the job for req run inside the with block; call with the GPU lock held"""
+        monitored = self.enabled() and shared.mem_mon is not None and not shared.mem_mon.disabled
+        if monitored:
+            torch.cuda.reset_peak_memory_stats(shared.mem_mon.device)
+            self.baseline = torch.cuda.memory_allocated(shared.mem_mon.device)
+
+        started = time.time()
+        yield
+
+        peak = shared.mem_mon.read()["active_peak"] - self.baseline if monitored else 0
+        self.observe(self.estimate(req) / self.scale, peak, time.time() - started)
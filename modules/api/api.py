@@ -1,8 +1,11 @@
 import base64
 import io
+import json
 import os
 import time
 import datetime
+import uuid
+import zipfile
 import uvicorn
 import ipaddress
 import requests
@@ -11,14 +14,16 @@ from threading import Lock
 from io import BytesIO
 from fastapi import APIRouter, Depends, FastAPI, Request, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.exceptions import HTTPException, RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 from secrets import compare_digest
+from pydantic import ValidationError
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
-from modules.api import models
+from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, shared_options, script_callbacks, infotext_utils, sd_models, sd_schedulers, call_queue, job_scheduler, progress, worker_pool, admission, metrics, hashes, sd_models_cache
+from modules.api import models, jobs, batching
 from modules.shared import opts
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
@@ -27,11 +32,11 @@ from PIL import PngImagePlugin
 from modules.sd_models_config import find_checkpoint_config_near_filename
 from modules.realesrgan_model import get_realesrgan_models
 from modules import devices
-from typing import Any
+from typing import Any, Optional, Union
 import piexif
 import piexif.helper
 from contextlib import closing
-from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task
+from modules.progress import create_task_id, start_task, finish_task, current_task
 
 def script_name_to_index(name, scripts):
     try:
@@ -75,6 +80,13 @@ def verify_url(url):
 
 
 def decode_base64_to_image(encoding):
+    if isinstance(encoding, bytes):
+        # raw file contents from a multipart upload
+        try:
+            return images.read(BytesIO(encoding))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail="Invalid uploaded image") from e
+
     if encoding.startswith("http://") or encoding.startswith("https://"):
         if not opts.api_enable_requests:
             raise HTTPException(status_code=500, detail="Requests not allowed")
@@ -100,9 +112,17 @@ def decode_base64_to_image(encoding):
 
 
 def encode_pil_to_base64(image):
-    with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
+    if isinstance(image, str):
+        return image
+
+    return base64.b64encode(encode_pil_to_bytes(image))
+
+
+def encode_pil_to_bytes(image):
+    if isinstance(image, bytes):
+        return image
+
+    with io.BytesIO() as output_bytes, metrics.stage("encode"):
         if opts.samples_format.lower() == 'png':
             use_metadata = False
             metadata = PngImagePlugin.PngInfo()
@@ -129,7 +149,77 @@ def encode_pil_to_base64(image):
 
         bytes_data = output_bytes.getvalue()
 
-    return base64.b64encode(bytes_data)
+    return bytes_data
+
+
+def image_file_type():
+    """(extension, mime type) of images made by encode_pil_to_bytes"""
+    extension = opts.samples_format.lower()
+    extension = "jpg" if extension == "jpeg" else extension
+    return extension, "image/jpeg" if extension == "jpg" else f"image/{extension}"
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only file that hands out what was written to it since last time; lets zipfile write into a stream"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_images_zip(pil_images, info):
+    """Yields a zip archive with info.json and the images as files, encoding one image at a time"""
+    extension, _ = image_file_type()
+    buffer = ChunkBuffer()
+
+    # images are compressed already, so they are only stored; zipfile uses data descriptors because the buffer is not seekable
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr("info.json", json.dumps(jsonable_encoder(info)))
+        yield buffer.take()
+
+        for i, image in enumerate(pil_images):
+            archive.writestr(f"{i:05}.{extension}", encode_pil_to_bytes(image))
+            yield buffer.take()
+
+    yield buffer.take()
+
+
+def stream_images_multipart(pil_images, info, boundary):
+    """Yields a multipart/mixed body: a JSON part with parameters and info, then one part per image"""
+    extension, mime_type = image_file_type()
+
+    yield f"--{boundary}\r\nContent-Type: application/json\r\nContent-Disposition: inline; name=\"info\"\r\n\r\n".encode()
+    yield json.dumps(jsonable_encoder(info)).encode()
+
+    for i, image in enumerate(pil_images):
+        data = encode_pil_to_bytes(image)
+        yield f"\r\n--{boundary}\r\nContent-Type: {mime_type}\r\nContent-Disposition: inline; name=\"images\"; filename=\"{i:05}.{extension}\"\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+        yield data
+
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def binary_images_response(pil_images, response_format, info):
+    """Response with raw image files instead of base64 in JSON, for response_format=zip or response_format=multipart"""
+    if response_format == "zip":
+        return StreamingResponse(stream_images_zip(pil_images, info), media_type="application/zip", headers={"Content-Disposition": 'attachment; filename="images.zip"'})
+
+    if response_format == "multipart":
+        boundary = uuid.uuid4().hex
+        return StreamingResponse(stream_images_multipart(pil_images, info, boundary), media_type=f"multipart/mixed; boundary={boundary}")
+
+    raise HTTPException(status_code=422, detail=f"Unknown response_format: {response_format}; use zip or multipart")
 
 
 def api_middleware(app: FastAPI):
@@ -171,14 +261,25 @@ def api_middleware(app: FastAPI):
             "body": vars(e).get('body', ''),
             "errors": str(e),
         }
-        if not isinstance(e, HTTPException):  # do not print backtrace on known httpexceptions
+        if not isinstance(e, (HTTPException, job_scheduler.QueueFullError, job_scheduler.JobCancelledError, worker_pool.WorkerError, admission.AdmissionError)):  # do not print backtrace on known httpexceptions
             message = f"API error: {request.method}: {request.url} {err}"
             if rich_available:
                 print(message)
                 console.print_exception(show_locals=True, max_frames=2, extra_lines=1, suppress=[anyio, starlette], word_wrap=False, width=min([console.width, 200]))
             else:
                 errors.report(message, exc_info=True)
-        return JSONResponse(status_code=vars(e).get('status_code', 500), content=jsonable_encoder(err))
+        return JSONResponse(status_code=vars(e).get('status_code', 500), content=jsonable_encoder(err), headers=vars(e).get('headers'))
+
+    @app.middleware("http")
+    async def job_priority(req: Request, call_next):
+        if not req.scope.get('path', '').startswith('/sdapi'):
+            return await call_next(req)
+
+        # API jobs queue behind the web UI; clients can ask to go further back, and name themselves for fair share
+        priority = "background" if req.headers.get("x-job-priority") == "background" else "batch"
+        client = req.headers.get("x-client-id") or (req.client.host if req.client else "api")
+        with job_scheduler.job_context(priority=priority, client=client):
+            return await call_next(req)
 
     @app.middleware("http")
     async def exception_handling(request: Request, call_next):
@@ -197,7 +298,7 @@ def api_middleware(app: FastAPI):
 
 
 class Api:
-    def __init__(self, app: FastAPI, queue_lock: Lock):
+    def __init__(self, app: FastAPI, queue_lock: job_scheduler.JobScheduler):
         if shared.cmd_opts.api_auth:
             self.credentials = {}
             for auth in shared.cmd_opts.api_auth.split(","):
@@ -207,9 +308,20 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
+        self.job_store = jobs.JobStore()
+        self.worker_pool: Optional[worker_pool.WorkerPool] = None
+        self.txt2img_batcher = batching.Txt2ImgBatcher(self.run_txt2img)
+        self.admission = admission.AdmissionController(queue_lock)
         api_middleware(self.app)
         self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
         self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
+        self.add_api_route("/sdapi/v1/img2img-multipart", self.img2img_multipart_api, methods=["POST"], response_model=models.ImageToImageResponse)
+        self.add_api_route("/sdapi/v2/jobs/txt2img", self.submit_txt2img_job, methods=["POST"], response_model=models.JobSubmitResponse)
+        self.add_api_route("/sdapi/v2/jobs/img2img", self.submit_img2img_job, methods=["POST"], response_model=models.JobSubmitResponse)
+        self.add_api_route("/sdapi/v2/jobs/{id_task}", self.get_job, methods=["GET"], response_model=models.JobStatusResponse)
+        self.add_api_route("/sdapi/v2/jobs/{id_task}/events", progress.progress_stream, methods=["GET"])
+        self.add_api_route("/sdapi/v2/jobs/{id_task}/result", self.get_job_result, methods=["GET"], response_model=Union[models.TextToImageResponse, models.ImageToImageResponse])
+        self.add_api_route("/sdapi/v2/jobs/{id_task}", self.delete_job, methods=["DELETE"])
         self.add_api_route("/sdapi/v1/extra-single-image", self.extras_single_image_api, methods=["POST"], response_model=models.ExtrasSingleImageResponse)
         self.add_api_route("/sdapi/v1/extra-batch-images", self.extras_batch_images_api, methods=["POST"], response_model=models.ExtrasBatchImagesResponse)
         self.add_api_route("/sdapi/v1/png-info", self.pnginfoapi, methods=["POST"], response_model=models.PNGInfoResponse)
@@ -239,11 +351,18 @@ class Api:
         self.add_api_route("/sdapi/v1/train/embedding", self.train_embedding, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/train/hypernetwork", self.train_hypernetwork, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/memory", self.get_memory, methods=["GET"], response_model=models.MemoryResponse)
+        self.add_api_route("/sdapi/v1/workers", self.get_workers, methods=["GET"], response_model=list[models.WorkerItem])
+        self.add_api_route("/sdapi/v1/hashing", self.get_hashing, methods=["GET"], response_model=list[models.HashingItem])
+        self.add_api_route("/sdapi/v1/checkpoint-cache", self.get_checkpoint_cache, methods=["GET"], response_model=models.CheckpointCacheResponse)
+        self.add_api_route("/metrics", self.get_metrics, methods=["GET"], response_class=PlainTextResponse)
         self.add_api_route("/sdapi/v1/unload-checkpoint", self.unloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/reload-checkpoint", self.reloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
         self.add_api_route("/sdapi/v1/script-info", self.get_script_info, methods=["GET"], response_model=list[models.ScriptInfo])
         self.add_api_route("/sdapi/v1/extensions", self.get_extensions_list, methods=["GET"], response_model=list[models.ExtensionItem])
+        self.add_api_route("/sdapi/v1/enhance-prompt", self.enhance_prompt, methods=["POST"], response_model=models.EnhancePromptResponse)
+        self.add_api_route("/sdapi/v1/enhance-prompts", self.enhance_prompts, methods=["POST"], response_model=models.EnhancePromptsResponse)
+        self.add_api_route("/sdapi/v1/enhance-prompt/stats", self.get_enhance_prompt_stats, methods=["GET"], response_model=models.EnhancePromptStatsResponse)
 
         if shared.cmd_opts.api_server_stop:
             self.add_api_route("/sdapi/v1/server-kill", self.kill_webui, methods=["POST"])
@@ -429,7 +548,29 @@ class Api:
 
         return params
 
-    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, response_format: Optional[str] = None):
+        self.admission.check(txt2imgreq, memory=self.worker_pool is None)
+        processed = self.process_txt2img(txt2imgreq)
+        send_images = txt2imgreq.send_images
+
+        if response_format is not None:
+            return binary_images_response(processed.images if send_images else [], response_format, {"parameters": vars(txt2imgreq), "info": processed.js()})
+
+        b64images = list(images.encode_in_parallel(encode_pil_to_base64, processed.images)) if send_images else []
+
+        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+
+    def process_txt2img(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+        """Runs a txt2img request when its turn in the queue comes; returns the Processed result"""
+        if self.worker_pool is not None:
+            return self.run_on_worker("txt2img", txt2imgreq)
+
+        if self.txt2img_batcher.accepts(txt2imgreq):
+            return self.txt2img_batcher.submit(txt2imgreq)
+
+        return self.run_txt2img(txt2imgreq)
+
+    def run_txt2img(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
         task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
 
         script_runner = scripts.scripts_txt2img
@@ -459,12 +600,10 @@ class Api:
 
         script_args = self.init_script_args(txt2imgreq, self.default_script_arg_txt2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
-        send_images = args.pop('send_images', True)
+        args.pop('send_images', None)
         args.pop('save_images', None)
 
-        add_task_to_queue(task_id)
-
-        with self.queue_lock:
+        with call_queue.queued_task(task_id, self.queue_lock, model=call_queue.model_key(txt2imgreq.prompt, txt2imgreq.override_settings)), self.admission.measure(txt2imgreq):
             with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
                 p.is_api = True
                 p.scripts = script_runner
@@ -485,11 +624,29 @@ class Api:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        return processed
 
-        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, response_format: Optional[str] = None):
+        self.admission.check(img2imgreq, memory=self.worker_pool is None)
+        processed = self.process_img2img(img2imgreq)
+        send_images = img2imgreq.send_images
+
+        if not img2imgreq.include_init_images:
+            img2imgreq.init_images = None
+            img2imgreq.mask = None
+
+        if response_format is not None:
+            return binary_images_response(processed.images if send_images else [], response_format, {"parameters": vars(img2imgreq), "info": processed.js()})
+
+        b64images = list(images.encode_in_parallel(encode_pil_to_base64, processed.images)) if send_images else []
+
+        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+
+    def process_img2img(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+        """Runs an img2img request when its turn in the queue comes; returns the Processed result"""
+        if self.worker_pool is not None:
+            return self.run_on_worker("img2img", img2imgreq)
 
-    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
         init_images = img2imgreq.init_images
@@ -529,12 +686,10 @@ class Api:
 
         script_args = self.init_script_args(img2imgreq, self.default_script_arg_img2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
-        send_images = args.pop('send_images', True)
+        args.pop('send_images', None)
         args.pop('save_images', None)
 
-        add_task_to_queue(task_id)
-
-        with self.queue_lock:
+        with call_queue.queued_task(task_id, self.queue_lock, model=call_queue.model_key(img2imgreq.prompt, img2imgreq.override_settings)), self.admission.measure(img2imgreq):
             with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
                 p.init_images = [decode_base64_to_image(x) for x in init_images]
                 p.is_api = True
@@ -556,13 +711,140 @@ class Api:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        return processed
 
-        if not img2imgreq.include_init_images:
-            img2imgreq.init_images = None
-            img2imgreq.mask = None
+    def set_worker_pool(self, pool):
+        """Runs txt2img/img2img jobs in the worker processes of pool; they are queued and admitted by the pool's queue"""
+        self.worker_pool = pool
+        self.admission.queue = pool.queue
 
-        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+    def run_on_worker(self, kind, req):
+        """Runs a txt2img/img2img request in a worker process, in --workers mode; the images in the result are encoded already"""
+        task_id = req.force_task_id or create_task_id(kind)
+        model = call_queue.model_key(req.prompt, req.override_settings)
+
+        try:
+            with call_queue.queued_task(task_id, self.worker_pool.queue, model=model):
+                return self.worker_pool.run(kind, req.dict(), model[0], on_start=lambda: progress.start_worker_task(task_id), on_progress=lambda state: progress.update_worker_task(task_id, state))
+        finally:
+            progress.remove_task_from_queue(task_id)
+            finish_task(task_id)
+
+    async def img2img_multipart_api(self, request: Request, response_format: Optional[str] = None):
+        """img2img with init images and mask uploaded as files in a multipart/form-data body, next to a "payload" field
+        holding the usual JSON request without init_images and mask"""
+
+        form = await request.form()
+        try:
+            payload = json.loads(form.get("payload") or "{}")
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail="payload must be JSON") from e
+
+        async def file_contents(field):
+            # files become raw bytes; plain form fields are left as base64 strings or URLs
+            return await field.read() if hasattr(field, "read") else field
+
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=422, detail="payload must be a JSON object")
+
+        try:
+            img2imgreq = models.StableDiffusionImg2ImgProcessingAPI(**payload)
+        except ValidationError as e:
+            # the same 422 response that FastAPI gives for an invalid JSON body
+            raise RequestValidationError(e.raw_errors, body=payload) from e
+
+        img2imgreq.init_images = [await file_contents(x) for x in form.getlist("init_images")] or img2imgreq.init_images
+        if form.get("mask") is not None:
+            img2imgreq.mask = await file_contents(form["mask"])
+
+        # uploaded files can not go back into a JSON response
+        img2imgreq.include_init_images = False
+
+        return await run_in_threadpool(self.img2imgapi, img2imgreq, response_format)
+
+    def submit_txt2img_job(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+        """Queues txt2img and returns right away; poll /sdapi/v2/jobs/{id_task} and fetch the images from /sdapi/v2/jobs/{id_task}/result"""
+        self.admission.check(txt2imgreq, memory=self.worker_pool is None)
+        txt2imgreq.force_task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
+
+        def run():
+            processed = self.process_txt2img(txt2imgreq)
+            return {
+                "images": list(images.encode_in_parallel(encode_pil_to_bytes, processed.images)) if txt2imgreq.send_images else [],
+                "parameters": jsonable_encoder(vars(txt2imgreq)),
+                "info": processed.js(),
+            }
+
+        self.job_store.submit(txt2imgreq.force_task_id, run)
+        return models.JobSubmitResponse(id_task=txt2imgreq.force_task_id)
+
+    def submit_img2img_job(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+        """img2img counterpart of submit_txt2img_job"""
+        self.admission.check(img2imgreq, memory=self.worker_pool is None)
+        img2imgreq.force_task_id = img2imgreq.force_task_id or create_task_id("img2img")
+
+        def run():
+            processed = self.process_img2img(img2imgreq)
+
+            if not img2imgreq.include_init_images:
+                img2imgreq.init_images = None
+                img2imgreq.mask = None
+
+            return {
+                "images": list(images.encode_in_parallel(encode_pil_to_bytes, processed.images)) if img2imgreq.send_images else [],
+                "parameters": jsonable_encoder(vars(img2imgreq)),
+                "info": processed.js(),
+            }
+
+        self.job_store.submit(img2imgreq.force_task_id, run, kind="img2img")
+        return models.JobSubmitResponse(id_task=img2imgreq.force_task_id)
+
+    def find_job(self, id_task):
+        entry = self.job_store.get(id_task)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Job {id_task} not found; it may have expired")
+
+        return entry
+
+    def get_job(self, id_task: str, live_preview: bool = False):
+        entry = self.find_job(id_task)
+        status = entry["status"]
+
+        job_progress = None
+        if status == "queued":
+            job_progress = progress.progressapi(progress.ProgressRequest(id_task=id_task, live_preview=live_preview)).dict()
+
+            if job_progress["active"]:
+                status = "running"
+
+        return models.JobStatusResponse(id_task=id_task, status=status, created=entry.get("created"), finished=entry.get("finished"), error=entry.get("error"), progress=job_progress)
+
+    def get_job_result(self, id_task: str, response_format: Optional[str] = None):
+        entry = self.find_job(id_task)
+
+        if entry["status"] == "failed":
+            raise HTTPException(status_code=500, detail=entry.get("error"))
+        if entry["status"] != "done":
+            raise HTTPException(status_code=409, detail=f"Job {id_task} has not finished yet")
+
+        if response_format is not None:
+            return binary_images_response(entry["images"], response_format, {"parameters": entry["parameters"], "info": entry["info"]})
+
+        b64images = list(images.encode_in_parallel(encode_pil_to_base64, entry["images"]))
+        response = models.ImageToImageResponse if entry.get("kind") == "img2img" else models.TextToImageResponse
+
+        return response(images=b64images, parameters=entry["parameters"], info=entry["info"])
+
+    def delete_job(self, id_task: str):
+        """Deletes a job; one that is still waiting is taken out of the queue, a running one is interrupted"""
+        self.find_job(id_task)
+        self.job_store.delete(id_task)
+
+        queue = self.worker_pool.queue if self.worker_pool is not None else self.queue_lock
+        if not queue.cancel(id_task) and progress.current_task == id_task:
+            shared.state.interrupt()
+
+        return {}
 
     def extras_single_image_api(self, req: models.ExtrasSingleImageRequest):
         reqDict = setUpscalers(req)
@@ -583,7 +865,7 @@ class Api:
         with self.queue_lock:
             result = postprocessing.run_extras(extras_mode=1, image_folder=image_folder, image="", input_dir="", output_dir="", save_output=False, **reqDict)
 
-        return models.ExtrasBatchImagesResponse(images=list(map(encode_pil_to_base64, result[0])), html_info=result[1])
+        return models.ExtrasBatchImagesResponse(images=list(images.encode_in_parallel(encode_pil_to_base64, result[0])), html_info=result[1])
 
     def pnginfoapi(self, req: models.PNGInfoRequest):
         image = decode_base64_to_image(req.image.strip())
@@ -622,8 +904,9 @@ class Api:
         shared.state.set_current_image()
 
         current_image = None
-        if shared.state.current_image and not req.skip_current_image:
-            current_image = encode_pil_to_base64(shared.state.current_image)
+        encoded = shared.state.current_image_base64() if not req.skip_current_image else None
+        if encoded is not None:
+            _, current_image = encoded
 
         return models.ProgressResponse(progress=progress, eta_relative=eta_relative, state=shared.state.dict(), current_image=current_image, textinfo=shared.state.textinfo, current_task=current_task)
 
@@ -667,6 +950,9 @@ class Api:
     def get_config(self):
         options = {}
         for key in shared.opts.data.keys():
+            if key in shared_options.secret_opts:
+                continue
+
             metadata = shared.opts.data_labels.get(key)
             if(metadata is not None):
                 options.update({key: shared.opts.data.get(key, shared.opts.data_labels.get(key).default)})
@@ -883,6 +1169,22 @@ class Api:
             cuda = {'error': f'{err}'}
         return models.MemoryResponse(ram=ram, cuda=cuda)
 
+    def get_workers(self):
+        if self.worker_pool is None:
+            return []
+
+        return [models.WorkerItem(**x) for x in self.worker_pool.info()]
+
+    def get_hashing(self):
+        return [models.HashingItem(**x) for x in hashes.service.progress()]
+
+    def get_checkpoint_cache(self):
+        return models.CheckpointCacheResponse(**sd_models_cache.checkpoints.info())
+
+    def get_metrics(self):
+        """Queue, stage timings, sampling speed, memory, model loads and cache hits in the Prometheus text format"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
     def get_extensions_list(self):
         from modules import extensions
         extensions.list_extensions()
@@ -902,6 +1204,28 @@ class Api:
                 })
         return ext_list
 
+    async def enhance_prompt(self, req: models.EnhancePromptRequest):
+        from modules import chatgpt_integration
+
+        # awaited on the event loop, so waiting on OpenAI does not take up a threadpool slot
+        enhanced = await chatgpt_integration.get_chatgpt_instance().enhance_prompt_async(req.prompt, req.style_preference, req.enhancement_percentage)
+
+        return models.EnhancePromptResponse(prompt=enhanced)
+
+    async def enhance_prompts(self, req: models.EnhancePromptsRequest):
+        from modules import chatgpt_integration
+
+        items = await chatgpt_integration.get_chatgpt_instance().enhance_prompts_async(req.prompts, req.style_preference, req.enhancement_percentage)
+
+        return models.EnhancePromptsResponse(items=items)
+
+    def get_enhance_prompt_stats(self):
+        from modules import chatgpt_integration
+
+        instance = chatgpt_integration.get_chatgpt_instance()
+
+        return models.EnhancePromptStatsResponse(cache=instance.get_cache_stats(), requests=instance.get_request_stats())
+
     def launch(self, server_name, port, root_path):
         self.app.include_router(self.router)
         uvicorn.run(
@@ -0,0 +1,136 @@
+import copy
+import json
+import threading
+
+from modules import processing, progress, shared
+
+
+class Group:
+    def __init__(self, key):
+        self.key = key
+        self.requests = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+def split_processed(processed, index):
+    """Processed for a single image of a batch, as if that image had been generated on its own"""
+    res = copy.copy(processed)
+
+    res.images = [processed.images[processed.index_of_first_image + index]]
+    res.all_prompts = [processed.all_prompts[index]]
+    res.all_negative_prompts = [processed.all_negative_prompts[index]]
+    res.all_seeds = [processed.all_seeds[index]]
+    res.all_subseeds = [processed.all_subseeds[index]]
+    res.infotexts = [processed.infotexts[processed.index_of_first_image + index]]
+    res.prompt = res.all_prompts[0]
+    res.negative_prompt = res.all_negative_prompts[0]
+    res.seed = res.all_seeds[0]
+    res.subseed = res.all_subseeds[0]
+    res.info = res.infotexts[0]
+    res.batch_size = 1
+    res.index_of_first_image = 0
+
+    return res
+
+
+class Txt2ImgBatcher:
+    """Merges single-image txt2img API requests that differ only in prompts and seeds into one batch.
+
+    The first request of a kind waits for api_txt2img_batch_window_ms (or until the batch is full) for others to join,
+    then runs them all with one process_images call, using lists for prompts and seeds, and gives every request
+    its own image, seeds and infotext."""
+
+    batch_fields = {"prompt", "negative_prompt", "seed", "subseed", "force_task_id"}
+    """fields that can differ between requests in one batch"""
+
+    def __init__(self, run):
+        self.run = run
+        """function that runs a txt2img request and returns Processed"""
+
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def window(self):
+        return getattr(shared.opts, "api_txt2img_batch_window_ms", 0) / 1000
+
+    def max_batch_size(self):
+        return max(getattr(shared.opts, "api_txt2img_batch_max_size", 8), 1)
+
+    def accepts(self, req):
+        if self.window() <= 0 or self.max_batch_size() < 2:
+            return False
+
+        # saved batches would also save a grid
+        return req.batch_size == 1 and req.n_iter == 1 and not req.save_images and not req.script_name and not req.alwayson_scripts
+
+    def key(self, req):
+        return json.dumps(req.dict(exclude=self.batch_fields), sort_keys=True, default=str)
+
+    def submit(self, req):
+        """Runs req as part of a batch; returns its own Processed"""
+        key = self.key(req)
+
+        with self.lock:
+            group = self.groups.get(key)
+            leader = group is None
+            if leader:
+                group = self.groups[key] = Group(key)
+
+            index = len(group.requests)
+            group.requests.append(req.copy(update={"seed": processing.get_fixed_seed(req.seed), "subseed": processing.get_fixed_seed(req.subseed)}))
+
+            if len(group.requests) >= self.max_batch_size():
+                self.close(group)
+
+        if leader:
+            group.full.wait(self.window())
+
+            with self.lock:
+                self.close(group)
+
+            self.run_group(group)
+        else:
+            id_task = req.force_task_id or progress.create_task_id("txt2img")
+            progress.add_task_to_queue(id_task)
+            try:
+                group.done.wait()
+            finally:
+                progress.remove_task_from_queue(id_task)
+                progress.finish_task(id_task)
+
+        if group.error is not None:
+            raise group.error
+
+        return group.results[index]
+
+    def close(self, group):
+        """Stops group from taking more requests; call with self.lock held"""
+        if self.groups.get(group.key) is group:
+            del self.groups[group.key]
+
+        group.full.set()
+
+    def run_group(self, group):
+        requests = group.requests
+        try:
+            if len(requests) == 1:
+                group.results = [self.run(requests[0])]
+                return
+
+            batch = requests[0].copy(update={
+                "prompt": [x.prompt for x in requests],
+                "negative_prompt": [x.negative_prompt for x in requests],
+                "seed": [x.seed for x in requests],
+                "subseed": [x.subseed for x in requests],
+                "batch_size": len(requests),
+            })
+
+            processed = self.run(batch)
+            group.results = [split_processed(processed, i) for i in range(len(requests))]
+        except Exception as e:
+            group.error = e
+        finally:
+            group.done.set()
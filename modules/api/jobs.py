@@ -0,0 +1,87 @@
+import contextvars
+import threading
+import time
+
+from modules import cache, errors, shared
+
+
+class JobStore:
+    """Jobs submitted through /sdapi/v2/jobs and their results.
+
+    Entries are kept in a disk cache with a TTL, so that results can be fetched long after the job is done, also after
+    a restart; unlike progress.recorded_results, which only holds the last two results of UI jobs in memory."""
+
+    def __init__(self, subsection="api-jobs"):
+        self.subsection = subsection
+        self.lock = threading.Lock()
+
+        self.active = set()
+        """ids of jobs started by this process that have not finished yet"""
+
+        self.deleted = set()
+        """ids of active jobs that were deleted; they are not stored when they finish"""
+
+    def storage(self):
+        return cache.cache(self.subsection)
+
+    def ttl(self):
+        hours = getattr(shared.opts, "api_jobs_ttl_hours", 24)
+        return hours * 3600 if hours > 0 else None
+
+    def put(self, id_task, entry):
+        self.storage().set(id_task, entry, expire=self.ttl())
+
+    def get(self, id_task):
+        entry = self.storage().get(id_task)
+        if entry is None:
+            return None
+
+        with self.lock:
+            lost = entry["status"] == "queued" and id_task not in self.active
+
+        if lost:
+            return {**entry, "status": "failed", "error": "The server was restarted before the job finished"}
+
+        return entry
+
+    def delete(self, id_task):
+        with self.lock:
+            if id_task in self.active:
+                self.deleted.add(id_task)
+
+            return self.storage().delete(id_task)
+
+    def submit(self, id_task, func, kind="txt2img"):
+        """Runs func in a new thread and stores what it returns: a dict with images (list of bytes), parameters and info.
+        kind, txt2img or img2img, is kept with the job for the shape of its result.
+
+        The thread gets a copy of the caller's context, so the job keeps the priority and client of the request."""
+
+        with self.lock:
+            self.active.add(id_task)
+
+        self.put(id_task, {"status": "queued", "kind": kind, "created": time.time()})
+
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(self.run, id_task, func), name=f"job {id_task}", daemon=True)
+        thread.start()
+
+    def run(self, id_task, func):
+        entry = self.storage().get(id_task) or {"created": time.time()}
+
+        try:
+            result = func()
+            entry = {**entry, **result, "status": "done"}
+        except Exception as e:
+            if id_task not in self.deleted:
+                errors.display(e, f"API job {id_task}")
+            entry = {**entry, "status": "failed", "error": getattr(e, "detail", None) or str(e) or type(e).__name__}
+        finally:
+            entry["finished"] = time.time()
+
+            with self.lock:
+                self.active.discard(id_task)
+                if id_task in self.deleted:
+                    self.deleted.discard(id_task)
+                else:
+                    self.put(id_task, entry)
@@ -190,7 +190,7 @@ class ProgressResponse(BaseModel):
     progress: float = Field(title="Progress", description="The progress with a range of 0 to 1")
     eta_relative: float = Field(title="ETA in secs")
     state: dict = Field(title="State", description="The current state snapshot")
-    current_image: str = Field(default=None, title="Current image", description="The current image in base64 format. opts.show_progress_every_n_steps is required for this to work.")
+    current_image: str = Field(default=None, title="Current image", description="The current image in base64 format, in the live preview file format. opts.show_progress_every_n_steps is required for this to work.")
     textinfo: str = Field(default=None, title="Info text", description="Info text used by WebUI.")
 
 class InterrogateRequest(BaseModel):
@@ -294,6 +294,39 @@ class EmbeddingsResponse(BaseModel):
     loaded: dict[str, EmbeddingItem] = Field(title="Loaded", description="Embeddings loaded for the current model")
     skipped: dict[str, EmbeddingItem] = Field(title="Skipped", description="Embeddings skipped for the current model (likely due to architecture incompatibility)")
 
+class WorkerItem(BaseModel):
+    index: int = Field(title="Index")
+    device: str = Field(title="Device")
+    ready: bool = Field(title="Ready", description="Whether the worker has finished starting up")
+    alive: bool = Field(title="Alive")
+    busy: bool = Field(title="Busy", description="Whether the worker is running a job now")
+    checkpoint: Optional[str] = Field(title="Checkpoint", description="Checkpoint loaded in the worker")
+    jobs: int = Field(title="Jobs", description="Jobs run since startup")
+    swaps: int = Field(title="Swaps", description="Jobs that needed a different checkpoint than the one loaded")
+
+class HashingItem(BaseModel):
+    filename: str = Field(title="Filename")
+    title: str = Field(title="Title", description="Name of the hash in the cache")
+    priority: str = Field(title="Priority", description="load, wait or background")
+    status: str = Field(title="Status", description="queued, running or paused")
+    bytes: int = Field(title="Bytes", description="Bytes hashed so far")
+    size: int = Field(title="Size", description="Size of the file, once hashing has started")
+
+class CheckpointCacheItem(BaseModel):
+    title: str = Field(title="Title")
+    filename: str = Field(title="Filename")
+    bytes: int = Field(title="Bytes", description="Size of the weights")
+    mapped: bool = Field(title="Mapped", description="Whether the weights are a memory-mapped view of the file rather than a copy in RAM")
+    hits: int = Field(title="Hits", description="Times the checkpoint was loaded from the cache")
+    added: float = Field(title="Added", description="When the checkpoint was cached, as a unix timestamp")
+    last_used: float = Field(title="Last used", description="When the checkpoint was cached or last loaded from the cache, as a unix timestamp")
+
+class CheckpointCacheResponse(BaseModel):
+    budget: int = Field(title="Budget", description="Bytes the cache may hold; 0 if it is only limited by count or disabled")
+    used: int = Field(title="Used", description="Bytes counted against the budget: checkpoints held as copies in RAM, and tensors of mapped checkpoints that had to be copied")
+    mapped: int = Field(title="Mapped", description="Bytes of cached checkpoints that are memory-mapped views, which do not count against the budget")
+    entries: list[CheckpointCacheItem] = Field(title="Entries", description="Cached checkpoints, most recently used first")
+
 class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
@@ -327,3 +360,38 @@ class ExtensionItem(BaseModel):
     version: str = Field(title="Version", description="Extension Version")
     commit_date: str = Field(title="Commit Date", description="Extension Repository Commit Date")
     enabled: bool = Field(title="Enabled", description="Flag specifying whether this extension is enabled")
+
+class EnhancePromptRequest(BaseModel):
+    prompt: str = Field(title="Prompt", description="Prompt to enhance")
+    style_preference: str = Field(default="photorealistic", title="Style preference", description="Style to steer the enhancement towards (photorealistic, artistic, anime, etc.)")
+    enhancement_percentage: int = Field(default=50, title="Enhancement percentage", description="Enhancement intensity, 10-100")
+
+class EnhancePromptResponse(BaseModel):
+    prompt: str = Field(title="Prompt", description="Enhanced prompt, or an error message")
+
+class EnhancePromptStatsResponse(BaseModel):
+    cache: dict = Field(title="Cache", description="Hit/miss counters of the enhanced prompt cache since startup")
+    requests: dict = Field(title="Requests", description="Calls that shared an identical request already in progress (coalesced) since startup, and requests in progress now")
+
+class EnhancePromptsRequest(BaseModel):
+    prompts: list[str] = Field(title="Prompts", description="Prompts to enhance")
+    style_preference: str = Field(default="photorealistic", title="Style preference", description="Style to steer the enhancement towards (photorealistic, artistic, anime, etc.)")
+    enhancement_percentage: int = Field(default=50, title="Enhancement percentage", description="Enhancement intensity, 10-100")
+
+class EnhancePromptsItem(BaseModel):
+    prompt: Optional[str] = Field(default=None, title="Prompt", description="Enhanced prompt; null if enhancing this prompt failed")
+    error: Optional[str] = Field(default=None, title="Error", description="Why enhancing this prompt failed")
+
+class EnhancePromptsResponse(BaseModel):
+    items: list[EnhancePromptsItem] = Field(title="Items", description="One item for every prompt in the request, in the same order")
+
+class JobSubmitResponse(BaseModel):
+    id_task: str = Field(title="Task ID", description="Use it to get the status and the result of the job")
+
+class JobStatusResponse(BaseModel):
+    id_task: str = Field(title="Task ID")
+    status: str = Field(title="Status", description="queued, running, done or failed")
+    created: float = Field(default=None, title="Created", description="When the job was submitted, as a unix timestamp")
+    finished: float = Field(default=None, title="Finished", description="When the job finished, as a unix timestamp")
+    error: str = Field(default=None, title="Error", description="Why the job failed")
+    progress: dict = Field(default=None, title="Progress", description="Progress of a queued or running job, as returned by /internal/progress")
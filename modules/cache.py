@@ -6,6 +6,7 @@ import threading
 import diskcache
 import tqdm
 
+from modules import metrics
 from modules.paths import data_path, script_path
 
 cache_filename = os.environ.get('SD_WEBUI_CACHE_FILE', os.path.join(data_path, "cache.json"))
@@ -20,10 +21,10 @@ def dump_cache():
     pass
 
 
-def make_cache(subsection: str) -> diskcache.Cache:
+def make_cache(subsection: str, size_limit: int = 2**32) -> diskcache.Cache:
     return diskcache.Cache(
         os.path.join(cache_dir, subsection),
-        size_limit=2**32,  # 4 GB, culling oldest first
+        size_limit=size_limit,  # 4 GB by default, culling oldest first
         disk_min_file_size=2**18,  # keep up to 256KB in Sqlite
     )
 
@@ -53,28 +54,32 @@ def convert_old_cached_data():
                 progress.update(1)
 
 
-def cache(subsection):
+def cache(subsection, size_limit=None):
     """
     Retrieves or initializes a cache for a specific subsection.
 
     Parameters:
         subsection (str): The subsection identifier for the cache.
+        size_limit (int): If set, the maximum size of the subsection on disk, in bytes; oldest entries are culled first.
 
     Returns:
         diskcache.Cache: The cache data for the specified subsection.
     """
 
     cache_obj = caches.get(subsection)
-    if not cache_obj:
+    if cache_obj is None:
         with cache_lock:
             if not os.path.exists(cache_dir) and os.path.isfile(cache_filename):
                 convert_old_cached_data()
 
             cache_obj = caches.get(subsection)
-            if not cache_obj:
-                cache_obj = make_cache(subsection)
+            if cache_obj is None:
+                cache_obj = make_cache(subsection) if size_limit is None else make_cache(subsection, size_limit=size_limit)
                 caches[subsection] = cache_obj
 
+    if size_limit is not None and cache_obj.size_limit != size_limit:
+        cache_obj.reset('size_limit', size_limit)
+
     return cache_obj
 
 
@@ -110,6 +115,8 @@ def cached_data_for_file(subsection, title, filename, func):
         if ondisk_mtime > cached_mtime:
             entry = None
 
+    metrics.cache_lookup(subsection, hit=bool(entry) and 'value' in entry)
+
     if not entry or 'value' not in entry:
         value = func()
         if value is None:
@@ -1,11 +1,32 @@
+import contextlib
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import html
+import inspect
+import re
+import threading
 import time
 
-from modules import shared, progress, errors, devices, fifo_lock, profiling
+from modules import shared, progress, errors, devices, job_scheduler, profiling
 
-queue_lock = fifo_lock.FIFOLock()
+
+
+def loaded_checkpoints():
+    from modules import sd_models
+
+    return [x.sd_checkpoint_info.title for x in sd_models.model_data.loaded_sd_models]
+
+
+queue_lock = job_scheduler.JobScheduler(
+    max_depth=lambda: getattr(shared.opts, "queue_max_depth", 0),
+    affinity_window=lambda: getattr(shared.opts, "queue_affinity_window", 0),
+    loaded_checkpoints=loaded_checkpoints,
+)
+
+remote_call_executor = None
+remote_call_executor_lock = threading.Lock()
+remote_call_slots = None
 
 
 def wrap_queued_call(func):
@@ -18,6 +39,97 @@ def wrap_queued_call(func):
     return f
 
 
+re_lora = re.compile(r"<lora:([^:>]+)")
+
+
+def model_key(prompt="", override_settings=None):
+    """(checkpoint, VAE, LoRAs) a job will run with; queue_lock uses it to group jobs that need the same models"""
+    from modules import sd_models
+
+    override_settings = override_settings or {}
+
+    checkpoint = override_settings.get("sd_model_checkpoint") or shared.opts.sd_model_checkpoint
+    checkpoint_info = sd_models.get_closet_checkpoint_match(checkpoint) if checkpoint else None
+    vae = override_settings.get("sd_vae") or shared.opts.sd_vae
+    prompts = prompt if isinstance(prompt, list) else [prompt or ""]
+    loras = tuple(sorted({name for x in prompts for name in re_lora.findall(x)}))
+
+    return checkpoint_info.title if checkpoint_info is not None else checkpoint, vae, loras
+
+
+@contextlib.contextmanager
+def queued_task(id_task, lock=None, model=None):
+    """Holds queue_lock for a job; a job with a task id is listed in progress.pending_tasks while it waits"""
+
+    lock = lock or queue_lock
+
+    if id_task is not None:
+        progress.add_task_to_queue(id_task)
+    try:
+        lock.acquire(id_task=id_task, model=model)
+    except (job_scheduler.QueueFullError, job_scheduler.JobCancelledError):
+        if id_task is not None:
+            progress.remove_task_from_queue(id_task)
+        raise
+
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def get_remote_call_executor():
+    """Returns the thread pool used for calls that wait on remote services (such as ChatGPT) instead of the GPU.
+
+    The pool and remote_call_slots, which limits how many such calls (streams included) are in progress at once, are
+    sized by the chatgpt_concurrency_limit setting when they are first created."""
+
+    global remote_call_executor, remote_call_slots
+
+    with remote_call_executor_lock:
+        if remote_call_executor is None:
+            max_workers = max(1, int(shared.opts.chatgpt_concurrency_limit if shared.opts is not None else 4))
+            remote_call_slots = threading.BoundedSemaphore(max_workers)
+            remote_call_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="remote_call")
+
+    return remote_call_executor
+
+
+def wrap_remote_call(func):
+    """Like wrap_queued_call, but runs func on the remote call pool without taking queue_lock, so that generation
+    jobs are not kept waiting while a network request is in progress.
+
+    Each call holds one of remote_call_slots until it returns, or, for a generator, until it is exhausted or closed; the
+    slot is taken before anything is submitted to the pool, so calls waiting for a slot never occupy its threads."""
+
+    if inspect.isgeneratorfunction(func):
+        # streaming functions: every step of the generator runs on the pool; gradio only sees a generator
+        @wraps(func)
+        def g(*args, **kwargs):
+            executor = get_remote_call_executor()
+            with remote_call_slots:
+                gen = func(*args, **kwargs)
+                try:
+                    while True:
+                        res = executor.submit(next, gen, StopIteration).result()
+                        if res is StopIteration:
+                            return
+
+                        yield res
+                finally:
+                    gen.close()
+
+        return g
+
+    @wraps(func)
+    def f(*args, **kwargs):
+        executor = get_remote_call_executor()
+        with remote_call_slots:
+            return executor.submit(func, *args, **kwargs).result()
+
+    return f
+
+
 def wrap_gradio_gpu_call(func, extra_outputs=None):
     @wraps(func)
     def f(*args, **kwargs):
@@ -25,11 +137,10 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         # if the first argument is a string that says "task(...)", it is treated as a job id
         if args and type(args[0]) == str and args[0].startswith("task(") and args[0].endswith(")"):
             id_task = args[0]
-            progress.add_task_to_queue(id_task)
         else:
             id_task = None
 
-        with queue_lock:
+        with queued_task(id_task):
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
 
@@ -4,130 +4,178 @@ Provides prompt enhancement and image improvement features
 """
 
 import os
-import sys
+import asyncio
+import importlib.util
+import threading
 import requests
+import requests.adapters
+import httpx
 import json
 import base64
+import hashlib
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional, Dict, Any
 import gradio as gr
 
+from modules import cache, local_llm, rate_limiter, shared
+
+openai_url = "https://api.openai.com/v1/chat/completions"
+
+# Where enhancement requests go, selected with the chatgpt_backend setting
+backend_openai = "OpenAI"
+backend_server = "OpenAI-compatible server"
+backend_local = "Local model (CPU)"
+
+# Bump when the system prompts or response handling change, so that cached enhancements made with the old prompts are not reused
+prompt_cache_version = 1
+
+
+def _opt(name, default):
+    """Read a setting, falling back to default when settings are not loaded (standalone scripts, tests)"""
+    return getattr(shared.opts, name, default) if shared.opts is not None else default
+
+
+def find_api_key() -> Optional[str]:
+    """OpenAI API key from --openai-api-key, the OPENAI_API_KEY environment variable or the chatgpt_api_key setting, in
+    that order; None if none of them is set"""
+    for api_key in (getattr(shared.cmd_opts, "openai_api_key", None), os.getenv("OPENAI_API_KEY"), _opt("chatgpt_api_key", "")):
+        if api_key and api_key.strip():
+            return api_key.strip()
+
+    return None
+
+
+def _skip_validation() -> bool:
+    return getattr(shared.cmd_opts, "skip_chatgpt_validation", False)
+
+
+validation_messages = {
+    "missing": "❌ OpenAI API key is not configured",
+    "local": "✅ Using a local model; no API key needed",
+    "pending": "⏳ Checking OpenAI API key...",
+    "unchecked": "OpenAI API key has not been checked yet; it is checked by the first request",
+    "valid": "✅ OpenAI API key is valid",
+    "invalid": "❌ OpenAI API key was rejected (401 Unauthorized)",
+    "unreachable": "⚠️ Could not reach OpenAI to check the API key; it is checked again by the first request",
+}
+
+
+def iter_sse_deltas(lines):
+    """Yields the pieces of text from the server-sent events of a streaming chat completion, given the lines of the response"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+
+        if not line.startswith("data:"):
+            continue  # blank separator lines, comments, event/id fields
+
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise ValueError(chunk["error"].get("message", chunk["error"]) if isinstance(chunk["error"], dict) else chunk["error"])
+
+        for choice in chunk.get("choices", [])[:1]:
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield content
+
+
+def chat_completions_url(base_url: str) -> str:
+    """Accepts both a server's base URL (http://127.0.0.1:8080/v1) and the full chat completions URL"""
+    base_url = base_url.strip().rstrip("/")
+    if base_url.endswith("/chat/completions"):
+        return base_url
+
+    return base_url + "/chat/completions"
+
+
+def create_rate_limiter() -> rate_limiter.RateLimiter:
+    """Rate limiter for OpenAI requests; shared with other webui processes when chatgpt_rate_limit_file is set"""
+    requests_per_minute = _opt("chatgpt_requests_per_minute", 30)
+    filename = _opt("chatgpt_rate_limit_file", "")
+    if filename:
+        return rate_limiter.SqliteRateLimiter(filename, requests_per_minute=requests_per_minute)
+
+    return rate_limiter.RateLimiter(requests_per_minute=requests_per_minute)
+
+
 class ChatGPTIntegration:
-    def __init__(self):
+    def __init__(self, api_key: Optional[str] = None, base_url: str = openai_url, model: str = "gpt-3.5-turbo", local_model: Optional[local_llm.LocalChatModel] = None):
         self.api_key = None
-        self.base_url = "https://api.openai.com/v1/chat/completions"
+        self.base_url = base_url
+        self.model = model
+        self.local_model = local_model
+        """answers requests in-process instead of base_url when set"""
+
         self.headers = {}
-        self.last_request_time = 0
-        self.min_request_interval = 2  # Minimum 2 seconds between requests
-        # Prompt for API key on initialization
-        self._prompt_api_key()
-    
-    def _prompt_api_key(self) -> None:
-        """Prompt user to enter OpenAI API key interactively"""
-        # First, try to get from environment variable
-        api_key = os.getenv("OPENAI_API_KEY")
-        if api_key and api_key.strip():
-            print("\n" + "="*60)
-            print("🤖 ChatGPT Integration - Using API key from environment variable")
-            print("="*60)
-            if self._validate_api_key(api_key.strip()):
-                self.api_key = api_key.strip()
-                self.headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-                print("✅ API key validated successfully!")
-                print("="*60 + "\n")
-                return
-            else:
-                print("❌ API key from environment variable is invalid. Please enter a new one.\n")
-        
-        # Check if we're in an interactive terminal
-        if not sys.stdin.isatty():
-            # Not in interactive terminal (e.g., running as service or in web UI)
-            print("\n" + "="*60)
-            print("🤖 ChatGPT Integration - API Key Required")
-            print("="*60)
-            print("⚠️  Running in non-interactive mode.")
-            print("Please set your OpenAI API key using one of these methods:")
-            print("1. Set environment variable: OPENAI_API_KEY=your_key_here")
-            print("2. Use the API key input in the web UI (if available)")
-            print("3. Restart in interactive terminal mode")
-            print("="*60 + "\n")
-            return  # Don't block startup, allow setting later
-        
-        # Interactive terminal - prompt for API key
-        print("\n" + "="*60)
-        print("🤖 ChatGPT Integration - API Key Required")
-        print("="*60)
-        print("Please enter your OpenAI API key.")
-        print("You can get your API key from: https://platform.openai.com/api-keys")
-        print("The API key will be stored in memory only (not saved to disk).")
-        print("(Press ESC or Ctrl+C to skip - prompt enhancement will be disabled)")
-        print("-"*60)
-        
-        try:
-            while True:
-                try:
-                    api_key = input("Enter your OpenAI API key (or press ESC to skip): ").strip()
-                except KeyboardInterrupt:
-                    # Handle Ctrl+C
-                    raise
-                except EOFError:
-                    # Handle ESC or EOF
-                    print("\n⚠️  API key input skipped. Prompt enhancement feature will be disabled.")
-                    print("You can set your API key later using:")
-                    print("   - Environment variable: OPENAI_API_KEY=your_key_here")
-                    print("   - Or restart the application in interactive mode")
-                    print("="*60 + "\n")
-                    return
-                
-                # Check for ESC key (if input is empty and user pressed ESC)
-                if not api_key:
-                    response = input("No API key entered. Skip ChatGPT integration? (y/n): ").strip().lower()
-                    if response == 'y':
-                        print("\n⚠️  API key skipped. Prompt enhancement feature will be disabled.")
-                        print("You can set your API key later using:")
-                        print("   - Environment variable: OPENAI_API_KEY=your_key_here")
-                        print("   - Or restart the application in interactive mode")
-                        print("="*60 + "\n")
-                        return
-                    continue
-                
-                # Basic validation - OpenAI API keys typically start with 'sk-'
-                if not api_key.startswith('sk-'):
-                    response = input("⚠️  Warning: API key doesn't start with 'sk-'. Continue anyway? (y/n): ").strip().lower()
-                    if response != 'y':
-                        continue
-                
-                # Test the API key by making a simple request
-                print("\n🔍 Validating API key...")
-                if self._validate_api_key(api_key):
-                    self.api_key = api_key
-                    self.headers = {
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                    print("✅ API key validated successfully!")
-                    print("✨ Prompt enhancement feature is now enabled!")
-                    print("="*60 + "\n")
-                    return
-                else:
-                    print("❌ Invalid API key. Please check your API key and try again.\n")
-                    response = input("Skip API key setup? (y/n): ").strip().lower()
-                    if response == 'y':
-                        print("\n⚠️  API key skipped. Prompt enhancement feature will be disabled.")
-                        print("="*60 + "\n")
-                        return
-        except (KeyboardInterrupt, EOFError):
-            print("\n⚠️  API key input cancelled. Prompt enhancement feature will be disabled.")
-            print("You can set your API key later using:")
-            print("   - Environment variable: OPENAI_API_KEY=your_key_here")
-            print("   - Or restart the application in interactive mode")
-            print("="*60 + "\n")
+        self.rate_limiter = create_rate_limiter()
+        self.request_timeout = 30
+
+        # Keep-alive connection pools, so repeated requests skip the TCP+TLS handshake
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.async_client = None
+        self.async_client_loop = None
+
+        self.stats_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.in_flight = {}
+        """cache key -> Future with the result, for requests that are being made right now"""
+
+        self.coalesced_calls = 0
+
+        self.validation_status = "missing"
+        """one of the keys of validation_messages"""
+
+        self.validation_thread = None
+
+        if api_key is not None:
+            # Key supplied by the caller (tests, scripts) - use it as is, without prompting or validation
+            self._set_api_key(api_key)
+            self.validation_status = "unchecked" if local_model is None else "local"
+            return
+
+        # the key comes from the command line, the environment or settings, so startup never waits for input; it is
+        # checked in the background
+        api_key = find_api_key()
+        if api_key is None:
+            print("ChatGPT integration: no OpenAI API key; set it in Settings → Prompt enhancement, with --openai-api-key or in the OPENAI_API_KEY environment variable")
+            return
+
+        self._set_api_key(api_key)
+        self.start_validation()
+
+    def _set_api_key(self, api_key: str) -> None:
+        self.api_key = api_key
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
     
-    def _validate_api_key(self, api_key: str) -> bool:
-        """Validate API key by making a test request"""
+    def reload_api_key(self) -> None:
+        """Uses the key from find_api_key if it changed, as after the chatgpt_api_key setting is changed"""
+        api_key = find_api_key()
+        if api_key == self.api_key:
+            return
+
+        if api_key is None:
+            self.api_key = None
+            self.headers = {}
+            self.validation_status = "missing"
+            return
+
+        self._set_api_key(api_key)
+        self.start_validation()
+
+    def _check_api_key(self, api_key: str) -> str:
+        """Check API key by making a test request; returns "valid", "invalid" or "unreachable"."""
         try:
             test_headers = {
                 "Authorization": f"Bearer {api_key}",
@@ -135,11 +183,11 @@ class ChatGPTIntegration:
             }
             # Make a minimal test request
             test_payload = {
-                "model": "gpt-3.5-turbo",
+                "model": self.model,
                 "messages": [{"role": "user", "content": "test"}],
                 "max_tokens": 5
             }
-            response = requests.post(
+            response = self.session.post(
                 self.base_url, 
                 headers=test_headers, 
                 json=test_payload, 
@@ -147,32 +195,77 @@ class ChatGPTIntegration:
             )
             
             if response.status_code == 200:
-                return True
+                return "valid"
             elif response.status_code == 401:
                 print("   Error: Invalid API key (401 Unauthorized)")
-                return False
+                return "invalid"
             elif response.status_code == 429:
                 print("   Warning: Rate limited, but API key appears valid")
-                return True  # Rate limit means key is valid
+                return "valid"  # Rate limit means key is valid
             else:
                 print(f"   Warning: Unexpected response ({response.status_code}), but continuing...")
-                return True  # Assume valid if not 401
+                return "valid"  # Assume valid if not 401
         except requests.exceptions.RequestException as e:
             print(f"   Error: Could not validate API key - {str(e)}")
-            return False
-    
+            return "unreachable"
+
+    def start_validation(self) -> None:
+        """Check the API key in a background thread; with --skip-chatgpt-validation the key is left to the first real request"""
+        if self.local_model is not None:
+            self.validation_status = "local"
+            return
+
+        if _skip_validation():
+            self.validation_status = "unchecked"
+            return
+
+        api_key = self.api_key
+        self.validation_status = "pending"
+
+        def validate():
+            status = self._check_api_key(api_key)
+            with self.stats_lock:
+                if self.api_key != api_key or self.validation_status != "pending":
+                    return  # key was replaced, or a real request already found out
+
+                self.validation_status = status
+
+            print(f"ChatGPT integration: {validation_messages[status]}")
+
+        self.validation_thread = threading.Thread(target=validate, name="chatgpt_key_validation", daemon=True)
+        self.validation_thread.start()
+
+    def _note_key_status(self, status_code: int) -> None:
+        """Let responses to real requests settle the key status, for when validation was skipped or has not finished"""
+        if status_code == 401:
+            status = "invalid"
+        elif status_code < 400 or status_code == 429:
+            status = "valid"
+        else:
+            return
+
+        with self.stats_lock:
+            self.validation_status = status
+
+    def get_validation_status(self) -> str:
+        """Human-readable state of the API key check, for the UI"""
+        return validation_messages[self.validation_status]
+
     def set_api_key(self, api_key: str) -> bool:
         """Set API key programmatically (for UI updates)"""
         if not api_key or not api_key.strip():
             return False
         
         api_key = api_key.strip()
-        if self._validate_api_key(api_key):
-            self.api_key = api_key
-            self.headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+        if _skip_validation():
+            self._set_api_key(api_key)
+            self.validation_status = "unchecked"
+            return True
+
+        status = self._check_api_key(api_key)
+        if status != "invalid":
+            self._set_api_key(api_key)
+            self.validation_status = status
             return True
         return False
     
@@ -180,38 +273,180 @@ class ChatGPTIntegration:
         """Check if API key is set"""
         return self.api_key is not None and len(self.api_key) > 0
     
-    def _rate_limit_protection(self):
-        """Ensure minimum time between API requests"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        
-        if time_since_last < self.min_request_interval:
-            sleep_time = self.min_request_interval - time_since_last
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
-    
+    @staticmethod
+    def _estimate_tokens(payload: dict) -> int:
+        """Rough token count of a request as OpenAI charges it against the limit: ~4 characters per prompt token, plus max_tokens"""
+        prompt_chars = sum(len(message.get("content", "")) for message in payload.get("messages", []))
+        return prompt_chars // 4 + payload.get("max_tokens", 0)
+
+    def _rate_limit_delay(self, payload: dict) -> float:
+        """Reserve budget for the request and return how many seconds the caller must wait before sending it"""
+        return self.rate_limiter.reserve(self._estimate_tokens(payload))
+
+    def _rate_limit_protection(self, payload: dict):
+        """Wait until the rate limiter allows sending the request"""
+        wait_time = self._rate_limit_delay(payload)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    async def _rate_limit_protection_async(self, payload: dict):
+        """Same as _rate_limit_protection, but yields to the event loop instead of blocking a thread"""
+        wait_time = self._rate_limit_delay(payload)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+    def _handle_rate_limited(self, response, attempt: int) -> float:
+        """Stop all requests for as long as the server asks to on a 429 response; returns the wait in seconds"""
+        try:
+            wait_time = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            wait_time = min(60, (2 ** attempt) * 5)  # Exponential backoff, max 60 seconds
+
+        self.rate_limiter.block(wait_time)
+        return wait_time
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Return the pooled async client for the running event loop, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_client_loop is not loop:
+            # a client's connection pool belongs to the loop it was created on
+            self.async_client = httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8, keepalive_expiry=60),
+                timeout=self.request_timeout,
+            )
+            self.async_client_loop = loop
+
+        return self.async_client
+
+    async def aclose(self) -> None:
+        """Close the async client and its pooled connections"""
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+            self.async_client_loop = None
+
+    @staticmethod
+    def _cache_key(payload: dict) -> str:
+        """Content address of a request: the model, sampling parameters and the full system and user prompts"""
+        data = json.dumps([prompt_cache_version, payload], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf8")).hexdigest()
+
+    @staticmethod
+    def _prompt_cache():
+        return cache.cache("chatgpt-prompts", size_limit=int(_opt("chatgpt_cache_size_mb", 64) * 1024 * 1024))
+
+    def _cache_get(self, key: str) -> Optional[dict]:
+        if not _opt("chatgpt_cache_enable", True):
+            return None
+
+        result = self._prompt_cache().get(key)
+
+        with self.stats_lock:
+            if result is not None:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+        return result
+
+    def _cache_put(self, key: str, result: dict) -> None:
+        if not _opt("chatgpt_cache_enable", True):
+            return
+
+        ttl_hours = _opt("chatgpt_cache_ttl_hours", 168)
+        self._prompt_cache().set(key, result, expire=ttl_hours * 3600 if ttl_hours > 0 else None)
+
+    def get_cache_stats(self) -> dict:
+        """Hit/miss counters for the enhanced prompt cache since startup"""
+        with self.stats_lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_ratio": self.cache_hits / lookups if lookups else 0.0,
+            }
+
+    def _local_model_result(self, cache_key: str, result: dict) -> dict:
+        if "error" not in result:
+            self._cache_put(cache_key, result)
+
+        return result
+
+    def _join_in_flight(self, cache_key: str) -> tuple:
+        """Single-flight: the first caller of a request gets (future, True) and must make the request and pass the result
+        to _finish_in_flight; callers of an identical request made before that get (future, False) and wait for it"""
+        with self.stats_lock:
+            future = self.in_flight.get(cache_key)
+            if future is not None:
+                self.coalesced_calls += 1
+                return future, False
+
+            future = Future()
+            self.in_flight[cache_key] = future
+            return future, True
+
+    def _finish_in_flight(self, cache_key: str, future: Future, result: Optional[dict]) -> None:
+        with self.stats_lock:
+            if self.in_flight.get(cache_key) is future:
+                del self.in_flight[cache_key]
+
+        if not future.done():
+            future.set_result(result if result is not None else {"error": "Request was cancelled"})
+
+    def get_request_stats(self) -> dict:
+        """Number of calls that were served by an identical request already in progress, since startup"""
+        with self.stats_lock:
+            return {
+                "coalesced": self.coalesced_calls,
+                "in_flight": len(self.in_flight),
+            }
+
     def _make_api_request(self, payload: dict, max_retries: int = 3) -> dict:
         """Make API request with retry logic and rate limiting"""
         if not self.is_api_key_set():
             return {"error": "API key not set. Please configure your OpenAI API key."}
+
+        cache_key = self._cache_key(payload)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        future, leader = self._join_in_flight(cache_key)
+        if not leader:
+            return future.result()
+
+        result = None
+        try:
+            result = self._request(payload, cache_key, max_retries)
+        finally:
+            self._finish_in_flight(cache_key, future, result)
+
+        return result
+
+    def _request(self, payload: dict, cache_key: str, max_retries: int = 3) -> dict:
+        if self.local_model is not None:
+            return self._local_model_result(cache_key, self.local_model.complete(payload))
         
         for attempt in range(max_retries):
             try:
-                self._rate_limit_protection()
-                response = requests.post(self.base_url, headers=self.headers, json=payload, timeout=30)
+                self._rate_limit_protection(payload)
+                response = self.session.post(self.base_url, headers=self.headers, json=payload, timeout=self.request_timeout)
+                self.rate_limiter.update_from_headers(response.headers)
+                self._note_key_status(response.status_code)
                 
                 if response.status_code == 429:
-                    # Rate limited - wait longer and retry
-                    wait_time = min(60, (2 ** attempt) * 5)  # Exponential backoff, max 60 seconds
+                    # Rate limited - the limiter holds back this and every other request, then retry
+                    wait_time = self._handle_rate_limited(response, attempt)
                     if attempt < max_retries - 1:
-                        time.sleep(wait_time)
                         continue
                     else:
                         return {"error": f"Rate limited. Please wait {wait_time} seconds and try again."}
                 
                 response.raise_for_status()
-                return response.json()
+                result = response.json()
+                self._cache_put(cache_key, result)
+                return result
                 
             except requests.exceptions.RequestException as e:
                 if attempt < max_retries - 1:
@@ -223,41 +458,168 @@ class ChatGPTIntegration:
                 return {"error": f"Unexpected error: {str(e)}"}
         
         return {"error": "Max retries exceeded"}
-    
-    def enhance_prompt(self, original_prompt: str, style_preference: str = "photorealistic", enhancement_percentage: int = 50) -> str:
-        """
-        Enhance a prompt using ChatGPT for better image generation
-        
-        Args:
-            original_prompt: The original user prompt
-            style_preference: Style preference (photorealistic, artistic, anime, etc.)
-            enhancement_percentage: Enhancement intensity (10-100%)
-        
-        Returns:
-            Enhanced prompt string
-        """
+
+    async def _make_api_request_async(self, payload: dict, max_retries: int = 3) -> dict:
+        """Async version of _make_api_request that uses the pooled httpx client"""
+        if not self.is_api_key_set():
+            return {"error": "API key not set. Please configure your OpenAI API key."}
+
+        cache_key = self._cache_key(payload)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        future, leader = self._join_in_flight(cache_key)
+        if not leader:
+            # shield: a cancelled waiter must not cancel the request for everyone else
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        result = None
+        try:
+            result = await self._request_async(payload, cache_key, max_retries)
+        finally:
+            self._finish_in_flight(cache_key, future, result)
+
+        return result
+
+    async def _request_async(self, payload: dict, cache_key: str, max_retries: int = 3) -> dict:
+        if self.local_model is not None:
+            result = await asyncio.get_running_loop().run_in_executor(None, self.local_model.complete, payload)
+            return self._local_model_result(cache_key, result)
+
+        for attempt in range(max_retries):
+            try:
+                await self._rate_limit_protection_async(payload)
+                response = await self._get_async_client().post(self.base_url, headers=self.headers, json=payload)
+                self.rate_limiter.update_from_headers(response.headers)
+                self._note_key_status(response.status_code)
+
+                if response.status_code == 429:
+                    # Rate limited - the limiter holds back this and every other request, then retry
+                    wait_time = self._handle_rate_limited(response, attempt)
+                    if attempt < max_retries - 1:
+                        continue
+                    else:
+                        return {"error": f"Rate limited. Please wait {wait_time} seconds and try again."}
+
+                response.raise_for_status()
+                result = response.json()
+                self._cache_put(cache_key, result)
+                return result
+
+            except httpx.HTTPError as e:
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                    continue
+                else:
+                    return {"error": f"Error connecting to ChatGPT API: {str(e)}"}
+            except Exception as e:
+                return {"error": f"Unexpected error: {str(e)}"}
+
+        return {"error": "Max retries exceeded"}
+
+    def _stream_text(self, payload: dict):
+        """Generator version of _make_api_request that yields the completion text as it grows, using the streaming
+        mode of chat completions; falls back to a regular request if streaming is disabled or fails"""
+        if not _opt("chatgpt_stream", True) or not self.is_api_key_set() or self.local_model is not None:
+            yield self._response_text(self._make_api_request(payload))
+            return
+
+        cache_key = self._cache_key(payload)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            yield self._response_text(cached)
+            return
+
+        future, leader = self._join_in_flight(cache_key)
+        if not leader:
+            yield self._response_text(future.result())
+            return
+
+        result = None
+        try:
+            result = yield from self._stream_request(payload, cache_key)
+        finally:
+            self._finish_in_flight(cache_key, future, result)
+
+        yield self._response_text(result)
+
+    def _stream_request(self, payload: dict, cache_key: str):
+        """Yields the text of a streaming chat completion as it grows; returns the complete response"""
+        text = ""
+        try:
+            self._rate_limit_protection(payload)
+            with self.session.post(self.base_url, headers=self.headers, json={**payload, "stream": True}, timeout=self.request_timeout, stream=True) as response:
+                self.rate_limiter.update_from_headers(response.headers)
+                self._note_key_status(response.status_code)
+
+                if response.status_code == 429:
+                    self._handle_rate_limited(response, 0)
+
+                response.raise_for_status()
+
+                if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    # server ignored "stream": a regular response
+                    result = response.json()
+                    self._cache_put(cache_key, result)
+                    return result
+
+                for delta in iter_sse_deltas(response.iter_lines()):
+                    text += delta
+                    yield text.lstrip()
+        except Exception as e:
+            print(f"ChatGPT streaming request failed, retrying without streaming: {e}")
+            text = ""
+
+        if not text.strip():
+            return self._request(payload, cache_key)
+
+        result = {"choices": [{"message": {"role": "assistant", "content": text}}]}
+        self._cache_put(cache_key, result)
+        return result
+
+    @staticmethod
+    def _response_content(result: dict) -> tuple:
+        """Split an API response into (completion text, None) or (None, error message)"""
+        if "error" in result:
+            return None, result["error"]
+
+        try:
+            return result["choices"][0]["message"]["content"].strip(), None
+        except (KeyError, IndexError, TypeError) as e:
+            return None, f"Error parsing ChatGPT response: {str(e)}"
+
+    @staticmethod
+    def _response_text(result: dict) -> str:
+        """Extract the completion text from an API response, or the error message"""
+        text, error = ChatGPTIntegration._response_content(result)
+        return text if error is None else error
+
+    def _enhance_prompt_check(self, original_prompt: str) -> Optional[str]:
         if not self.is_api_key_set():
             return "❌ API key not configured. Please set your OpenAI API key first."
-        
+
         if not original_prompt.strip():
             return "Please enter a prompt to enhance."
-        
-        try:
-            # Calculate enhancement intensity based on percentage
-            if enhancement_percentage <= 30:
-                enhancement_level = "subtle"
-                detail_multiplier = "1.2-1.5x"
-            elif enhancement_percentage <= 60:
-                enhancement_level = "moderate"
-                detail_multiplier = "1.5-2x"
-            elif enhancement_percentage <= 80:
-                enhancement_level = "strong"
-                detail_multiplier = "2-2.5x"
-            else:
-                enhancement_level = "maximum"
-                detail_multiplier = "2.5-3x"
 
-            system_prompt = f"""You are an expert AI image generation prompt engineer. Your task is to enhance user prompts to create better, more detailed, and more effective prompts for AI image generation.
+        return None
+
+    def _enhance_system_prompt(self, style_preference: str, enhancement_percentage: int) -> str:
+        # Calculate enhancement intensity based on percentage
+        if enhancement_percentage <= 30:
+            enhancement_level = "subtle"
+            detail_multiplier = "1.2-1.5x"
+        elif enhancement_percentage <= 60:
+            enhancement_level = "moderate"
+            detail_multiplier = "1.5-2x"
+        elif enhancement_percentage <= 80:
+            enhancement_level = "strong"
+            detail_multiplier = "2-2.5x"
+        else:
+            enhancement_level = "maximum"
+            detail_multiplier = "2.5-3x"
+
+        system_prompt = f"""You are an expert AI image generation prompt engineer. Your task is to enhance user prompts to create better, more detailed, and more effective prompts for AI image generation.
 
 Enhancement Level: {enhancement_level} ({enhancement_percentage}%)
 Detail Multiplier: {detail_multiplier}
@@ -278,65 +640,218 @@ Examples:
 
 Enhance this prompt with {enhancement_level} intensity while keeping the original intent:"""
 
-            user_prompt = f"Original prompt: '{original_prompt}'\n\nPlease enhance this prompt for better AI image generation results."
+        return system_prompt
 
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "max_tokens": 500,
-                "temperature": 0.7
-            }
+    def _enhance_prompt_payload(self, original_prompt: str, style_preference: str, enhancement_percentage: int) -> dict:
+        system_prompt = self._enhance_system_prompt(style_preference, enhancement_percentage)
+        user_prompt = f"Original prompt: '{original_prompt}'\n\nPlease enhance this prompt for better AI image generation results."
 
-            result = self._make_api_request(payload)
-            
-            if "error" in result:
-                return result["error"]
-            
-            enhanced_prompt = result["choices"][0]["message"]["content"].strip()
-            return enhanced_prompt
-            
-        except KeyError as e:
-            return f"Error parsing ChatGPT response: {str(e)}"
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": 500,
+            "temperature": 0.7
+        }
+
+        return payload
+
+    def enhance_prompt(self, original_prompt: str, style_preference: str = "photorealistic", enhancement_percentage: int = 50) -> str:
+        """
+        Enhance a prompt using ChatGPT for better image generation
+        
+        Args:
+            original_prompt: The original user prompt
+            style_preference: Style preference (photorealistic, artistic, anime, etc.)
+            enhancement_percentage: Enhancement intensity (10-100%)
+        
+        Returns:
+            Enhanced prompt string
+        """
+        message = self._enhance_prompt_check(original_prompt)
+        if message is not None:
+            return message
+
+        try:
+            payload = self._enhance_prompt_payload(original_prompt, style_preference, enhancement_percentage)
+            return self._response_text(self._make_api_request(payload))
         except Exception as e:
             return f"Unexpected error: {str(e)}"
-    
-    def improve_image_prompt(self, original_prompt: str, generated_image_description: str = "", enhancement_percentage: int = 50) -> str:
+
+    async def enhance_prompt_async(self, original_prompt: str, style_preference: str = "photorealistic", enhancement_percentage: int = 50) -> str:
+        """Awaitable version of enhance_prompt; does not occupy a worker thread while waiting for the API"""
+        message = self._enhance_prompt_check(original_prompt)
+        if message is not None:
+            return message
+
+        try:
+            payload = self._enhance_prompt_payload(original_prompt, style_preference, enhancement_percentage)
+            return self._response_text(await self._make_api_request_async(payload))
+        except Exception as e:
+            return f"Unexpected error: {str(e)}"
+
+    def enhance_prompt_stream(self, original_prompt: str, style_preference: str = "photorealistic", enhancement_percentage: int = 50):
+        """Generator version of enhance_prompt that yields the enhanced prompt as it is being written"""
+        message = self._enhance_prompt_check(original_prompt)
+        if message is not None:
+            yield message
+            return
+
+        payload = self._enhance_prompt_payload(original_prompt, style_preference, enhancement_percentage)
+        yield from self._stream_text(payload)
+
+    def _enhance_prompts_payload(self, original_prompts: list, style_preference: str, enhancement_percentage: int) -> dict:
+        system_prompt = self._enhance_system_prompt(style_preference, enhancement_percentage)
+        system_prompt += "\n\nYou will be given a JSON array of prompts. Enhance each of them on its own as described above, and answer with only a JSON array of strings holding the enhanced prompts in the same order."
+        user_prompt = json.dumps(original_prompts, ensure_ascii=False)
+
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": min(4000, 300 * len(original_prompts)),
+            "temperature": 0.7
+        }
+
+        return payload
+
+    @staticmethod
+    def _parse_batch_response(text: str, count: int) -> Optional[list]:
+        """Read the JSON array of enhanced prompts from a batch response; None if the answer is not an array of the expected length"""
+        start, end = text.find("["), text.rfind("]")
+        if start == -1 or end < start:
+            return None
+
+        try:
+            items = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+
+        if not isinstance(items, list) or len(items) != count or not all(isinstance(x, str) and x.strip() for x in items):
+            return None
+
+        return [x.strip() for x in items]
+
+    def _prepare_batch(self, original_prompts: list) -> tuple:
+        """Check the prompts and split the valid ones into chunks, one request per chunk; returns (results, chunks)"""
+        results = [None] * len(original_prompts)
+        pending = []
+        for i, original_prompt in enumerate(original_prompts):
+            message = self._enhance_prompt_check(original_prompt)
+            if message is not None:
+                results[i] = {"prompt": None, "error": message}
+            else:
+                pending.append(i)
+
+        batch_size = max(1, int(_opt("chatgpt_batch_size", 10)))
+        chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+        return results, chunks
+
+    def _store_batch_result(self, results: list, indexes: list, text: Optional[str], error: Optional[str]) -> bool:
+        """Fill results for a chunk from a batch response; returns False if the prompts have to be enhanced one by one instead"""
+        if error is None:
+            enhanced = self._parse_batch_response(text, len(indexes))
+            if enhanced is None:
+                return False
+
+            for i, enhanced_prompt in zip(indexes, enhanced):
+                results[i] = {"prompt": enhanced_prompt, "error": None}
+        else:
+            for i in indexes:
+                results[i] = {"prompt": None, "error": error}
+
+        return True
+
+    def _enhance_chunk(self, results: list, original_prompts: list, indexes: list, style_preference: str, enhancement_percentage: int) -> None:
+        if len(indexes) > 1:
+            payload = self._enhance_prompts_payload([original_prompts[i] for i in indexes], style_preference, enhancement_percentage)
+            text, error = self._response_content(self._make_api_request(payload))
+            if self._store_batch_result(results, indexes, text, error):
+                return
+
+        # a single prompt, or the model did not answer in the expected format: same request as for enhance_prompt
+        for i in indexes:
+            payload = self._enhance_prompt_payload(original_prompts[i], style_preference, enhancement_percentage)
+            text, error = self._response_content(self._make_api_request(payload))
+            results[i] = {"prompt": text, "error": error}
+
+    async def _enhance_chunk_async(self, results: list, original_prompts: list, indexes: list, style_preference: str, enhancement_percentage: int) -> None:
+        if len(indexes) > 1:
+            payload = self._enhance_prompts_payload([original_prompts[i] for i in indexes], style_preference, enhancement_percentage)
+            text, error = self._response_content(await self._make_api_request_async(payload))
+            if self._store_batch_result(results, indexes, text, error):
+                return
+
+        for i in indexes:
+            payload = self._enhance_prompt_payload(original_prompts[i], style_preference, enhancement_percentage)
+            text, error = self._response_content(await self._make_api_request_async(payload))
+            results[i] = {"prompt": text, "error": error}
+
+    def enhance_prompts(self, original_prompts: list, style_preference: str = "photorealistic", enhancement_percentage: int = 50) -> list:
         """
-        Generate an improved prompt based on the original prompt and generated image
+        Enhance many prompts at once, packing several of them into each ChatGPT request
         
         Args:
-            original_prompt: The original prompt used
-            generated_image_description: Description of what was generated
+            original_prompts: The original user prompts
+            style_preference: Style preference (photorealistic, artistic, anime, etc.)
             enhancement_percentage: Enhancement intensity (10-100%)
         
         Returns:
-            Improved prompt for better results
+            A {"prompt": enhanced prompt, "error": None} or {"prompt": None, "error": message} dict for each prompt, in the same order
         """
+        results, chunks = self._prepare_batch(original_prompts)
+        if len(chunks) == 1:
+            self._enhance_chunk(results, original_prompts, chunks[0], style_preference, enhancement_percentage)
+        elif chunks:
+            max_workers = min(len(chunks), max(1, int(_opt("chatgpt_concurrency_limit", 4))))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="enhance_prompts") as executor:
+                list(executor.map(lambda indexes: self._enhance_chunk(results, original_prompts, indexes, style_preference, enhancement_percentage), chunks))
+
+        return results
+
+    async def enhance_prompts_async(self, original_prompts: list, style_preference: str = "photorealistic", enhancement_percentage: int = 50) -> list:
+        """Awaitable version of enhance_prompts"""
+        results, chunks = self._prepare_batch(original_prompts)
+        semaphore = asyncio.Semaphore(max(1, int(_opt("chatgpt_concurrency_limit", 4))))
+
+        async def enhance_chunk(indexes):
+            async with semaphore:
+                await self._enhance_chunk_async(results, original_prompts, indexes, style_preference, enhancement_percentage)
+
+        await asyncio.gather(*[enhance_chunk(indexes) for indexes in chunks])
+
+        return results
+
+    def _improve_image_prompt_check(self, original_prompt: str) -> Optional[str]:
         if not self.is_api_key_set():
             return "❌ API key not configured. Please set your OpenAI API key first."
-        
+
         if not original_prompt.strip():
             return "Please provide the original prompt to improve."
-        
-        try:
-            # Calculate enhancement intensity based on percentage
-            if enhancement_percentage <= 30:
-                enhancement_level = "subtle"
-                improvement_focus = "minor adjustments"
-            elif enhancement_percentage <= 60:
-                enhancement_level = "moderate"
-                improvement_focus = "balanced improvements"
-            elif enhancement_percentage <= 80:
-                enhancement_level = "strong"
-                improvement_focus = "significant enhancements"
-            else:
-                enhancement_level = "maximum"
-                improvement_focus = "major improvements"
 
-            system_prompt = f"""You are an expert AI image generation prompt engineer. Your task is to analyze the original prompt and suggest improvements for generating a better version of the image.
+        return None
+
+    def _improve_image_prompt_payload(self, original_prompt: str, generated_image_description: str, enhancement_percentage: int) -> dict:
+        # Calculate enhancement intensity based on percentage
+        if enhancement_percentage <= 30:
+            enhancement_level = "subtle"
+            improvement_focus = "minor adjustments"
+        elif enhancement_percentage <= 60:
+            enhancement_level = "moderate"
+            improvement_focus = "balanced improvements"
+        elif enhancement_percentage <= 80:
+            enhancement_level = "strong"
+            improvement_focus = "significant enhancements"
+        else:
+            enhancement_level = "maximum"
+            improvement_focus = "major improvements"
+
+        system_prompt = f"""You are an expert AI image generation prompt engineer. Your task is to analyze the original prompt and suggest improvements for generating a better version of the image.
 
 Enhancement Level: {enhancement_level} ({enhancement_percentage}%)
 Improvement Focus: {improvement_focus}
@@ -353,53 +868,78 @@ Guidelines:
 
 Focus on making the prompt more effective for AI image generation with {enhancement_level} intensity."""
 
-            user_prompt = f"""Original prompt: '{original_prompt}'
+        user_prompt = f"""Original prompt: '{original_prompt}'
 Generated image description: '{generated_image_description}'
 
 Please suggest improvements to create a better version of this image. Provide specific, actionable improvements to the prompt."""
 
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "max_tokens": 600,
-                "temperature": 0.8
-            }
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": 600,
+            "temperature": 0.8
+        }
 
-            result = self._make_api_request(payload)
-            
-            if "error" in result:
-                return result["error"]
-            
-            improved_suggestions = result["choices"][0]["message"]["content"].strip()
-            return improved_suggestions
-            
-        except KeyError as e:
-            return f"Error parsing ChatGPT response: {str(e)}"
-        except Exception as e:
-            return f"Unexpected error: {str(e)}"
-    
-    def generate_alternative_prompt(self, original_prompt: str, variation_type: str = "creative") -> str:
+        return payload
+
+    def improve_image_prompt(self, original_prompt: str, generated_image_description: str = "", enhancement_percentage: int = 50) -> str:
         """
-        Generate alternative prompts for creative variations
+        Generate an improved prompt based on the original prompt and generated image
         
         Args:
-            original_prompt: The original prompt
-            variation_type: Type of variation (creative, artistic, photorealistic, etc.)
+            original_prompt: The original prompt used
+            generated_image_description: Description of what was generated
+            enhancement_percentage: Enhancement intensity (10-100%)
         
         Returns:
-            Alternative prompt string
+            Improved prompt for better results
         """
+        message = self._improve_image_prompt_check(original_prompt)
+        if message is not None:
+            return message
+
+        try:
+            payload = self._improve_image_prompt_payload(original_prompt, generated_image_description, enhancement_percentage)
+            return self._response_text(self._make_api_request(payload))
+        except Exception as e:
+            return f"Unexpected error: {str(e)}"
+
+    async def improve_image_prompt_async(self, original_prompt: str, generated_image_description: str = "", enhancement_percentage: int = 50) -> str:
+        """Awaitable version of improve_image_prompt; does not occupy a worker thread while waiting for the API"""
+        message = self._improve_image_prompt_check(original_prompt)
+        if message is not None:
+            return message
+
+        try:
+            payload = self._improve_image_prompt_payload(original_prompt, generated_image_description, enhancement_percentage)
+            return self._response_text(await self._make_api_request_async(payload))
+        except Exception as e:
+            return f"Unexpected error: {str(e)}"
+
+    def improve_image_prompt_stream(self, original_prompt: str, generated_image_description: str = "", enhancement_percentage: int = 50):
+        """Generator version of improve_image_prompt that yields the improved prompt as it is being written"""
+        message = self._improve_image_prompt_check(original_prompt)
+        if message is not None:
+            yield message
+            return
+
+        payload = self._improve_image_prompt_payload(original_prompt, generated_image_description, enhancement_percentage)
+        yield from self._stream_text(payload)
+
+    def _generate_alternative_prompt_check(self, original_prompt: str) -> Optional[str]:
         if not self.is_api_key_set():
             return "❌ API key not configured. Please set your OpenAI API key first."
-        
+
         if not original_prompt.strip():
             return "Please provide a prompt to create variations."
-        
-        try:
-            system_prompt = f"""You are a creative AI image generation prompt engineer. Create alternative prompts that explore different artistic interpretations of the original concept.
+
+        return None
+
+    def _generate_alternative_prompt_payload(self, original_prompt: str, variation_type: str) -> dict:
+        system_prompt = f"""You are a creative AI image generation prompt engineer. Create alternative prompts that explore different artistic interpretations of the original concept.
 
 Guidelines:
 1. Keep the core subject/concept
@@ -411,31 +951,63 @@ Guidelines:
 
 Provide 3 creative alternative prompts that explore different artistic directions."""
 
-            user_prompt = f"Original prompt: '{original_prompt}'\n\nCreate creative alternative prompts for different artistic interpretations."
+        user_prompt = f"Original prompt: '{original_prompt}'\n\nCreate creative alternative prompts for different artistic interpretations."
 
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "max_tokens": 500,
-                "temperature": 0.9
-            }
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": 500,
+            "temperature": 0.9
+        }
 
-            result = self._make_api_request(payload)
-            
-            if "error" in result:
-                return result["error"]
-            
-            alternatives = result["choices"][0]["message"]["content"].strip()
-            return alternatives
-            
-        except KeyError as e:
-            return f"Error parsing ChatGPT response: {str(e)}"
+        return payload
+
+    def generate_alternative_prompt(self, original_prompt: str, variation_type: str = "creative") -> str:
+        """
+        Generate alternative prompts for creative variations
+        
+        Args:
+            original_prompt: The original prompt
+            variation_type: Type of variation (creative, artistic, photorealistic, etc.)
+        
+        Returns:
+            Alternative prompt string
+        """
+        message = self._generate_alternative_prompt_check(original_prompt)
+        if message is not None:
+            return message
+
+        try:
+            payload = self._generate_alternative_prompt_payload(original_prompt, variation_type)
+            return self._response_text(self._make_api_request(payload))
+        except Exception as e:
+            return f"Unexpected error: {str(e)}"
+
+    async def generate_alternative_prompt_async(self, original_prompt: str, variation_type: str = "creative") -> str:
+        """Awaitable version of generate_alternative_prompt; does not occupy a worker thread while waiting for the API"""
+        message = self._generate_alternative_prompt_check(original_prompt)
+        if message is not None:
+            return message
+
+        try:
+            payload = self._generate_alternative_prompt_payload(original_prompt, variation_type)
+            return self._response_text(await self._make_api_request_async(payload))
         except Exception as e:
             return f"Unexpected error: {str(e)}"
 
+    def generate_alternative_prompt_stream(self, original_prompt: str, variation_type: str = "creative"):
+        """Generator version of generate_alternative_prompt that yields the alternatives as they are being written"""
+        message = self._generate_alternative_prompt_check(original_prompt)
+        if message is not None:
+            yield message
+            return
+
+        payload = self._generate_alternative_prompt_payload(original_prompt, variation_type)
+        yield from self._stream_text(payload)
+
 def _create_dummy_instance():
     """Create a dummy ChatGPT instance when API key is not available"""
     class DummyChatGPT:
@@ -453,19 +1025,66 @@ def _create_dummy_instance():
         
         def generate_alternative_prompt(self, *args, **kwargs):
             return "❌ ChatGPT API key is not configured. Alternative prompts are disabled."
+
+        async def enhance_prompt_async(self, *args, **kwargs):
+            return self.enhance_prompt(*args, **kwargs)
+
+        async def improve_image_prompt_async(self, *args, **kwargs):
+            return self.improve_image_prompt(*args, **kwargs)
+
+        async def generate_alternative_prompt_async(self, *args, **kwargs):
+            return self.generate_alternative_prompt(*args, **kwargs)
+
+        def enhance_prompt_stream(self, *args, **kwargs):
+            yield self.enhance_prompt(*args, **kwargs)
+
+        def improve_image_prompt_stream(self, *args, **kwargs):
+            yield self.improve_image_prompt(*args, **kwargs)
+
+        def generate_alternative_prompt_stream(self, *args, **kwargs):
+            yield self.generate_alternative_prompt(*args, **kwargs)
+
+        def enhance_prompts(self, original_prompts, *args, **kwargs):
+            return [{"prompt": None, "error": self.enhance_prompt()} for _ in original_prompts]
+
+        async def enhance_prompts_async(self, *args, **kwargs):
+            return self.enhance_prompts(*args, **kwargs)
+
+        def get_cache_stats(self):
+            return {"hits": 0, "misses": 0, "hit_ratio": 0.0}
+
+        def get_request_stats(self):
+            return {"coalesced": 0, "in_flight": 0}
+
+        def get_validation_status(self):
+            return validation_messages["missing"]
     
     return DummyChatGPT()
 
-# Global instance - initialize on module import (will prompt for API key if in interactive mode)
+def create_chatgpt_instance() -> ChatGPTIntegration:
+    """Create the integration for the backend chosen in settings"""
+    backend = _opt("chatgpt_backend", backend_openai)
+
+    if backend == backend_local:
+        model = local_llm.LocalChatModel(_opt("chatgpt_local_model", "Qwen/Qwen2.5-0.5B-Instruct"))
+        instance = ChatGPTIntegration(api_key="local", model=model.model_name, local_model=model)
+    elif backend == backend_server:
+        base_url = chat_completions_url(_opt("chatgpt_base_url", "") or "http://127.0.0.1:8080/v1")
+        # llama.cpp and vLLM servers accept any key unless started with one
+        instance = ChatGPTIntegration(api_key=find_api_key() or "local", base_url=base_url, model=_opt("chatgpt_model", "") or "local")
+        instance.start_validation()
+    else:
+        return ChatGPTIntegration(base_url=chat_completions_url(_opt("chatgpt_base_url", "") or openai_url), model=_opt("chatgpt_model", "") or "gpt-3.5-turbo")
+
+    # no external rate limits to respect
+    instance.rate_limiter = rate_limiter.RateLimiter(requests_per_minute=None)
+    return instance
+
+# Global instance - initialize on module import (never asks for input or waits for the network)
 _chatgpt_instance = None
 try:
-    _chatgpt_instance = ChatGPTIntegration()
-except KeyboardInterrupt:
-    # User pressed ESC/Ctrl+C to skip
-    print("ChatGPT integration: API key input skipped, feature disabled.")
-    _chatgpt_instance = _create_dummy_instance()
+    _chatgpt_instance = create_chatgpt_instance()
 except Exception as e:
-    # Other errors (non-interactive mode, etc.)
     print(f"ChatGPT integration: {e}")
     _chatgpt_instance = _create_dummy_instance()
 
@@ -476,6 +1095,11 @@ def get_chatgpt_instance():
     """Get ChatGPT integration instance"""
     return _chatgpt_instance if _chatgpt_instance else _create_dummy_instance()
 
+def reload_api_key():
+    """Called when the chatgpt_api_key setting changes; other backends do not use it"""
+    if _opt("chatgpt_backend", backend_openai) == backend_openai and isinstance(chatgpt, ChatGPTIntegration):
+        chatgpt.reload_api_key()
+
 def is_chatgpt_available() -> bool:
     """Check if ChatGPT integration is available (API key is set)"""
     try:
@@ -483,27 +1107,38 @@ def is_chatgpt_available() -> bool:
     except:
         return False
 
-def enhance_prompt_ui(original_prompt: str, style_preference: str, enhancement_percentage: int) -> str:
-    """UI wrapper for prompt enhancement"""
+def validation_status_ui() -> str:
+    """Status of the API key check, shown next to the Enhance Prompt button"""
+    return get_chatgpt_instance().get_validation_status()
+
+def enhance_prompt_ui(original_prompt: str, style_preference: str, enhancement_percentage: int):
+    """UI wrapper for prompt enhancement; a generator, so that the prompt textbox fills in as the text streams in"""
     if not is_chatgpt_available():
-        return "❌ ChatGPT API key is not configured. Prompt enhancement is disabled.\n\n" \
+        yield "❌ ChatGPT API key is not configured. Prompt enhancement is disabled.\n\n" \
                "To enable prompt enhancement:\n" \
                "1. Set environment variable: OPENAI_API_KEY=your_key_here\n" \
-               "2. Or restart the application and enter your API key when prompted\n" \
+               "2. Or enter it in Settings → Prompt enhancement, or start with --openai-api-key\n" \
                "3. Get your API key from: https://platform.openai.com/api-keys"
+        return
     instance = get_chatgpt_instance()
-    return instance.enhance_prompt(original_prompt, style_preference, enhancement_percentage)
+    yield from instance.enhance_prompt_stream(original_prompt, style_preference, enhancement_percentage)
+
+def enhance_prompts(original_prompts: list, style_preference: str = "photorealistic", enhancement_percentage: int = 50) -> list:
+    """Enhance a list of prompts in as few requests as possible; for scripts such as prompts_from_file"""
+    return get_chatgpt_instance().enhance_prompts(original_prompts, style_preference, enhancement_percentage)
 
-def improve_image_prompt_ui(original_prompt: str, image_description: str, enhancement_percentage: int) -> str:
-    """UI wrapper for image improvement"""
+def improve_image_prompt_ui(original_prompt: str, image_description: str, enhancement_percentage: int):
+    """UI wrapper for image improvement; streams like enhance_prompt_ui"""
     if not is_chatgpt_available():
-        return "❌ ChatGPT API key is not configured. Image improvement is disabled."
+        yield "❌ ChatGPT API key is not configured. Image improvement is disabled."
+        return
     instance = get_chatgpt_instance()
-    return instance.improve_image_prompt(original_prompt, image_description, enhancement_percentage)
+    yield from instance.improve_image_prompt_stream(original_prompt, image_description, enhancement_percentage)
 
-def generate_alternative_prompt_ui(original_prompt: str, variation_type: str) -> str:
-    """UI wrapper for alternative prompt generation"""
+def generate_alternative_prompt_ui(original_prompt: str, variation_type: str):
+    """UI wrapper for alternative prompt generation; streams like enhance_prompt_ui"""
     if not is_chatgpt_available():
-        return "❌ ChatGPT API key is not configured. Alternative prompts are disabled."
+        yield "❌ ChatGPT API key is not configured. Alternative prompts are disabled."
+        return
     instance = get_chatgpt_instance()
-    return instance.generate_alternative_prompt(original_prompt, variation_type)
+    yield from instance.generate_alternative_prompt_stream(original_prompt, variation_type)
@@ -1,5 +1,10 @@
+import concurrent.futures
+import ctypes
 import hashlib
+import heapq
+import itertools
 import os.path
+import threading
 
 from modules import shared
 import modules.cache
@@ -7,6 +12,254 @@ import modules.cache
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+read_size = 16 * 1024 * 1024
+"""bytes read from the file at a time; large reads with readahead keep network and spinning disks streaming"""
+
+checkpoint_every = 256 * 1024 * 1024
+"""bytes hashed between saves of the partial state, so that an interrupted hash resumes from there"""
+
+
+def load_libcrypto():
+    """OpenSSL, as loaded for hashlib, for its SHA256_* functions, whose state can be saved; None where not available"""
+    try:
+        import _hashlib
+
+        lib = ctypes.CDLL(_hashlib.__file__)
+        for name in ("SHA256_Init", "SHA256_Update", "SHA256_Final"):
+            getattr(lib, name).restype = ctypes.c_int
+
+        return lib
+    except Exception:
+        return None
+
+
+libcrypto = load_libcrypto()
+
+
+class Sha256:
+    """sha256 whose state can be exported and restored (with libcrypto), so that hashing can stop and resume later,
+    also in another process; without libcrypto it falls back to hashlib, and state() returns None"""
+
+    state_size = 112
+    """sizeof(SHA256_CTX)"""
+
+    def __init__(self, state=None):
+        if libcrypto is None:
+            self.ctx = None
+            self.hash = hashlib.sha256()
+            return
+
+        self.ctx = ctypes.create_string_buffer(128)
+        if state is not None:
+            ctypes.memmove(self.ctx, state, self.state_size)
+        else:
+            libcrypto.SHA256_Init(self.ctx)
+
+    def update(self, data, length):
+        """hashes the first length bytes of the bytearray data"""
+        if self.ctx is None:
+            self.hash.update(memoryview(data)[:length])
+        else:
+            libcrypto.SHA256_Update(self.ctx, (ctypes.c_char * len(data)).from_buffer(data), ctypes.c_size_t(length))
+
+    def state(self):
+        return self.ctx.raw[:self.state_size] if self.ctx is not None else None
+
+    def hexdigest(self):
+        if self.ctx is None:
+            return self.hash.hexdigest()
+
+        digest = ctypes.create_string_buffer(32)
+        libcrypto.SHA256_Final(digest, self.ctx)
+        return digest.raw.hex()
+
+
+def hash_start(file, use_addnet_hash):
+    """Offset in file where the hash starts: 0, or after the header of a safetensors file for the kohya-ss hash"""
+    if not use_addnet_hash:
+        return 0
+
+    file.seek(0)
+    return int.from_bytes(file.read(8), "little") + 8
+
+
+priorities = {
+    "load": 0,
+    "wait": 1,
+    "background": 2,
+}
+"""hash jobs, most urgent first: files about to be loaded, hashes someone waits for, all others"""
+
+
+class HashJob:
+    def __init__(self, filename, title, use_addnet_hash, priority, seq):
+        self.filename = filename
+        self.title = title
+        self.use_addnet_hash = use_addnet_hash
+        self.priority = priority
+        self.seq = seq
+        self.future = concurrent.futures.Future()
+        self.status = "queued"
+        self.size = 0
+        self.offset = 0
+        self.hasher = None
+
+    def sort_key(self):
+        return priorities[self.priority], self.seq
+
+
+class HashingService:
+    """Calculates sha256 of model files on a few background threads, most urgent files first.
+
+    Files are read in large chunks with sequential readahead. A hash that is running can be paused for a more urgent
+    one and continues where it stopped; its partial state is also saved to the "hashes-partial" cache every
+    checkpoint_every bytes, so that a hash interrupted by a restart does not start over."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.seq = itertools.count()
+        self.jobs = {}
+        self.queue = []
+        self.workers = 0
+        self.running = 0
+
+    def threads(self):
+        return max(int(getattr(shared.opts, "hashing_threads", 2)), 1)
+
+    def submit(self, filename, title, use_addnet_hash=False, priority="background"):
+        """Queues the hash of filename; returns a Future with the hash. A file that is queued already moves up if
+        the new priority is more urgent."""
+
+        key = (title, use_addnet_hash)
+        with self.condition:
+            job = self.jobs.get(key)
+            if job is None:
+                job = self.jobs[key] = HashJob(filename, title, use_addnet_hash, priority, next(self.seq))
+                heapq.heappush(self.queue, (job.sort_key(), job.seq, job))
+            elif priorities[priority] < priorities[job.priority]:
+                job.priority = priority
+                if job.status != "running":
+                    heapq.heappush(self.queue, (job.sort_key(), job.seq, job))
+
+            if self.workers < self.threads() and self.workers - self.running < len(self.queue):
+                self.workers += 1
+                threading.Thread(target=self.worker, name="hashing", daemon=True).start()
+
+            self.condition.notify()
+
+        return job.future
+
+    def next_job(self):
+        """The most urgent queued job, or None; call with self.condition held"""
+        while self.queue:
+            _, _, job = heapq.heappop(self.queue)
+            if job.status != "running" and self.jobs.get((job.title, job.use_addnet_hash)) is job:
+                return job
+
+        return None
+
+    def should_pause(self, job):
+        """Whether a more urgent job is waiting for the thread running job; call with self.condition held"""
+        if not self.queue or self.workers > self.running:
+            return False
+
+        _, _, waiting = self.queue[0]
+        return waiting.sort_key() < job.sort_key() and waiting.status != "running" and self.jobs.get((waiting.title, waiting.use_addnet_hash)) is waiting
+
+    def worker(self):
+        while True:
+            with self.condition:
+                job = self.next_job()
+                if job is None:
+                    self.workers -= 1
+                    return
+
+                job.status = "running"
+                self.running += 1
+
+            try:
+                result = self.run(job)
+            except Exception as e:
+                result = e
+
+            with self.condition:
+                self.running -= 1
+
+                if result is None:
+                    job.status = "paused"
+                    heapq.heappush(self.queue, (job.sort_key(), job.seq, job))
+                    continue
+
+                job.status = "done"
+                del self.jobs[(job.title, job.use_addnet_hash)]
+
+            if isinstance(result, Exception):
+                job.future.set_exception(result)
+            else:
+                job.future.set_result(result)
+
+    def run(self, job):
+        """Hashes job.filename from where it stopped; returns the hash, or None if paused for a more urgent job"""
+
+        partial = cache("hashes-partial")
+        key = f"{'addnet/' if job.use_addnet_hash else ''}{job.title}"
+        stat = os.stat(job.filename)
+
+        with open(job.filename, "rb", buffering=0) as file:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+            if job.hasher is None:
+                saved = partial.get(key)
+                if saved and saved["mtime"] == stat.st_mtime and saved["size"] == stat.st_size and libcrypto is not None:
+                    job.hasher, job.offset = Sha256(saved["state"]), saved["offset"]
+                    print(f"Resuming sha256 for {job.filename} at {job.offset / stat.st_size:.0%}")
+                else:
+                    job.hasher, job.offset = Sha256(), hash_start(file, job.use_addnet_hash)
+
+            job.size = stat.st_size
+            file.seek(job.offset)
+
+            buffer = bytearray(read_size)
+            saved_at = job.offset
+            while True:
+                n = file.readinto(buffer)
+                if not n:
+                    break
+
+                job.hasher.update(buffer, n)
+                job.offset += n
+
+                if job.offset - saved_at >= checkpoint_every and job.hasher.state() is not None:
+                    partial.set(key, {"mtime": stat.st_mtime, "size": stat.st_size, "offset": job.offset, "state": job.hasher.state()})
+                    saved_at = job.offset
+
+                with self.condition:
+                    if self.should_pause(job):
+                        return None
+
+        sha256_value = job.hasher.hexdigest()
+        print(f"Calculated sha256 for {job.filename}: {sha256_value}")
+
+        hashes = cache("hashes-addnet") if job.use_addnet_hash else cache("hashes")
+        hashes[job.title] = {
+            "mtime": stat.st_mtime,
+            "sha256": sha256_value,
+        }
+        partial.delete(key)
+
+        dump_cache()
+
+        return sha256_value
+
+    def progress(self):
+        with self.condition:
+            jobs = sorted(self.jobs.values(), key=lambda x: x.sort_key())
+            return [{"filename": x.filename, "title": x.title, "priority": x.priority, "status": x.status, "bytes": x.offset, "size": x.size} for x in jobs]
+
+
+service = HashingService()
+
 
 def calculate_sha256(filename):
     hash_sha256 = hashlib.sha256()
@@ -19,12 +272,14 @@ def calculate_sha256(filename):
     return hash_sha256.hexdigest()
 
 
-def sha256_from_cache(filename, title, use_addnet_hash=False):
+def sha256_from_cache(filename, title, use_addnet_hash=False, ondisk_mtime=None):
+    """sha256 of filename if it is in cache and the file did not change since; ondisk_mtime saves a stat if the caller has it"""
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
-    try:
-        ondisk_mtime = os.path.getmtime(filename)
-    except FileNotFoundError:
-        return None
+    if ondisk_mtime is None:
+        try:
+            ondisk_mtime = os.path.getmtime(filename)
+        except FileNotFoundError:
+            return None
 
     if title not in hashes:
         return None
@@ -39,8 +294,6 @@ def sha256_from_cache(filename, title, use_addnet_hash=False):
 
 
 def sha256(filename, title, use_addnet_hash=False):
-    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
-
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,22 +301,23 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
-    print(f"Calculating sha256 for {filename}: ", end='')
-    if use_addnet_hash:
-        with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
-    print(f"{sha256_value}")
+    return service.submit(filename, title, use_addnet_hash, priority="wait").result()
 
-    hashes[title] = {
-        "mtime": os.path.getmtime(filename),
-        "sha256": sha256_value,
-    }
 
-    dump_cache()
+def sha256_in_background(filename, title, use_addnet_hash=False, on_done=None, priority="load"):
+    """Like sha256, but never waits for the hash: returns it if it is in cache; otherwise queues it and returns None.
 
-    return sha256_value
+    on_done, if given, is called with the hash (or None if it could not be calculated) from a hashing thread."""
+
+    sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
+    if sha256_value is not None or shared.cmd_opts.no_hashing:
+        return sha256_value
+
+    future = service.submit(filename, title, use_addnet_hash, priority=priority)
+    if on_done is not None:
+        future.add_done_callback(lambda x: on_done(None if x.exception() else x.result()))
+
+    return None
 
 
 def addnet_hash_safetensors(b):
@@ -81,4 +335,3 @@ def addnet_hash_safetensors(b):
         hash_sha256.update(chunk)
 
     return hash_sha256.hexdigest()
-
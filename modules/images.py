@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import concurrent.futures
 import datetime
 import functools
 import pytz
@@ -18,13 +19,28 @@ import pillow_avif # noqa: F401
 import string
 import json
 import hashlib
+import itertools
+import threading
+import uuid
 
-from modules import sd_samplers, shared, script_callbacks, errors
+from modules import sd_samplers, shared, script_callbacks, errors, metrics
 from modules.paths_internal import roboto_ttf_file
 from modules.shared import opts
 
 LANCZOS = (Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS)
 
+encoding_pool = None
+encoding_pool_lock = threading.Lock()
+
+background_saves = {}
+"""(filename, future) of images being written by save_image(background=True), in the order they were saved; for each
+job, keyed by background_saves_key of its processing object (None for images saved without one)"""
+
+background_saves_keys = itertools.count()
+
+reserved_filenames = set()
+"""names background saves will write their images to, so that no other save picks the same name"""
+
 
 def get_font(fontsize: int):
     try:
@@ -540,6 +556,74 @@ class FilenameGenerator:
         return res
 
 
+def get_encoding_pool():
+    """Threads that compress images for save_image and for API responses; PIL releases the GIL while it compresses,
+    so they run alongside sampling and each other."""
+    global encoding_pool
+
+    with encoding_pool_lock:
+        if encoding_pool is None:
+            encoding_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(opts.image_encoding_threads, 1), thread_name_prefix="image encoding")
+
+    return encoding_pool
+
+
+def encode_in_parallel(func, pil_images):
+    """Returns an iterator over func(image) for every image, computed on the encoding pool; results keep the order of pil_images"""
+    if opts.image_encoding_threads <= 1 or len(pil_images) < 2:
+        return map(func, pil_images)
+
+    return get_encoding_pool().map(func, pil_images)
+
+
+def background_saves_key(p):
+    """Key of the images p saves in background_saves; unlike id(p), it is not reused by a later job; call with
+    encoding_pool_lock held"""
+    if p is None:
+        return None
+
+    if getattr(p, "background_saves_key", None) is None:
+        p.background_saves_key = next(background_saves_keys)
+
+    return p.background_saves_key
+
+
+def wait_for_background_saves(p=None):
+    """Blocks until all images saved with save_image(background=True) for p are written; reports those that could not be.
+    Returns filenames of the images that were not saved."""
+    with encoding_pool_lock:
+        saves = background_saves.pop(background_saves_key(p), [])
+
+    failed = []
+    for filename, future in saves:
+        try:
+            future.result()
+        except Exception:
+            errors.report(f"Error saving image {filename}", exc_info=True)
+            failed.append(filename)
+
+    return failed
+
+
+def temp_filename(filename_without_extension):
+    """Unique name for a temporary file to write an image to before it gets its name; it starts like the name, so that
+    it claims the same sequence number"""
+    directory, name = os.path.split(filename_without_extension)
+    return os.path.join(directory, f"{name[:200]}-{uuid.uuid4().hex[:8]}.tmp")
+
+
+def unused_filename(filename_without_extension, extension):
+    """filename_without_extension + extension, or if that file exists or a background save is going to write it, the
+    same name with the first free -1, -2, ... suffix; call with encoding_pool_lock held"""
+    filename = filename_without_extension + extension
+    n = 0
+    while os.path.exists(filename) or filename in reserved_filenames:
+        n += 1
+        filename = f"{filename_without_extension}-{n}{extension}"
+
+    return filename
+
+
 def get_next_sequence_number(path, basename):
     """
     Determines and returns the next sequence number to use when saving an image in the specified directory.
@@ -621,7 +705,7 @@ def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_p
         image.save(filename, format=image_format, quality=opts.jpeg_quality)
 
 
-def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None):
+def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None, background=False):
     """Save an image.
 
     Args:
@@ -647,6 +731,9 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             If specified, `basename` and filename pattern will be ignored.
         save_to_dirs (bool):
             If true, the image will be saved into a subdirectory of `path`.
+        background (bool):
+            If true, the file name is picked right away, and the image is compressed and written by the encoding pool;
+            wait_for_background_saves(p) waits for it. image_saved_callback is still called in the order images were saved.
 
     Returns: (fullfn, txt_fullfn)
         fullfn (`str`):
@@ -709,21 +796,28 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
     fullfn = params.filename
     info = params.pnginfo.get(pnginfo_section_name, None)
 
-    def _atomically_save_image(image_to_save, filename_without_extension, extension):
+    def _atomically_save_image(image_to_save, filename_without_extension, extension, temp_file_path=None, filename=None, previous=None):
         """
-        save image with .tmp extension to avoid race condition when another process detects new image in the directory
+        save image with .tmp extension to avoid race condition when another process detects new image in the directory;
+        each save has its own .tmp file; without filename, the name is picked when the image is written; the file gets
+        its name only after the save in previous is done, so that a later image replaces an earlier one, not the other way
         """
-        temp_file_path = f"{filename_without_extension}.tmp"
+        temp_file_path = temp_file_path or temp_filename(filename_without_extension)
 
-        save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
+        try:
+            save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
+
+            if previous is not None:
+                concurrent.futures.wait([previous])
 
-        filename = filename_without_extension + extension
-        if shared.opts.save_images_replace_action != "Replace":
-            n = 0
-            while os.path.exists(filename):
-                n += 1
-                filename = f"{filename_without_extension}-{n}{extension}"
-        os.replace(temp_file_path, filename)
+            with encoding_pool_lock:
+                if filename is None and shared.opts.save_images_replace_action != "Replace":
+                    filename = unused_filename(filename_without_extension, extension)
+                os.replace(temp_file_path, filename or filename_without_extension + extension)
+        except Exception:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
 
     fullfn_without_extension, extension = os.path.splitext(params.filename)
     if hasattr(os, 'statvfs'):
@@ -731,38 +825,81 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
         fullfn_without_extension = fullfn_without_extension[:max_name_len - max(4, len(extension))]
         params.filename = fullfn_without_extension + extension
         fullfn = params.filename
-    _atomically_save_image(image, fullfn_without_extension, extension)
+    if opts.save_txt and info is not None:
+        txt_fullfn = f"{fullfn_without_extension}.txt"
+    else:
+        txt_fullfn = None
 
-    image.already_saved_as = fullfn
+    def write_files(image, previous=None, temp_file_path=None):
+        with metrics.stage("save"):
+            _atomically_save_image(image, fullfn_without_extension, extension, temp_file_path, filename=fullfn if temp_file_path is not None else None, previous=previous)
 
-    oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
-    if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
-        ratio = image.width / image.height
-        resize_to = None
-        if oversize and ratio > 1:
-            resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
-        elif oversize:
-            resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
+        oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
+        if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
+            ratio = image.width / image.height
+            resize_to = None
+            if oversize and ratio > 1:
+                resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
+            elif oversize:
+                resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
 
-        if resize_to is not None:
+            if resize_to is not None:
+                try:
+                    # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
+                    image = image.resize(resize_to, LANCZOS)
+                except Exception:
+                    image = image.resize(resize_to)
             try:
-                # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
-                image = image.resize(resize_to, LANCZOS)
-            except Exception:
-                image = image.resize(resize_to)
-        try:
-            _atomically_save_image(image, fullfn_without_extension, ".jpg")
-        except Exception as e:
-            errors.display(e, "saving image as downscaled JPG")
+                _atomically_save_image(image, fullfn_without_extension, ".jpg")
+            except Exception as e:
+                errors.display(e, "saving image as downscaled JPG")
 
-    if opts.save_txt and info is not None:
-        txt_fullfn = f"{fullfn_without_extension}.txt"
-        with open(txt_fullfn, "w", encoding="utf8") as file:
-            file.write(f"{info}\n")
+        if txt_fullfn is not None:
+            with open(txt_fullfn, "w", encoding="utf8") as file:
+                file.write(f"{info}\n")
+
+        if previous is not None:
+            concurrent.futures.wait([previous])
+
+        script_callbacks.image_saved_callback(params)
+
+    def write_files_in_background(previous, temp_file_path):
+        try:
+            write_files(image, previous, temp_file_path)
+        except Exception:
+            # image_saved_callback for later images still comes after the one for earlier images
+            if previous is not None:
+                concurrent.futures.wait([previous])
+
+            raise
+        finally:
+            with encoding_pool_lock:
+                reserved_filenames.discard(fullfn)
+
+    if background and opts.image_encoding_threads > 0:
+        pool = get_encoding_pool()
+        with encoding_pool_lock:
+            # an empty .tmp file claims the sequence number until the image is written
+            temp_file_path = temp_filename(fullfn_without_extension)
+            open(temp_file_path, "wb").close()
+
+            # the name is taken now, while files for earlier images may not be written yet
+            if opts.save_images_replace_action != "Replace":
+                fullfn = unused_filename(fullfn_without_extension, extension)
+                reserved_filenames.add(fullfn)
+
+                fullfn_without_extension = os.path.splitext(fullfn)[0]
+                params.filename = fullfn
+                if txt_fullfn is not None:
+                    txt_fullfn = f"{fullfn_without_extension}.txt"
+
+            saves = background_saves.setdefault(background_saves_key(p), [])
+            previous = saves[-1][1] if saves else None
+            saves.append((fullfn, pool.submit(write_files_in_background, previous, temp_file_path)))
     else:
-        txt_fullfn = None
+        write_files(image)
 
-    script_callbacks.image_saved_callback(params)
+    image.already_saved_as = fullfn
 
     return fullfn, txt_fullfn
 
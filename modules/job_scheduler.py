@@ -0,0 +1,265 @@
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+
+from modules import metrics
+
+
+priorities = {
+    "interactive": 0,
+    "batch": 1,
+    "background": 2,
+}
+"""job classes, most urgent first: users of the web UI, API clients, work nobody is waiting for"""
+
+current_priority = contextvars.ContextVar("job_priority", default="interactive")
+current_client = contextvars.ContextVar("job_client", default="ui")
+
+
+class QueueFullError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.status_code = 503
+        self.detail = message
+
+
+class JobCancelledError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.status_code = 409
+        self.detail = message
+
+
+@contextlib.contextmanager
+def job_context(priority=None, client=None):
+    """Sets the priority and client for jobs queued by code inside the with block. API middleware does this for
+    every request; new threads start with the defaults (interactive, "ui") and have to do it themselves."""
+
+    tokens = []
+    if priority is not None:
+        tokens.append((current_priority, current_priority.set(priority)))
+    if client is not None:
+        tokens.append((current_client, current_client.set(client)))
+
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class Waiter:
+    def __init__(self, seq, priority, client, id_task, model=None):
+        self.seq = seq
+        self.priority = priority
+        self.client = client
+        self.id_task = id_task
+        self.model = model
+        self.passed_over = 0
+        self.queued_at = time.time()
+        self.started_at = None
+        self.thread = threading.get_ident()
+        self.event = threading.Event()
+        self.cancelled = False
+
+
+class JobScheduler:
+    """A lock for the GPU that is handed out by priority and fair share instead of in arrival order.
+
+    When the lock is released, the next holder is the waiter with the most urgent priority; among waiters of the same
+    priority, the one whose client has used the lock for the least time; among those, the one that came first.
+    This way a client that queued a hundred jobs cannot make everyone else wait for all of them.
+
+    Works as a drop-in replacement for FIFOLock: `with scheduler:` queues with the priority and client set for the
+    current context (see job_context); acquire() also takes them as arguments, along with the task id.
+
+    With an affinity window, jobs that say which models they use (a (checkpoint, VAE, LoRAs) tuple) can be run out of
+    order within their priority: jobs for the model of the last job come first, then jobs for checkpoints that are
+    loaded already. A job is passed over at most affinity_window times, so no job waits forever.
+
+    With more than one slot, that many jobs hold the lock at once, as in --workers mode, where each worker process runs
+    a job. release() releases the hold taken by the calling thread, or, if it has none, the oldest one."""
+
+    def __init__(self, max_depth=0, affinity_window=0, loaded_checkpoints=None, slots=1):
+        self.lock = threading.Lock()
+        self.seq = itertools.count()
+        self.waiting = []
+        self.holders = []
+
+        self.usage = {}
+        """client -> seconds it held the lock since the queue was last empty"""
+
+        self.max_depth = max_depth
+        """maximum number of waiting jobs, 0 = unlimited; a number or a function returning one"""
+
+        self.affinity_window = affinity_window
+        """how many times a job may be passed over for jobs with a loaded model, 0 = never; a number or a function returning one"""
+
+        self.loaded_checkpoints = loaded_checkpoints
+        """function returning checkpoints that are in memory and can be switched to without loading them"""
+
+        self.slots = slots
+        """how many jobs can hold the lock at once; a number or a function returning one"""
+
+        self.last_model = None
+        self.swaps_avoided = 0
+
+        self.listeners = []
+        """functions called without arguments when a job is queued or starts; they run with the lock held and must be quick"""
+
+    def get_max_depth(self):
+        return self.max_depth() if callable(self.max_depth) else self.max_depth
+
+    def get_slots(self):
+        return max(self.slots() if callable(self.slots) else self.slots, 1)
+
+    @property
+    def holder(self):
+        return self.holders[0] if self.holders else None
+
+    def get_affinity_window(self):
+        return self.affinity_window() if callable(self.affinity_window) else self.affinity_window
+
+    def sort_key(self, waiter, usage=None):
+        usage = self.usage if usage is None else usage
+        return priorities.get(waiter.priority, len(priorities)), usage.get(waiter.client, 0.0), waiter.seq
+
+    def model_cost(self, model, loaded):
+        """0 for the model of the last job, 1 for a checkpoint that is loaded (or an unknown model), 2 for a checkpoint that has to be loaded"""
+        if model is None:
+            return 1
+        if model == self.last_model:
+            return 0
+        if loaded is None or model[0] in loaded:
+            return 1
+
+        return 2
+
+    def next_waiter(self):
+        ordered = sorted(self.waiting, key=self.sort_key)
+        head = ordered[0]
+
+        window = self.get_affinity_window()
+        if not window:
+            return head
+
+        candidates = [x for x in ordered if x.priority == head.priority]
+
+        overdue = next((x for x in candidates if x.passed_over >= window), None)
+        if overdue is not None:
+            return overdue
+
+        loaded = self.loaded_checkpoints() if self.loaded_checkpoints is not None else None
+        costs = [self.model_cost(x.model, loaded) for x in candidates]
+        index = costs.index(min(costs))
+
+        if index > 0:
+            for waiter in candidates[:index]:
+                waiter.passed_over += 1
+
+            if head.model is not None:
+                # running the head now would have meant changing the checkpoint, VAE or LoRAs
+                self.swaps_avoided += 1
+
+        return candidates[index]
+
+    def acquire(self, blocking=True, priority=None, client=None, id_task=None, model=None):
+        waiter = Waiter(next(self.seq), priority or current_priority.get(), client or current_client.get(), id_task, model)
+
+        with self.lock:
+            if len(self.holders) < self.get_slots() and not self.waiting:
+                self.grant(waiter)
+                return True
+
+            if not blocking:
+                return False
+
+            max_depth = self.get_max_depth()
+            if max_depth and len(self.waiting) >= max_depth:
+                raise QueueFullError(f"The queue is full: {len(self.waiting)} jobs are already waiting")
+
+            if waiter.client not in self.usage:
+                # a client that (re)joins does not get to catch up on time it did not use
+                active = [self.usage.get(x.client, 0.0) for x in self.waiting]
+                self.usage[waiter.client] = min(active) if active else 0.0
+
+            self.waiting.append(waiter)
+            self.notify()
+
+        waiter.event.wait()
+        if waiter.cancelled:
+            raise JobCancelledError(f"Job {id_task} was cancelled")
+
+        return True
+
+    def cancel(self, id_task):
+        """Takes the waiting job with id_task out of the queue; its acquire raises JobCancelledError. Returns False if
+        there is no such job waiting."""
+        with self.lock:
+            waiter = next((x for x in self.waiting if x.id_task == id_task), None)
+            if waiter is None:
+                return False
+
+            self.waiting.remove(waiter)
+            waiter.cancelled = True
+            self.notify()
+
+        waiter.event.set()
+        return True
+
+    def grant(self, waiter):
+        waiter.started_at = time.time()
+        self.holders.append(waiter)
+
+        metrics.queue_wait_seconds.observe(waiter.started_at - waiter.queued_at, priority=waiter.priority)
+
+        if waiter.model is not None:
+            self.last_model = waiter.model
+
+        self.notify()
+
+    def notify(self):
+        for listener in self.listeners:
+            listener()
+
+    def release(self):
+        granted = []
+
+        with self.lock:
+            thread = threading.get_ident()
+            holder = next((x for x in self.holders if x.thread == thread), self.holders[0])
+            self.usage[holder.client] = self.usage.get(holder.client, 0.0) + time.time() - holder.started_at
+            self.holders.remove(holder)
+
+            if not self.waiting and not self.holders:
+                self.usage.clear()
+                return
+
+            while self.waiting and len(self.holders) < self.get_slots():
+                waiter = self.next_waiter()
+                self.waiting.remove(waiter)
+                self.grant(waiter)
+                granted.append(waiter)
+
+        for waiter in granted:
+            waiter.event.set()
+
+    __enter__ = acquire
+
+    def __exit__(self, t, v, tb):
+        self.release()
+
+    def queue_info(self):
+        """Waiting jobs in the order they would get the lock right now, not counting the affinity window"""
+
+        now = time.time()
+        with self.lock:
+            usage = dict(self.usage)
+            for holder in self.holders:
+                # jobs that are running now will be counted when they finish
+                usage[holder.client] = usage.get(holder.client, 0.0) + now - holder.started_at
+
+            waiting = sorted(self.waiting, key=lambda x: self.sort_key(x, usage))
+            return [{"id_task": x.id_task, "priority": x.priority, "client": x.client, "waiting": now - x.queued_at, "model": x.model} for x in waiting]
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import torch
+
+from modules import errors
+
+
+class LocalChatModel:
+    """A small instruction-tuned causal language model from transformers, run in-process on the CPU.
+
+    Answers chat completion payloads with responses in the format of the OpenAI API, so that prompt enhancement
+    works the same as with a remote server. The model is loaded on first use."""
+
+    def __init__(self, model_name, device="cpu"):
+        self.model_name = model_name
+        self.device = torch.device(device)
+        self.model = None
+        self.tokenizer = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.model is not None:
+            return
+
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        t = time.time()
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.float32).to(self.device)
+        self.model.eval()
+        print(f"Loaded local language model {self.model_name} in {time.time() - t:.1f}s")
+
+    def encode_messages(self, messages):
+        if getattr(self.tokenizer, "chat_template", None) and hasattr(self.tokenizer, "apply_chat_template"):
+            return self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt")
+
+        # tokenizers without a chat template (or older transformers): a plain transcript
+        text = "".join(f"{message['role']}: {message['content']}\n\n" for message in messages) + "assistant: "
+        return self.tokenizer(text, return_tensors="pt").input_ids
+
+    def generate(self, payload):
+        input_ids = self.encode_messages(payload["messages"]).to(self.device)
+        temperature = payload.get("temperature", 0)
+
+        with torch.inference_mode():
+            output = self.model.generate(
+                input_ids,
+                max_new_tokens=payload.get("max_tokens", 256),
+                do_sample=temperature > 0,
+                temperature=temperature if temperature > 0 else None,
+                pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id,
+            )
+
+        return self.tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+    def complete(self, payload):
+        """Generates the answer to a chat completions payload; returns a dict shaped like an OpenAI API response"""
+
+        with self.lock:
+            try:
+                self.load()
+            except Exception as e:
+                errors.display(e, f"loading local language model {self.model_name}")
+                return {"error": f"Could not load local model {self.model_name}: {e}"}
+
+            try:
+                text = self.generate(payload)
+            except Exception as e:
+                errors.display(e, f"generating text with local language model {self.model_name}")
+                return {"error": f"Local model error: {e}"}
+
+        return {
+            "model": self.model_name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        }
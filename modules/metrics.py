@@ -0,0 +1,227 @@
+import contextlib
+import math
+import threading
+import time
+
+
+class Metric:
+    """A metric in the Prometheus text format, with one value per combination of label values.
+
+    Updating one takes a lock and a dict lookup, so metrics stay on all the time; gauges can instead be given a
+    function that computes their value when /metrics is read."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self.lock = threading.Lock()
+        self.values = {}
+
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(x, "")) for x in self.labelnames)
+
+    def samples(self):
+        """(suffix, labels, value) for every sample of this metric"""
+        with self.lock:
+            values = dict(self.values)
+
+        for key, value in values.items():
+            yield "", dict(zip(self.labelnames, key)), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}")
+
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    """func, if given, returns the value, or a dict of {label value tuple: value} for a gauge with labels"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.func is None:
+            yield from super().samples()
+            return
+
+        try:
+            values = self.func()
+        except Exception:
+            return
+
+        if values is None:
+            return
+
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        for key, value in values.items():
+            yield "", dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+
+        for key, (counts, total, count) in values.items():
+            labels = dict(zip(self.labelnames, key))
+
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield "_bucket", {**labels, "le": format_value(bound)}, cumulative
+
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+registry = []
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+
+    return "\n".join(lines) + "\n"
+
+
+def queue_depth():
+    from modules import call_queue
+
+    return len(call_queue.queue_lock.waiting)
+
+
+def vram():
+    from modules import shared
+
+    if shared.mem_mon is None or shared.mem_mon.disabled:
+        return None
+
+    data = shared.mem_mon.read()
+    return {(x,): data[x] for x in ("active_peak", "reserved_peak", "total")}
+
+
+def cache_hit_ratio():
+    with cache_requests.lock:
+        requests = dict(cache_requests.values)
+
+    res = {}
+    for cache, result in requests:
+        hits = requests.get((cache, "hit"), 0)
+        res[(cache,)] = hits / max(hits + requests.get((cache, "miss"), 0), 1)
+
+    return res
+
+
+def checkpoint_cache_bytes():
+    from modules import sd_models_cache
+
+    info = sd_models_cache.checkpoints.info()
+    return {("mapped",): info["mapped"], ("ram",): info["used"]}
+
+
+queue_waiting = Gauge("sd_queue_depth", "Jobs waiting for the GPU", func=queue_depth)
+queue_wait_seconds = Histogram("sd_queue_wait_seconds", "Time jobs waited for the GPU", ["priority"], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+stage_seconds = Histogram("sd_stage_seconds", "Time spent in each stage of generation", ["stage"])
+sampling_steps = Counter("sd_sampling_steps_total", "Sampling steps done")
+sampling_speed = Gauge("sd_sampling_iterations_per_second", "Sampling speed of the last sampling run")
+vram_bytes = Gauge("sd_vram_bytes", "GPU memory: peak in use and reserved by torch since the last job started, and total", ["kind"], func=vram)
+model_loads = Counter("sd_model_loads_total", "Checkpoints loaded from disk into a new model")
+model_swaps = Counter("sd_model_swaps_total", "Times the checkpoint in use was changed")
+cache_requests = Counter("sd_cache_requests_total", "Lookups in caches", ["cache", "result"])
+cache_hits = Gauge("sd_cache_hit_ratio", "Share of lookups in each cache that were hits", ["cache"], func=cache_hit_ratio)
+checkpoint_cache = Gauge("sd_checkpoint_cache_bytes", "Size of checkpoints in the checkpoint cache, held as memory-mapped views of the file or as copies in RAM", ["kind"], func=checkpoint_cache_bytes)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Adds the time spent in the with block to the histogram for stage name; GPU work is counted when a later
+    operation waits for it, there is no synchronization here"""
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage=name)
+
+
+@contextlib.contextmanager
+def sampling():
+    """stage("sampling") that also sets the sampling speed from the steps done in the with block"""
+
+    started = time.perf_counter()
+    steps = sampling_steps.get()
+
+    with stage("sampling"):
+        yield
+
+    done = sampling_steps.get() - steps
+    if done > 0:
+        sampling_speed.set(done / (time.perf_counter() - started))
+
+
+def cache_lookup(cache, hit):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
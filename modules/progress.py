@@ -1,8 +1,9 @@
-import base64
-import io
+import asyncio
 import time
 
 import gradio as gr
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
 from modules.shared import opts
@@ -19,6 +20,10 @@ finished_tasks = []
 recorded_results = []
 recorded_results_limit = 2
 
+worker_tasks = {}
+"""tasks running in worker processes (--workers mode), with their progress as last reported by the worker: a dict with
+job_count, job_no, sampling_steps, sampling_step, time_start and textinfo from the worker's shared.state, or None"""
+
 
 def start_task(id_task):
     global current_task
@@ -27,12 +32,25 @@ def start_task(id_task):
     pending_tasks.pop(id_task, None)
 
 
+def start_worker_task(id_task):
+    """Like start_task, for a task that runs in a worker process; several of them can run at once"""
+    worker_tasks[id_task] = None
+    pending_tasks.pop(id_task, None)
+
+
+def update_worker_task(id_task, state):
+    if id_task in worker_tasks:
+        worker_tasks[id_task] = state
+
+
 def finish_task(id_task):
     global current_task
 
     if current_task == id_task:
         current_task = None
 
+    worker_tasks.pop(id_task, None)
+
     finished_tasks.append(id_task)
     if len(finished_tasks) > 16:
         finished_tasks.pop(0)
@@ -52,9 +70,30 @@ def record_results(id_task, res):
 def add_task_to_queue(id_job):
     pending_tasks[id_job] = time.time()
 
+
+def remove_task_from_queue(id_job):
+    pending_tasks.pop(id_job, None)
+
+
+def queued_tasks_in_order():
+    """Ids of pending tasks, in the order the scheduler would run them now"""
+    from modules import call_queue
+
+    order = {x["id_task"]: i for i, x in enumerate(call_queue.queue_lock.queue_info())}
+    return sorted(pending_tasks, key=lambda x: (order.get(x, len(order)), pending_tasks[x]))
+
+
+class PendingTask(BaseModel):
+    id_task: str = Field(default=None, title="Task ID")
+    priority: str = Field(title="Priority", description="interactive, batch or background")
+    client: str = Field(title="Client", description="who queued the job; fair share is counted per client")
+    waiting: float = Field(title="Waiting time in secs")
+
 class PendingTasksResponse(BaseModel):
     size: int = Field(title="Pending task size")
-    tasks: List[str] = Field(title="Pending task ids")
+    tasks: List[str] = Field(title="Pending task ids", description="in the order they will run")
+    queue: List[PendingTask] = Field(default=[], title="Jobs waiting for the GPU", description="in the order they will run, including jobs without a task id")
+    swaps_avoided: int = Field(default=0, title="Model swaps avoided", description="times a job was run ahead of others because its checkpoint was loaded already, since startup")
 
 class ProgressRequest(BaseModel):
     id_task: str = Field(default=None, title="Task ID", description="id of the task to get progress for")
@@ -75,43 +114,55 @@ class ProgressResponse(BaseModel):
 
 def setup_progress_api(app):
     app.add_api_route("/internal/pending-tasks", get_pending_tasks, methods=["GET"])
+    app.add_api_route("/internal/progress/stream", progress_stream, methods=["GET"])
     return app.add_api_route("/internal/progress", progressapi, methods=["POST"], response_model=ProgressResponse)
 
 
 def get_pending_tasks():
-    pending_tasks_ids = list(pending_tasks)
+    from modules import call_queue
+
+    pending_tasks_ids = queued_tasks_in_order()
     pending_len = len(pending_tasks_ids)
-    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids)
+    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids, queue=call_queue.queue_lock.queue_info(), swaps_avoided=call_queue.queue_lock.swaps_avoided)
+
+
+def progress_and_eta(job_count, job_no, sampling_steps, sampling_step, time_start):
+    progress = 0
+
+    if job_count > 0:
+        progress += job_no / job_count
+    if sampling_steps > 0 and job_count > 0:
+        progress += 1 / job_count * sampling_step / sampling_steps
+
+    progress = min(progress, 1)
+
+    elapsed_since_start = time.time() - time_start if time_start is not None else 0
+    predicted_duration = elapsed_since_start / progress if progress > 0 else None
+    eta = predicted_duration - elapsed_since_start if predicted_duration is not None else None
+
+    return progress, eta
 
 
 def progressapi(req: ProgressRequest):
-    active = req.id_task == current_task
+    active = req.id_task == current_task or req.id_task in worker_tasks
     queued = req.id_task in pending_tasks
     completed = req.id_task in finished_tasks
 
     if not active:
         textinfo = "Waiting..."
         if queued:
-            sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
+            sorted_queued = queued_tasks_in_order()
             queue_index = sorted_queued.index(req.id_task)
             textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
         return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
 
-    progress = 0
+    if req.id_task in worker_tasks:
+        # no live previews from workers
+        state = worker_tasks.get(req.id_task) or {}
+        progress, eta = progress_and_eta(state.get("job_count", 0), state.get("job_no", 0), state.get("sampling_steps", 0), state.get("sampling_step", 0), state.get("time_start"))
+        return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, id_live_preview=req.id_live_preview, textinfo=state.get("textinfo"))
 
-    job_count, job_no = shared.state.job_count, shared.state.job_no
-    sampling_steps, sampling_step = shared.state.sampling_steps, shared.state.sampling_step
-
-    if job_count > 0:
-        progress += job_no / job_count
-    if sampling_steps > 0 and job_count > 0:
-        progress += 1 / job_count * sampling_step / sampling_steps
-
-    progress = min(progress, 1)
-
-    elapsed_since_start = time.time() - shared.state.time_start
-    predicted_duration = elapsed_since_start / progress if progress > 0 else None
-    eta = predicted_duration - elapsed_since_start if predicted_duration is not None else None
+    progress, eta = progress_and_eta(shared.state.job_count, shared.state.job_no, shared.state.sampling_steps, shared.state.sampling_step, shared.state.time_start)
 
     live_preview = None
     id_live_preview = req.id_live_preview
@@ -119,28 +170,52 @@ def progressapi(req: ProgressRequest):
     if opts.live_previews_enable and req.live_preview:
         shared.state.set_current_image()
         if shared.state.id_live_preview != req.id_live_preview:
-            image = shared.state.current_image
-            if image is not None:
-                buffered = io.BytesIO()
-
-                if opts.live_previews_image_format == "png":
-                    # using optimize for large images takes an enormous amount of time
-                    if max(*image.size) <= 256:
-                        save_kwargs = {"optimize": True}
-                    else:
-                        save_kwargs = {"optimize": False, "compress_level": 1}
-
-                else:
-                    save_kwargs = {}
-
-                image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
-                base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
-                live_preview = f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
+            encoded = shared.state.current_image_base64()
+            if encoded is not None:
+                image_format, base64_image = encoded
+                live_preview = f"data:image/{image_format};base64,{base64_image}"
                 id_live_preview = shared.state.id_live_preview
 
     return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
 
 
+async def progress_events(id_task, live_preview=True, inactivity_timeout=40):
+    """Yields server-sent events with the progress of a task, as returned by progressapi, every
+    live_preview_refresh_period until the task is over. A live preview frame is only sent once.
+
+    Runs on the event loop, so an open stream does not take a thread from the pool that serves sync routes; only a
+    poll that may decode and encode a preview frame is moved to a pool thread, for as long as that takes."""
+
+    started = time.time()
+    was_active = False
+    id_live_preview = -1
+
+    while True:
+        req = ProgressRequest(id_task=id_task, id_live_preview=id_live_preview, live_preview=live_preview)
+        if live_preview and opts.live_previews_enable and id_task == current_task:
+            res = await run_in_threadpool(progressapi, req)
+        else:
+            res = progressapi(req)
+
+        id_live_preview = res.id_live_preview
+        was_active = was_active or res.active
+
+        yield f"data: {res.json()}\n\n"
+
+        if res.completed or (was_active and not res.active):
+            return
+
+        if not res.active and not res.queued and time.time() - started > inactivity_timeout:
+            return
+
+        await asyncio.sleep((opts.live_preview_refresh_period or 500) / 1000)
+
+
+async def progress_stream(id_task: str, live_preview: bool = True, inactivity_timeout: float = 40):
+    """Progress of a task pushed to the client as server-sent events, instead of the client polling /internal/progress"""
+    return StreamingResponse(progress_events(id_task, live_preview, inactivity_timeout), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 def restore_progress(id_task):
     while id_task == current_task or id_task in pending_tasks:
         time.sleep(0.1)
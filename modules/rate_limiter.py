@@ -0,0 +1,185 @@
+import contextlib
+import math
+import re
+import sqlite3
+import threading
+import time
+
+
+class Bucket:
+    def __init__(self, capacity, rate, level=None, updated=None):
+        self.capacity = capacity
+        """maximum number of units that can be spent in a burst"""
+
+        self.rate = rate
+        """units added back per second"""
+
+        self.level = capacity if level is None else level
+        self.updated = time.time() if updated is None else updated
+
+    def refill(self, now):
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, amount, now):
+        """Takes amount out of the bucket, going into debt if there is not enough; returns how many seconds
+        the caller has to wait for the debt to be repaid."""
+
+        self.refill(now)
+        self.level -= amount
+
+        if self.level >= 0:
+            return 0.0
+
+        return -self.level / self.rate if self.rate > 0 else math.inf
+
+
+class RateLimiterState:
+    def __init__(self, buckets, blocked_until=0.0):
+        self.buckets = buckets
+        self.blocked_until = blocked_until
+
+
+def parse_duration(text):
+    """Parses durations as sent in OpenAI's x-ratelimit-reset-* headers, like "1s", "6m0s", "17ms" or "1h2m3.5s"; returns seconds."""
+
+    if not text:
+        return None
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", text.strip())
+    if not parts:
+        try:
+            return float(text)
+        except ValueError:
+            return None
+
+    multipliers = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(value) * multipliers[unit] for value, unit in parts)
+
+
+class RateLimiter:
+    """Token bucket rate limiter for an HTTP API with a budget for requests and a budget for tokens.
+
+    Starts with the limits it is given, and adjusts them to what the server reports in x-ratelimit-* response headers.
+    Callers reserve their share up front with reserve() and then sleep for the returned number of seconds, so that the
+    same limiter works for threads and for asyncio tasks. Safe to use from multiple threads."""
+
+    names = ("requests", "tokens")
+
+    def __init__(self, requests_per_minute=30, tokens_per_minute=None):
+        self.lock = threading.Lock()
+        self.initial_limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.state = self.create_state()
+
+    def create_state(self):
+        buckets = {}
+        for name, per_minute in self.initial_limits.items():
+            if per_minute:
+                buckets[name] = Bucket(capacity=per_minute, rate=per_minute / 60)
+            else:
+                buckets[name] = Bucket(capacity=math.inf, rate=math.inf)
+
+        return RateLimiterState(buckets)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            yield self.state
+
+    def reserve(self, tokens=0):
+        """Reserves budget for one request that will use the given number of tokens; returns seconds to wait before sending it."""
+
+        now = time.time()
+        with self.transaction() as state:
+            wait = max(0.0, state.blocked_until - now)
+            wait = max(wait, state.buckets["requests"].reserve(1, now))
+            wait = max(wait, state.buckets["tokens"].reserve(tokens, now))
+
+        return wait
+
+    def block(self, seconds):
+        """Stops all requests for the given number of seconds, for when the server responds with Retry-After."""
+
+        with self.transaction() as state:
+            state.blocked_until = max(state.blocked_until, time.time() + seconds)
+
+    def update_from_headers(self, headers):
+        """Learns the actual limits and remaining budget from x-ratelimit-limit-*, x-ratelimit-remaining-* and
+        x-ratelimit-reset-* response headers."""
+
+        now = time.time()
+        with self.transaction() as state:
+            for name in self.names:
+                try:
+                    limit = float(headers[f"x-ratelimit-limit-{name}"])
+                    remaining = float(headers[f"x-ratelimit-remaining-{name}"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+                if limit <= 0:
+                    continue
+
+                bucket = state.buckets[name]
+                bucket.refill(now)
+
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{name}"))
+                if reset and remaining < limit:
+                    bucket.rate = (limit - remaining) / reset
+                else:
+                    bucket.rate = limit / 60
+
+                if bucket.capacity != limit:
+                    # first time we hear about this limit: trust the server's count
+                    bucket.capacity = limit
+                    bucket.level = remaining
+                else:
+                    bucket.level = min(bucket.level, remaining)
+
+    def stats(self):
+        now = time.time()
+        with self.transaction() as state:
+            res = {}
+            for name, bucket in state.buckets.items():
+                bucket.refill(now)
+                res[name] = {"capacity": bucket.capacity, "available": bucket.level, "per_second": bucket.rate}
+
+            res["blocked_for"] = max(0.0, state.blocked_until - now)
+
+        return res
+
+
+class SqliteRateLimiter(RateLimiter):
+    """RateLimiter that keeps its state in an sqlite file, so that multiple webui processes pointing at the same
+    file share one budget."""
+
+    def __init__(self, filename, requests_per_minute=30, tokens_per_minute=None):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, capacity REAL, rate REAL, level REAL, updated REAL)")
+
+        super().__init__(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            # IMMEDIATE takes the write lock right away, so other processes wait for this transaction to finish
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                state = self.state
+                rows = self.connection.execute("SELECT name, capacity, rate, level, updated FROM buckets").fetchall()
+                for name, capacity, rate, level, updated in rows:
+                    if name == "blocked_until":
+                        state.blocked_until = level
+                    elif name in state.buckets:
+                        state.buckets[name] = Bucket(capacity, rate, level, updated)
+
+                yield state
+
+                values = [(name, b.capacity, b.rate, b.level, b.updated) for name, b in state.buckets.items()]
+                values.append(("blocked_until", 0.0, 0.0, state.blocked_until, 0.0))
+                self.connection.executemany("INSERT OR REPLACE INTO buckets (name, capacity, rate, level, updated) VALUES (?, ?, ?, ?, ?)", values)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
@@ -183,12 +183,19 @@ class LoadStateDictOnMeta(ReplaceHelper):
                 key = prefix + name
                 sd_param = sd.pop(key, None)
                 if sd_param is not None:
-                    state_dict[key] = sd_param.to(dtype=self.get_weight_dtype(key))
+                    # a parameter created below is already in the target dtype, so the tensor from the checkpoint (for a
+                    # memory-mapped one, a view of the file) is converted while it is copied in, without a converted copy
+                    state_dict[key] = sd_param if param.is_meta else sd_param.to(dtype=self.get_weight_dtype(key))
                     used_param_keys.append(key)
 
                 if param.is_meta:
-                    dtype = sd_param.dtype if sd_param is not None else param.dtype
-                    module._parameters[name] = torch.nn.parameter.Parameter(torch.zeros_like(param, device=device, dtype=dtype), requires_grad=param.requires_grad)
+                    if sd_param is not None:
+                        dtype = self.get_weight_dtype(key) or sd_param.dtype
+                        tensor = torch.empty_like(param, device=device, dtype=dtype)
+                    else:
+                        tensor = torch.zeros_like(param, device=device)
+
+                    module._parameters[name] = torch.nn.parameter.Parameter(tensor, requires_grad=param.requires_grad)
 
             for name in module._buffers:
                 key = prefix + name
@@ -1,4 +1,3 @@
-import collections
 import importlib
 import os
 import sys
@@ -12,7 +11,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches, metrics, sd_models_manifest, sd_models_prefetch, sd_models_cache, sd_models_mmap
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -24,7 +23,13 @@ model_path = os.path.abspath(os.path.join(paths.models_path, model_dir))
 checkpoints_list = {}
 checkpoint_aliases = {}
 checkpoint_alisases = checkpoint_aliases  # for compatibility with old name
-checkpoints_loaded = collections.OrderedDict()
+checkpoints_loaded = sd_models_cache.checkpoints
+
+checkpoints_lock = threading.RLock()
+"""held while checkpoints_list and checkpoint_aliases are changed, and while checkpoint_tiles reads them"""
+
+hashed_in_background = []
+"""checkpoints whose hash was calculated by a hashing thread; apply_background_hashes gives them their new titles"""
 
 
 class ModelType(enum.Enum):
@@ -71,26 +76,31 @@ class CheckpointInfo:
         if name.startswith("\\") or name.startswith("/"):
             name = name[1:]
 
-        def read_metadata():
-            metadata = read_metadata_from_safetensors(filename)
-            self.modelspec_thumbnail = metadata.pop('modelspec.thumbnail', None)
-
-            return metadata
-
-        self.metadata = {}
-        if self.is_safetensors:
-            try:
-                self.metadata = cache.cached_data_for_file('safetensors-metadata', "checkpoint/" + name, filename, read_metadata)
-            except Exception as e:
-                errors.display(e, f"reading metadata for {filename}")
+        self._metadata = None
 
         self.name = name
         self.name_for_extra = os.path.splitext(os.path.basename(filename))[0]
         self.model_name = os.path.splitext(name.replace("/", "_").replace("\\", "_"))[0]
-        self.hash = model_hash(filename)
 
-        self.sha256 = hashes.sha256_from_cache(self.filename, f"checkpoint/{name}")
+        # for files that did not change since the last listing, everything below comes from the manifest without reading them
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            stat = None
+
+        entry = sd_models_manifest.checkpoints.get(filename, stat)
+        if "hash" not in entry:
+            entry["hash"] = model_hash(filename)
+        if entry.get("sha256") is None and stat is not None:
+            sha256 = hashes.sha256_from_cache(self.filename, f"checkpoint/{name}", ondisk_mtime=stat.st_mtime)
+            if sha256 is not None:
+                entry["sha256"] = sha256
+
+        self.hash = entry["hash"]
+        self.sha256 = entry.get("sha256")
         self.shorthash = self.sha256[0:10] if self.sha256 else None
+        self.config_guess = entry.get("config")
+        """config the checkpoint was loaded with last time, or None; used instead of guessing it from the weights again"""
 
         self.title = name if self.shorthash is None else f'{name} [{self.shorthash}]'
         self.short_title = self.name_for_extra if self.shorthash is None else f'{self.name_for_extra} [{self.shorthash}]'
@@ -99,16 +109,51 @@ class CheckpointInfo:
         if self.shorthash:
             self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
+    @property
+    def metadata(self):
+        """safetensors metadata; read when first needed, as it is only shown in a few places"""
+        if self._metadata is not None:
+            return self._metadata
+
+        def read_metadata():
+            metadata = read_metadata_from_safetensors(self.filename)
+            self.modelspec_thumbnail = metadata.pop('modelspec.thumbnail', None)
+
+            return metadata
+
+        self._metadata = {}
+        if self.is_safetensors:
+            try:
+                self._metadata = cache.cached_data_for_file('safetensors-metadata', "checkpoint/" + self.name, self.filename, read_metadata)
+            except Exception as e:
+                errors.display(e, f"reading metadata for {self.filename}")
+
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
     def register(self):
-        checkpoints_list[self.title] = self
-        for id in self.ids:
-            checkpoint_aliases[id] = self
+        with checkpoints_lock:
+            checkpoints_list[self.title] = self
+            for id in self.ids:
+                checkpoint_aliases[id] = self
+
+    def calculate_shorthash(self, background=False):
+        """Sets sha256 and shorthash, calculating the hash if it is not in cache; with background=True, does not wait for it:
+        the hash is queued, and the checkpoint (and the model loaded from it) gets it once it is calculated"""
+
+        if background:
+            self.sha256 = hashes.sha256_in_background(self.filename, f"checkpoint/{self.name}", on_done=lambda _: hashed_in_background.append(self))
+        else:
+            self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
 
-    def calculate_shorthash(self):
-        self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
         if self.sha256 is None:
             return
 
+        sd_models_manifest.checkpoints.update(self.filename, sha256=self.sha256)
+
         shorthash = self.sha256[0:10]
         if self.shorthash == self.sha256[0:10]:
             return self.shorthash
@@ -118,12 +163,13 @@ class CheckpointInfo:
         if self.shorthash not in self.ids:
             self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
-        old_title = self.title
-        self.title = f'{self.name} [{self.shorthash}]'
-        self.short_title = f'{self.name_for_extra} [{self.shorthash}]'
+        with checkpoints_lock:
+            old_title = self.title
+            self.title = f'{self.name} [{self.shorthash}]'
+            self.short_title = f'{self.name_for_extra} [{self.shorthash}]'
 
-        replace_key(checkpoints_list, old_title, self.title, self)
-        self.register()
+            replace_key(checkpoints_list, old_title, self.title, self)
+            self.register()
 
         return self.shorthash
 
@@ -140,20 +186,22 @@ except Exception:
 def setup_model():
     """called once at startup to do various one-time tasks related to SD models"""
 
+    from modules import call_queue
+
     os.makedirs(model_path, exist_ok=True)
 
     enable_midas_autodownload()
     patch_given_betas()
 
+    sd_models_prefetch.prefetcher.attach(call_queue.queue_lock, call_queue.loaded_checkpoints)
+
 
 def checkpoint_tiles(use_short=False):
-    return [x.short_title if use_short else x.title for x in checkpoints_list.values()]
+    with checkpoints_lock:
+        return [x.short_title if use_short else x.title for x in checkpoints_list.values()]
 
 
 def list_models():
-    checkpoints_list.clear()
-    checkpoint_aliases.clear()
-
     cmd_ckpt = shared.cmd_opts.ckpt
     if shared.cmd_opts.no_download_sd_model or cmd_ckpt != shared.sd_model_file or os.path.exists(cmd_ckpt):
         model_url = None
@@ -164,17 +212,26 @@ def list_models():
 
     model_list = modelloader.load_models(model_path=model_path, model_url=model_url, command_path=shared.cmd_opts.ckpt_dir, ext_filter=[".ckpt", ".safetensors"], download_name="v1-5-pruned-emaonly.safetensors", ext_blacklist=[".vae.ckpt", ".vae.safetensors"], hash_prefix=expected_sha256)
 
-    if os.path.exists(cmd_ckpt):
-        checkpoint_info = CheckpointInfo(cmd_ckpt)
-        checkpoint_info.register()
+    with checkpoints_lock:
+        checkpoints_list.clear()
+        checkpoint_aliases.clear()
+
+        if os.path.exists(cmd_ckpt):
+            checkpoint_info = CheckpointInfo(cmd_ckpt)
+            checkpoint_info.register()
 
-        shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
-    elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
-        print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
+            shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
+        elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
+            print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
 
-    for filename in model_list:
-        checkpoint_info = CheckpointInfo(filename)
-        checkpoint_info.register()
+        for filename in model_list:
+            checkpoint_info = CheckpointInfo(filename)
+            checkpoint_info.register()
+
+        sd_models_manifest.checkpoints.retain(x.filename for x in checkpoints_list.values())
+        sd_models_manifest.checkpoints.save()
+
+    apply_background_hashes()
 
 
 re_strip_checksum = re.compile(r"\s*\[[^]]+]\s*$")
@@ -329,21 +386,64 @@ def read_state_dict(checkpoint_file, print_global_state=False, map_location=None
     return sd
 
 
+def apply_background_hashes():
+    """Retitles checkpoints whose hash was calculated in background; called when models are listed or loaded rather than
+    from the hashing thread, so that checkpoints_list and settings are not changed while other threads use them"""
+    with checkpoints_lock:
+        while hashed_in_background:
+            update_model_hash(hashed_in_background.pop(0))
+
+
+def update_model_hash(checkpoint_info):
+    """Gives checkpoint_info, and the model loaded from it, the hash that has been calculated in background"""
+    checkpoint_info.calculate_shorthash()
+
+    for model in model_data.loaded_sd_models:
+        if model.sd_checkpoint_info is checkpoint_info:
+            model.sd_model_hash = checkpoint_info.shorthash
+
+    if model_data.sd_model is not None and model_data.sd_model.sd_checkpoint_info is checkpoint_info and not SkipWritingToConfig.skip:
+        shared.opts.data["sd_model_checkpoint"] = checkpoint_info.title
+        shared.opts.data["sd_checkpoint_hash"] = checkpoint_info.sha256
+
+
+def record_config_guess(checkpoint_info, checkpoint_config):
+    if checkpoint_info is not None:
+        checkpoint_info.config_guess = checkpoint_config
+        sd_models_manifest.checkpoints.update(checkpoint_info.filename, config=checkpoint_config)
+
+
 def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    apply_background_hashes()
+    sd_model_hash = checkpoint_info.calculate_shorthash(background=True) or checkpoint_info.hash
     timer.record("calculate hash")
 
-    if checkpoint_info in checkpoints_loaded:
-        # use checkpoint cache
+    cached = checkpoints_loaded.get(checkpoint_info)
+    metrics.cache_lookup("checkpoint", hit=cached is not None)
+
+    if cached is not None:
         print(f"Loading weights [{sd_model_hash}] from cache")
-        # move to end as latest
-        checkpoints_loaded.move_to_end(checkpoint_info)
-        return checkpoints_loaded[checkpoint_info]
+        return cached
+
+    prefetched = sd_models_prefetch.prefetcher.take(checkpoint_info)
+    if prefetched is not None and prefetched.state_dict is not None:
+        print(f"Loading weights [{sd_model_hash}] prefetched into RAM")
+        timer.record("load weights from prefetch")
+        timer.add_time_to_record("prefetch saved", prefetched.seconds)
+        return prefetched.state_dict
 
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
-    res = read_state_dict(checkpoint_info.filename)
+    if sd_models_mmap.can_map(checkpoint_info.filename):
+        # tensors are views of the file, read one at a time as they are copied into the model's parameters
+        res = get_state_dict_from_checkpoint(sd_models_mmap.read_mapped(checkpoint_info.filename))
+    else:
+        res = read_state_dict(checkpoint_info.filename)
     timer.record("load weights from disk")
 
+    if prefetched is not None:
+        # the file was read into the page cache in background
+        timer.add_time_to_record("prefetch saved", prefetched.seconds)
+
     return res
 
 
@@ -408,7 +508,7 @@ def set_model_fields(model):
 
 
 def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer):
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    sd_model_hash = checkpoint_info.calculate_shorthash(background=True)
     timer.record("calculate hash")
 
     if devices.fp8:
@@ -430,9 +530,8 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     if model.is_ssd:
         sd_hijack.model_hijack.convert_sdxl_to_ssd(model)
 
-    if shared.opts.sd_checkpoint_cache > 0:
-        # cache newly loaded model
-        checkpoints_loaded[checkpoint_info] = state_dict.copy()
+    # cache newly loaded model
+    checkpoints_loaded.put(checkpoint_info, state_dict)
 
     if hasattr(model, "before_load_weights"):
         model.before_load_weights(state_dict)
@@ -521,8 +620,7 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     timer.record("apply dtype to VAE")
 
     # clean up cache if limit is reached
-    while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache:
-        checkpoints_loaded.popitem(last=False)
+    checkpoints_loaded.trim()
 
     model.sd_model_hash = sd_model_hash
     model.sd_model_checkpoint = checkpoint_info.filename
@@ -788,6 +886,7 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
     checkpoint_info = checkpoint_info or select_checkpoint()
 
     timer = Timer()
+    metrics.model_loads.inc()
 
     if model_data.sd_model:
         send_model_to_trash(model_data.sd_model)
@@ -802,6 +901,7 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
         state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
     checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+    record_config_guess(checkpoint_info, checkpoint_config)
     clip_is_included_into_sd = any(x for x in [sd1_clip_weight, sd2_clip_weight, sdxl_clip_weight, sdxl_refiner_clip_weight] if x in state_dict)
 
     timer.record("find config")
@@ -938,6 +1038,8 @@ def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
 
 
 def reload_model_weights(sd_model=None, info=None, forced_reload=False):
+    apply_background_hashes()
+
     checkpoint_info = info or select_checkpoint()
 
     timer = Timer()
@@ -955,6 +1057,9 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
         elif sd_model.sd_model_checkpoint == checkpoint_info.filename and not forced_reload:
             return sd_model
 
+    if current_checkpoint_info is not None:
+        metrics.model_swaps.inc()
+
     sd_model = reuse_model_from_already_loaded(sd_model, checkpoint_info, timer)
     if not forced_reload and sd_model is not None and sd_model.sd_checkpoint_info.filename == checkpoint_info.filename:
         return sd_model
@@ -967,6 +1072,7 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
     state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
     checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+    record_config_guess(checkpoint_info, checkpoint_config)
 
     timer.record("find config")
 
@@ -0,0 +1,157 @@
+import collections
+import threading
+import time
+
+import psutil
+import torch
+
+from modules import shared, sd_models_mmap
+
+
+class Entry:
+    def __init__(self, checkpoint_info, state_dict):
+        self.checkpoint_info = checkpoint_info
+        self.mapped = isinstance(state_dict, sd_models_mmap.MappedStateDict)
+        self.state_dict = sd_models_mmap.MappedStateDict(state_dict) if self.mapped else dict(state_dict)
+        self.bytes = state_dict_bytes(state_dict)
+        self.charged = state_dict.copied_bytes if self.mapped else self.bytes
+        """bytes counted against the budget: all of a copy in RAM, only tensors copied into RAM for a mapped checkpoint"""
+        self.hits = 0
+        self.added = time.time()
+        self.last_used = self.added
+
+
+def state_dict_bytes(state_dict):
+    return sum(x.nelement() * x.element_size() for x in state_dict.values() if isinstance(x, torch.Tensor))
+
+
+class CheckpointCache:
+    """Weights of recently loaded checkpoints kept in RAM, so that switching back to one does not read its file again.
+
+    Checkpoints held as copies in RAM are bounded by the sd_checkpoint_cache_size setting in bytes, evicting the least
+    recently used one first. Safetensors checkpoints are kept as memory-mapped views of the file, which live in the page
+    cache rather than as a second copy in RAM; only the few tensors that had to be copied count against the budget, and
+    the OS drops their pages by itself. Mapped checkpoints still keep their files open and their pages referenced, so
+    there are at most sd_checkpoint_cache_mapped of them. All checkpoints count against the old sd_checkpoint_cache
+    count, if set. When free RAM drops below sd_checkpoint_cache_min_free_ram, checkpoints holding RAM are evicted as
+    well."""
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def budget(self):
+        return int(getattr(shared.opts, "sd_checkpoint_cache_size", 0) * 1024 ** 3)
+
+    def count_limit(self):
+        return getattr(shared.opts, "sd_checkpoint_cache", 0)
+
+    def mapped_limit(self):
+        return getattr(shared.opts, "sd_checkpoint_cache_mapped", 0)
+
+    def min_free_ram(self):
+        return int(getattr(shared.opts, "sd_checkpoint_cache_min_free_ram", 0) * 1024 ** 3)
+
+    def enabled(self):
+        return self.budget() > 0 or self.count_limit() > 0
+
+    def __contains__(self, checkpoint_info):
+        return checkpoint_info in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, checkpoint_info):
+        """State dict of checkpoint_info if it is cached, else None"""
+        with self.lock:
+            entry = self.entries.get(checkpoint_info)
+            if entry is None:
+                return None
+
+            self.entries.move_to_end(checkpoint_info)
+            entry.hits += 1
+            entry.last_used = time.time()
+
+            return entry.state_dict
+
+    def put(self, checkpoint_info, state_dict):
+        """Caches state_dict, a shallow copy of it, as it is before loading into a model takes tensors out of it"""
+        if not self.enabled() or isinstance(state_dict, sd_models_mmap.MappedStateDict) and self.mapped_limit() <= 0:
+            return
+
+        with self.lock:
+            self.entries[checkpoint_info] = Entry(checkpoint_info, state_dict)
+            self.entries.move_to_end(checkpoint_info)
+
+    def used(self, mapped=None):
+        return sum(x.bytes for x in list(self.entries.values()) if mapped is None or x.mapped == mapped)
+
+    def charged(self):
+        return sum(x.charged for x in list(self.entries.values()))
+
+    def free_ram(self):
+        return psutil.virtual_memory().available
+
+    def room(self):
+        """Bytes that can still be taken in RAM within the budget and without going below sd_checkpoint_cache_min_free_ram;
+        free RAM already accounts for models kept in RAM under sd_checkpoints_limit"""
+        budget = self.budget()
+        if budget <= 0:
+            return 0
+
+        return max(min(budget - self.charged(), self.free_ram() - self.min_free_ram()), 0)
+
+    def trim(self):
+        """Evicts checkpoints over the limits or while RAM is short"""
+        budget = self.budget()
+        count_limit = self.count_limit()
+
+        with self.lock:
+            while self.entries and (count_limit > 0 and len(self.entries) > count_limit or not self.enabled()):
+                self.evict(next(iter(self.entries)))
+
+            mapped = [x for x, entry in self.entries.items() if entry.mapped]
+            for checkpoint_info in mapped[:max(len(mapped) - self.mapped_limit(), 0)]:
+                self.evict(checkpoint_info)
+
+            min_free_ram = self.min_free_ram()
+            while budget > 0 and self.charged() > budget or min_free_ram > 0 and self.free_ram() < min_free_ram:
+                in_ram = [x for x, entry in self.entries.items() if entry.charged > 0]
+                if not in_ram:
+                    break
+
+                self.evict(in_ram[0])
+
+    def evict(self, checkpoint_info):
+        """Removes checkpoint_info from the cache; call with self.lock held"""
+        entry = self.entries.pop(checkpoint_info)
+        print(f"Removing {checkpoint_info.title} from checkpoint cache ({entry.bytes / 1024 ** 3:.1f} GB{' mapped' if entry.mapped else ''})")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def info(self):
+        with self.lock:
+            entries = list(self.entries.values())
+
+        return {
+            "budget": self.budget(),
+            "used": sum(x.charged for x in entries),
+            "mapped": sum(x.bytes for x in entries if x.mapped),
+            "entries": [
+                {
+                    "title": x.checkpoint_info.title,
+                    "filename": x.checkpoint_info.filename,
+                    "bytes": x.bytes,
+                    "mapped": x.mapped,
+                    "hits": x.hits,
+                    "added": x.added,
+                    "last_used": x.last_used,
+                }
+                for x in reversed(entries)
+            ],
+        }
+
+
+checkpoints = CheckpointCache()
@@ -122,6 +122,11 @@ def find_checkpoint_config(state_dict, info):
     if config is not None:
         return config
 
+    # found for this version of the file by an earlier load; the manifest forgets it when the file changes
+    config_guess = getattr(info, "config_guess", None)
+    if config_guess is not None and os.path.exists(config_guess):
+        return config_guess
+
     return guess_model_config_from_state_dict(state_dict, info.filename)
 
 
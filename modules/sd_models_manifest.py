@@ -0,0 +1,89 @@
+import os
+import threading
+
+from modules import cache
+
+
+class Manifest:
+    """What is known about each model file, so that an unchanged tree of models can be listed from stat calls alone.
+
+    Entries are keyed by absolute path and hold the (size, mtime, inode) of the file when they were written; an entry
+    for a file whose stat differs is thrown away. Each entry is its own value in the disk cache, read on first use;
+    only the entries that changed are written back, merged with what other processes stored for the same file, after a
+    listing or when entries change."""
+
+    def __init__(self, subsection):
+        self.subsection = subsection
+        self.lock = threading.Lock()
+        self.entries = None
+        self.changed = set()
+
+    def load(self):
+        if self.entries is None:
+            storage = cache.cache(self.subsection)
+            self.entries = {key: value for key in storage if (value := storage.get(key)) is not None}
+
+        return self.entries
+
+    def get(self, filename, stat):
+        """Entry for filename as it is on disk now (stat from os.stat); an empty one if the file is new or changed"""
+        key = os.path.abspath(filename)
+        file_id = (stat.st_size, stat.st_mtime_ns, stat.st_ino) if stat is not None else None
+
+        with self.lock:
+            entries = self.load()
+            entry = entries.get(key)
+            if entry is None or entry["stat"] != file_id:
+                entry = entries[key] = {"stat": file_id}
+                self.changed.add(key)
+
+            return entry
+
+    def update(self, filename, **values):
+        """Changes the entry of a listed file and saves the manifest"""
+        key = os.path.abspath(filename)
+
+        with self.lock:
+            entry = self.load().get(key)
+            if entry is None or all(entry.get(k) == v for k, v in values.items()):
+                return
+
+            entry.update(values)
+            self.changed.add(key)
+
+        self.save()
+
+    def retain(self, filenames):
+        """Forgets files that are not in filenames, after a listing"""
+        keep = {os.path.abspath(x) for x in filenames}
+
+        with self.lock:
+            entries = self.load()
+            for key in [x for x in entries if x not in keep]:
+                del entries[key]
+                self.changed.add(key)
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+
+            storage = cache.cache(self.subsection)
+            with storage.transact():
+                for key in self.changed:
+                    entry = self.entries.get(key)
+                    if entry is None:
+                        storage.delete(key)
+                        continue
+
+                    # keep what another process found out about the same version of the file
+                    stored = storage.get(key)
+                    if stored is not None and stored["stat"] == entry["stat"]:
+                        entry.update({k: v for k, v in stored.items() if k not in entry})
+
+                    storage.set(key, entry)
+
+            self.changed.clear()
+
+
+checkpoints = Manifest("checkpoint-manifest")
@@ -0,0 +1,78 @@
+import json
+import mmap
+
+import torch
+
+from modules import shared
+
+dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+"""safetensors dtype names"""
+
+if hasattr(torch, "float8_e4m3fn"):
+    dtypes["F8_E4M3"] = torch.float8_e4m3fn
+    dtypes["F8_E5M2"] = torch.float8_e5m2
+
+
+class MappedStateDict(dict):
+    """State dict whose tensors are views of a memory-mapped safetensors file rather than copies in RAM.
+
+    Pages of the file are read on first access and belong to the page cache, which the OS can drop and read again, so
+    keeping such a dict around costs little RAM. The mapping is private: writes to the tensors do not reach the file."""
+
+    mapped = True
+
+    copied_bytes = 0
+    """size of tensors that had to be copied into RAM rather than mapped"""
+
+
+def can_map(filename):
+    """Whether weights from filename can be loaded as views of the file: a safetensors file, loaded to CPU, with mmap
+    not disabled in settings"""
+    return filename.lower().endswith(".safetensors") and shared.weight_load_location == "cpu" and not getattr(shared.opts, "disable_mmap_load_safetensors", False)
+
+
+def read_header(file):
+    """Header of the safetensors file and the offset in it where tensor data starts"""
+    file.seek(0)
+    header_size = int.from_bytes(file.read(8), "little")
+    return json.loads(file.read(header_size)), 8 + header_size
+
+
+def read_mapped(filename):
+    """MappedStateDict with all tensors of a safetensors file"""
+
+    with open(filename, "rb") as file:
+        header, data_start = read_header(file)
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    res = MappedStateDict()
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+
+        dtype = dtypes[info["dtype"]]
+        begin, end = info["data_offsets"]
+
+        if begin == end:
+            res[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+
+        tensor = torch.frombuffer(mapping, dtype=torch.uint8, count=end - begin, offset=data_start + begin)
+        if (data_start + begin) % dtype.itemsize:
+            tensor = tensor.clone()  # not aligned for dtype; safetensors files normally are
+            res.copied_bytes += end - begin
+
+        res[name] = tensor.view(dtype).reshape(info["shape"])
+
+    return res
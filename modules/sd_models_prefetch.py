@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+
+import torch
+
+from modules import errors, metrics, shared, sd_models_cache
+
+read_size = 16 * 1024 * 1024
+
+max_age = 10 * 60
+"""seconds a prefetched checkpoint is kept when no queued job needs it any more and no load took it"""
+
+
+class Prefetched:
+    def __init__(self, checkpoint_info, file_id, state_dict, seconds):
+        self.checkpoint_info = checkpoint_info
+        self.file_id = file_id
+        self.state_dict = state_dict
+        """the state dict in (pinned) RAM, or None if the file was only read into the page cache"""
+
+        self.seconds = seconds
+        """how long reading took in background"""
+
+        self.finished = time.time()
+
+
+def file_id(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Prefetcher:
+    """Reads the checkpoint that a queued job will need while the GPU is busy with the job before it.
+
+    When a job is queued or starts, a background thread looks for the first waiting job whose checkpoint is neither
+    loaded nor in the checkpoint cache, and reads that file, depending on the sd_checkpoint_prefetch setting, into the
+    page cache or into RAM (pinned with CUDA, so that moving it to the GPU is a plain host to device copy). Loading
+    that checkpoint then takes the prefetched copy instead of reading the file.
+
+    A copy in RAM counts against the checkpoint cache's budget: if it does not fit in sd_checkpoint_cache_size next to
+    the cached checkpoints, or in free RAM, the file is only read into the page cache. Only one checkpoint is kept; it
+    is dropped when another one is prefetched, or after max_age seconds once no waiting job needs it."""
+
+    def __init__(self):
+        self.queue = None
+        self.loaded_checkpoints = None
+        self.condition = threading.Condition()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.reading = None
+        self.prefetched = None
+
+    def mode(self):
+        return getattr(shared.opts, "sd_checkpoint_prefetch", "Off")
+
+    def attach(self, queue, loaded_checkpoints):
+        """Starts watching queue, a JobScheduler; loaded_checkpoints returns the titles of checkpoints in memory"""
+        self.queue = queue
+        self.loaded_checkpoints = loaded_checkpoints
+        queue.listeners.append(self.wake)
+
+    def wake(self):
+        if self.mode() == "Off":
+            return
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="checkpoint prefetch", daemon=True)
+            self.thread.start()
+
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(timeout=max_age)
+            self.wakeup.clear()
+
+            try:
+                self.drop_stale()
+                self.prefetch_next()
+            except Exception as e:
+                errors.display(e, "prefetching checkpoint")
+
+    def wanted_checkpoints(self):
+        """Checkpoints that waiting jobs need and that are neither loaded nor cached, in the order the jobs will run"""
+        from modules import sd_models
+
+        loaded = set(self.loaded_checkpoints())
+        res = []
+        for job in self.queue.queue_info():
+            checkpoint = job["model"][0] if job["model"] is not None else None
+            if checkpoint is None or checkpoint in loaded:
+                continue
+
+            info = sd_models.get_closet_checkpoint_match(checkpoint)
+            if info is not None and info not in sd_models.checkpoints_loaded and info not in res:
+                res.append(info)
+
+        return res
+
+    def next_checkpoint(self):
+        wanted = self.wanted_checkpoints()
+        return wanted[0] if wanted else None
+
+    def drop_stale(self):
+        """Forgets the prefetched checkpoint if no load took it within max_age seconds and no waiting job needs it"""
+        with self.condition:
+            prefetched = self.prefetched
+            if prefetched is None or time.time() - prefetched.finished < max_age:
+                return
+
+        if any(x.filename == prefetched.checkpoint_info.filename for x in self.wanted_checkpoints()):
+            return
+
+        with self.condition:
+            if self.prefetched is prefetched:
+                self.prefetched = None
+                print(f"Dropped prefetched {prefetched.checkpoint_info.title}: no job loaded it")
+
+    def prefetch_next(self):
+        mode = self.mode()
+        info = self.next_checkpoint() if mode != "Off" else None
+
+        with self.condition:
+            current = self.prefetched
+            if info is None or current is not None and current.checkpoint_info.filename == info.filename:
+                return
+
+            # one prefetched checkpoint at a time
+            self.prefetched = None
+            self.reading = info
+
+        try:
+            started = time.perf_counter()
+            state_dict = self.read(info.filename, mode)
+            prefetched = Prefetched(info, file_id(info.filename), state_dict, time.perf_counter() - started)
+            print(f"Prefetched {info.title} into {'RAM' if state_dict is not None else 'page cache'} in {prefetched.seconds:.1f}s")
+        except Exception:
+            prefetched = None
+            raise
+        finally:
+            with self.condition:
+                self.reading = None
+                self.prefetched = prefetched
+                self.condition.notify_all()
+
+    def read(self, filename, mode):
+        if mode == "RAM" and os.path.getsize(filename) > sd_models_cache.checkpoints.room():
+            print(f"Prefetching {os.path.basename(filename)} into page cache only: it does not fit in RAM for cached checkpoints")
+            mode = "Page cache"
+
+        if mode == "RAM":
+            from modules import sd_models
+
+            state_dict = sd_models.read_state_dict(filename, map_location="cpu")
+            if torch.cuda.is_available():
+                # one tensor at a time, so that only one unpinned tensor is held next to the pinned copy
+                for k, v in state_dict.items():
+                    if isinstance(v, torch.Tensor):
+                        state_dict[k] = v.pin_memory()
+
+            return state_dict
+
+        with open(filename, "rb", buffering=0) as file:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+            buffer = bytearray(read_size)
+            while file.readinto(buffer):
+                pass
+
+        return None
+
+    def take(self, checkpoint_info):
+        """Prefetched for checkpoint_info if it was prefetched (waiting for a prefetch of it that is running), else None.
+        Counts a prefetch hit or miss."""
+
+        if self.mode() == "Off" and self.prefetched is None:
+            return None
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.reading is None or self.reading.filename != checkpoint_info.filename)
+
+            prefetched = self.prefetched
+            hit = prefetched is not None and prefetched.checkpoint_info.filename == checkpoint_info.filename and prefetched.file_id == file_id(checkpoint_info.filename)
+            if hit:
+                self.prefetched = None
+
+        metrics.cache_lookup("checkpoint-prefetch", hit=hit)
+        return prefetched if hit else None
+
+
+prefetcher = Prefetcher()
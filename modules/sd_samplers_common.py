@@ -3,7 +3,7 @@ from collections import namedtuple
 import numpy as np
 import torch
 from PIL import Image
-from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models
+from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models, metrics
 from modules.shared import opts, state
 import k_diffusion.sampling
 
@@ -261,6 +261,7 @@ class Sampler:
 
         state.sampling_step = step
         shared.total_tqdm.update()
+        metrics.sampling_steps.inc()
 
     def launch_sampling(self, steps, func):
         self.model_wrap_cfg.steps = steps
@@ -269,7 +270,8 @@ class Sampler:
         state.sampling_step = 0
 
         try:
-            return func()
+            with metrics.sampling():
+                return func()
         except RecursionError:
             print(
                 'Encountered RecursionError during sampling, returning last latent. '
@@ -67,6 +67,12 @@ def list_samplers():
     return modules.sd_samplers.all_samplers
 
 
+def reload_chatgpt_api_key():
+    from modules import chatgpt_integration
+
+    chatgpt_integration.reload_api_key()
+
+
 def reload_hypernetworks():
     from modules.hypernetworks import hypernetwork
     from modules import shared
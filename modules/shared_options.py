@@ -24,6 +24,11 @@ restricted_opts = {
     "clean_temp_dir_at_start",
 }
 
+secret_opts = {
+    "chatgpt_api_key",
+}
+"""settings that the /sdapi/v1/options API does not return"""
+
 categories.register_category("saving", "Saving images")
 categories.register_category("sd", "AI Image Generation")
 categories.register_category("ui", "User Interface")
@@ -56,6 +61,7 @@ options_templates.update(options_section(('saving-images', "Saving images/grids"
     "save_mask_composite": OptionInfo(False, "For inpainting, save a masked composite"),
     "jpeg_quality": OptionInfo(80, "Quality for saved jpeg and avif images", gr.Slider, {"minimum": 1, "maximum": 100, "step": 1}),
     "webp_lossless": OptionInfo(False, "Use lossless compression for webp images"),
+    "image_encoding_threads": OptionInfo(4, "Threads for compressing images", gr.Slider, {"minimum": 0, "maximum": 16, "step": 1}).info("images are saved and encoded for API responses in the background, while the next batch is generated; 0 = compress on the thread that made the image").needs_restart(),
     "export_for_4chan": OptionInfo(True, "Save copy of large images as JPG").info("if the file size is above the limit, or either width or height are above the limit"),
     "img_downscale_threshold": OptionInfo(4.0, "File size limit for the above option, MB", gr.Number),
     "target_side_length": OptionInfo(4000, "Width/height limit for the above option, in pixels", gr.Number),
@@ -125,9 +131,12 @@ options_templates.update(options_section(('system', "System", "system"), {
     "enable_upscale_progressbar": OptionInfo(True, "Show a progress bar in the console for tiled upscaling."),
     "print_hypernet_extra": OptionInfo(False, "Print extra hypernetwork information to console."),
     "list_hidden_files": OptionInfo(True, "Load models/files in hidden directories").info("directory is hidden if its name starts with \".\""),
+    "hashing_threads": OptionInfo(2, "Threads for calculating hashes of model files", gr.Slider, {"minimum": 1, "maximum": 8, "step": 1}).info("hashes of models that are being loaded go first; generation does not wait for them"),
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
+    "queue_max_depth": OptionInfo(0, "Maximum number of jobs waiting for the GPU", gr.Number).info("jobs beyond this are rejected; API requests get 503; 0 = unlimited"),
+    "queue_affinity_window": OptionInfo(0, "Run waiting API jobs that use the loaded checkpoint first", gr.Slider, {"minimum": 0, "maximum": 50, "step": 1}).info("groups jobs by checkpoint, VAE and LoRAs to avoid loading models; a job is passed over at most this many times; 0 = run jobs in order"),
 }))
 
 options_templates.update(options_section(('profiler', "Profiler", "system"), {
@@ -150,6 +159,28 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_jobs_ttl_hours": OptionInfo(24, "Keep results of jobs submitted to /sdapi/v2/jobs for this many hours", gr.Number).info("0 = until deleted"),
+    "api_txt2img_batch_window_ms": OptionInfo(0, "Wait this long to batch single-image txt2img API requests together", gr.Number).info("in milliseconds; requests with the same settings except prompts and seeds run as one batch; 0 = off"),
+    "api_txt2img_batch_max_size": OptionInfo(8, "Largest batch made from txt2img API requests", gr.Slider, {"minimum": 2, "maximum": 64, "step": 1}),
+    "api_admission_control": OptionInfo(False, "Turn away API generation requests that cannot be served").info("when the queue is full (503) or the client has too many jobs waiting (429), with Retry-After; when the estimated GPU memory use does not fit (413)"),
+    "api_admission_client_jobs": OptionInfo(0, "Maximum number of waiting jobs per API client", gr.Number).info("with the above; clients are told by X-Client-Id header or address; 0 = unlimited"),
+    "api_admission_vram_fraction": OptionInfo(0.9, "Share of GPU memory API requests may use", gr.Slider, {"minimum": 0.5, "maximum": 1.0, "step": 0.01}).info("with the above; requests estimated to need more are rejected"),
+}))
+
+options_templates.update(options_section(('chatgpt', "Prompt enhancement", "system"), {
+    "chatgpt_api_key": OptionInfo("", "OpenAI API key", gr.Textbox, {"type": "password"}, onchange=shared_items.reload_chatgpt_api_key).info("used if neither --openai-api-key nor the OPENAI_API_KEY environment variable is set; saved in config.json"),
+    "chatgpt_backend": OptionInfo("OpenAI", "Prompt enhancement backend", gr.Radio, {"choices": ["OpenAI", "OpenAI-compatible server", "Local model (CPU)"]}).info("OpenAI-compatible server = llama.cpp server, vLLM and the like").needs_restart(),
+    "chatgpt_base_url": OptionInfo("", "Server URL").info("for example http://127.0.0.1:8080/v1; empty = OpenAI, or http://127.0.0.1:8080/v1 for an OpenAI-compatible server").needs_restart(),
+    "chatgpt_model": OptionInfo("", "Model name sent to the server").info("empty = gpt-3.5-turbo for OpenAI").needs_restart(),
+    "chatgpt_local_model": OptionInfo("Qwen/Qwen2.5-0.5B-Instruct", "Local model").info("Hugging Face model name or path to a directory with a small instruction-tuned model; used with the Local model (CPU) backend").needs_restart(),
+    "chatgpt_concurrency_limit": OptionInfo(4, "Maximum number of prompt enhancement requests running at the same time", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).info("these run separately from the image generation queue").needs_restart(),
+    "chatgpt_stream": OptionInfo(True, "Show enhanced prompts while they are being written").info("uses streaming chat completions; falls back to regular requests if the server does not stream"),
+    "chatgpt_batch_size": OptionInfo(10, "Prompts per request when enhancing many prompts at once", gr.Slider, {"minimum": 1, "maximum": 50, "step": 1}),
+    "chatgpt_requests_per_minute": OptionInfo(30, "Requests per minute to OpenAI until the real limit is known", gr.Number).info("the limits are learned from OpenAI's responses after the first request").needs_restart(),
+    "chatgpt_rate_limit_file": OptionInfo("", "Rate limit state file shared between webui processes").info("path to an sqlite file; set the same path in all processes that use one API key; empty = do not share").needs_restart(),
+    "chatgpt_cache_enable": OptionInfo(True, "Cache enhanced prompts on disk").info("repeating an enhancement with the same prompt and settings returns the cached result without contacting OpenAI"),
+    "chatgpt_cache_ttl_hours": OptionInfo(168, "Keep cached enhanced prompts for", gr.Number).info("hours; 0 = forever"),
+    "chatgpt_cache_size_mb": OptionInfo(64, "Maximum size of enhanced prompt cache", gr.Number).info("MB; oldest entries are removed first"),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -171,7 +202,11 @@ options_templates.update(options_section(('sd', "AI Image Generation", "sd"), {
     "sd_model_checkpoint": OptionInfo(None, "AI Image Generation checkpoint", gr.Dropdown, lambda: {"choices": shared_items.list_checkpoint_tiles(shared.opts.sd_checkpoint_dropdown_use_short)}, refresh=shared_items.refresh_checkpoints, infotext='Model hash'),
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
-    "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the settings below instead"),
+    "sd_checkpoint_cache_size": OptionInfo(0, "RAM for cached checkpoints (GB)", gr.Slider, {"minimum": 0, "maximum": 128, "step": 0.5}).info("0 = disable; least recently used checkpoints are removed first; safetensors files are cached as memory-mapped views, which do not take RAM for a second copy and do not count against this"),
+    "sd_checkpoint_cache_mapped": OptionInfo(4, "Memory-mapped checkpoints to cache", gr.Slider, {"minimum": 0, "maximum": 32, "step": 1}).info("safetensors checkpoints cached as views of their files; they take little RAM, but keep their files open; 0 = do not cache them"),
+    "sd_checkpoint_cache_min_free_ram": OptionInfo(2, "Free RAM to keep when caching checkpoints (GB)", gr.Slider, {"minimum": 0, "maximum": 64, "step": 0.5}).info("checkpoints cached as copies in RAM are removed when less RAM than this is available"),
+    "sd_checkpoint_prefetch": OptionInfo("Off", "Read the checkpoint for the next queued job in advance", gr.Radio, {"choices": ["Off", "Page cache", "RAM"]}).info("while the current job runs; Page cache = read the file so that loading it does not wait for the disk; RAM = also keep its weights in (pinned) memory, within RAM for cached checkpoints; the next job's checkpoint is only known for API requests that set sd_model_checkpoint in override_settings"),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
     "emphasis": OptionInfo("Original", "Emphasis mode", gr.Radio, lambda: {"choices": [x.name for x in sd_emphasis.options]}, infotext="Emphasis").info("makes it possible to make model to pay (more:1.1) or (less:0.9) attention to text when you use the syntax in prompt; " + sd_emphasis.get_options_descriptions()),
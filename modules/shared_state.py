@@ -1,4 +1,6 @@
+import base64
 import datetime
+import io
 import logging
 import threading
 import time
@@ -24,11 +26,13 @@ class State:
     current_image = None
     current_image_sampling_step = 0
     id_live_preview = 0
+    current_image_encoded = None
     textinfo = None
     time_start = None
     server_start = None
     _server_command_signal = threading.Event()
     _server_command: Optional[str] = None
+    _current_image_lock = threading.Lock()
 
     def __init__(self):
         self.server_start = time.time()
@@ -116,6 +120,7 @@ class State:
         self.job_timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         self.current_latent = None
         self.current_image = None
+        self.current_image_encoded = None
         self.current_image_sampling_step = 0
         self.id_live_preview = 0
         self.skipped = False
@@ -165,4 +170,37 @@ class State:
         if shared.opts.live_previews_image_format == 'jpeg' and image.mode in ('RGBA', 'P'):
             image = image.convert('RGB')
         self.current_image = image
+        self.current_image_encoded = None
         self.id_live_preview += 1
+
+    def current_image_base64(self):
+        """returns (format, base64 string) of self.current_image saved in opts.live_previews_image_format, or None if there is no image;
+        a frame is encoded the first time it's asked for, and everyone polling progress after that gets the same string"""
+        image = self.current_image
+        if image is None:
+            return None
+
+        image_format = shared.opts.live_previews_image_format
+
+        with self._current_image_lock:
+            encoded = self.current_image_encoded
+            if encoded is not None and encoded[0] is image and encoded[1] == image_format:
+                return image_format, encoded[2]
+
+            if image_format == "png":
+                # using optimize for large images takes an enormous amount of time
+                if max(*image.size) <= 256:
+                    save_kwargs = {"optimize": True}
+                else:
+                    save_kwargs = {"optimize": False, "compress_level": 1}
+
+            else:
+                save_kwargs = {}
+
+            buffered = io.BytesIO()
+            image.save(buffered, format=image_format, **save_kwargs)
+            base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+
+            self.current_image_encoded = (image, image_format, base64_image)
+
+        return image_format, base64_image
@@ -318,7 +318,7 @@ def create_embedding_from_data(data, name, filename='unknown embedding file', fi
 
     if filepath:
         embedding.filename = filepath
-        embedding.set_hash(hashes.sha256(filepath, "textual_inversion/" + name) or '')
+        embedding.set_hash(hashes.sha256_in_background(filepath, "textual_inversion/" + name, on_done=lambda x: embedding.set_hash(x or ''), priority="background") or '')
 
     return embedding
 
@@ -10,7 +10,7 @@ import gradio as gr
 import gradio.utils
 import numpy as np
 from PIL import Image, PngImagePlugin  # noqa: F401
-from modules.call_queue import wrap_gradio_gpu_call, wrap_queued_call, wrap_gradio_call, wrap_gradio_call_no_job # noqa: F401
+from modules.call_queue import wrap_gradio_gpu_call, wrap_queued_call, wrap_remote_call, wrap_gradio_call, wrap_gradio_call_no_job # noqa: F401
 
 from modules import gradio_extensons, sd_schedulers  # noqa: F401
 from modules import sd_hijack, sd_models, script_callbacks, ui_extensions, deepbooru, extra_networks, ui_common, ui_postprocessing, progress, ui_loadsave, shared_items, ui_settings, timer, sysinfo, ui_checkpoint_merger, scripts, sd_samplers, processing, ui_extra_networks, ui_toprow, launch_utils, chatgpt_integration
@@ -499,10 +499,15 @@ def create_ui():
             
             if chatgpt_available and hasattr(toprow, 'enhance_prompt_btn') and toprow.enhance_prompt_btn is not None:
                 toprow.enhance_prompt_btn.click(
-                    fn=wrap_queued_call(chatgpt_integration.enhance_prompt_ui),
+                    fn=wrap_remote_call(chatgpt_integration.enhance_prompt_ui),
                     inputs=[toprow.prompt, toprow.style_preference, toprow.enhancement_percentage],
                     outputs=[toprow.prompt],
                     show_progress=True
+                ).then(
+                    fn=chatgpt_integration.validation_status_ui,
+                    inputs=[],
+                    outputs=[toprow.chatgpt_status],
+                    show_progress=False
                 )
             elif hasattr(toprow, 'chatgpt_row') and toprow.chatgpt_row is not None:
                 # Hide the ChatGPT row if API key is not available
@@ -888,10 +893,15 @@ def create_ui():
             
             if chatgpt_available and hasattr(toprow, 'enhance_prompt_btn') and toprow.enhance_prompt_btn is not None:
                 toprow.enhance_prompt_btn.click(
-                    fn=wrap_queued_call(chatgpt_integration.enhance_prompt_ui),
+                    fn=wrap_remote_call(chatgpt_integration.enhance_prompt_ui),
                     inputs=[toprow.prompt, toprow.style_preference, toprow.enhancement_percentage],
                     outputs=[toprow.prompt],
                     show_progress=True
+                ).then(
+                    fn=chatgpt_integration.validation_status_ui,
+                    inputs=[],
+                    outputs=[toprow.chatgpt_status],
+                    show_progress=False
                 )
             elif hasattr(toprow, 'chatgpt_row') and toprow.chatgpt_row is not None:
                 # Hide the ChatGPT row if API key is not available
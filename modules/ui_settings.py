@@ -1,12 +1,12 @@
 import gradio as gr
 
-from modules import ui_common, shared, script_callbacks, scripts, sd_models, sysinfo, timer, shared_items
+from modules import ui_common, shared, script_callbacks, scripts, sd_models, sysinfo, timer, shared_items, hashes
 from modules.call_queue import wrap_gradio_call_no_job
 from modules.options import options_section
 from modules.shared import opts
 from modules.ui_components import FormRow
 from modules.ui_gradio_extensions import reload_javascript
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 
 
 def get_value_for_setting(key):
@@ -189,7 +189,6 @@ class UiSettings:
                         reload_sd_model = gr.Button(value='Load SD checkpoint to VRAM from RAM', elem_id="sett_reload_sd_model")
                     with gr.Row():
                         calculate_all_checkpoint_hash = gr.Button(value='Calculate hash for all checkpoint', elem_id="calculate_all_checkpoint_hash")
-                        calculate_all_checkpoint_hash_threads = gr.Number(value=1, label="Number of parallel calculations", elem_id="calculate_all_checkpoint_hash_threads", precision=0, minimum=1)
 
                 with gr.TabItem("Licenses", id="licenses", elem_id="settings_tab_licenses"):
                     gr.HTML(shared.html("licenses.html"), elem_id="licenses")
@@ -270,19 +269,21 @@ class UiSettings:
                 outputs=[sysinfo_check_output],
             )
 
-            def calculate_all_checkpoint_hash_fn(max_thread):
-                checkpoints_list = sd_models.checkpoints_list.values()
-                with ThreadPoolExecutor(max_workers=max_thread) as executor:
-                    futures = [executor.submit(checkpoint.calculate_shorthash) for checkpoint in checkpoints_list]
-                    completed = 0
-                    for _ in as_completed(futures):
-                        completed += 1
-                        print(f"{completed} / {len(checkpoints_list)} ")
-                    print("Finish calculating hash for all checkpoints")
+            def calculate_all_checkpoint_hash_fn():
+                # runs on the hashing threads (see the hashing_threads setting), after hashes of models that are being loaded
+                checkpoints_list = list(sd_models.checkpoints_list.values())
+                futures = [hashes.service.submit(checkpoint.filename, f"checkpoint/{checkpoint.name}") for checkpoint in checkpoints_list]
+                completed = 0
+                for _ in as_completed(futures):
+                    completed += 1
+                    print(f"{completed} / {len(checkpoints_list)} ")
+
+                for checkpoint in checkpoints_list:
+                    checkpoint.calculate_shorthash()
+                print("Finish calculating hash for all checkpoints")
 
             calculate_all_checkpoint_hash.click(
                 fn=calculate_all_checkpoint_hash_fn,
-                inputs=[calculate_all_checkpoint_hash_threads],
             )
 
         self.interface = settings_interface
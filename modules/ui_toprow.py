@@ -35,6 +35,7 @@ class Toprow:
 
     submit_box = None
     chatgpt_row = None
+    chatgpt_status = None
 
     def __init__(self, is_img2img, is_compact=False, id_part=None):
         if id_part is None:
@@ -113,6 +114,8 @@ class Toprow:
                         elem_id=f"{self.id_part}_style_preference",
                         elem_classes=["style-dropdown"]
                     )
+                with gr.Column(scale=2, min_width=200):
+                    self.chatgpt_status = gr.HTML(value=chatgpt_integration.validation_status_ui if chatgpt_available else "", elem_id=f"{self.id_part}_chatgpt_status", elem_classes=["chatgpt-status"])
                 # Improve image button removed as requested
             
             # Initialize attributes even if ChatGPT is not available (for compatibility)
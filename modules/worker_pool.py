@@ -0,0 +1,279 @@
+import multiprocessing
+import threading
+import time
+
+from modules import errors, job_scheduler, shared
+
+progress_interval = 0.5
+"""seconds between progress reports a worker sends while it runs a job"""
+
+
+class WorkerError(Exception):
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = message
+
+
+class WorkerResult:
+    """What a worker returns for a txt2img/img2img job, in the shape of Processed as far as the API uses it"""
+
+    def __init__(self, images, info):
+        self.images = images
+        self.info = info
+
+    def js(self):
+        return self.info
+
+
+class ApiRunner:
+    """Runs txt2img and img2img requests in a worker process with the same code as the API.
+
+    The worker process initializes the webui on its own device and loads its own model; sd_models.model_data lives
+    in the worker, so each worker can have a different checkpoint loaded."""
+
+    def setup(self, device):
+        from modules import shared
+
+        if device == "cpu":
+            shared.cmd_opts.use_cpu = ["all"]
+            shared.cmd_opts.no_half = True
+            shared.cmd_opts.precision = "full"
+        elif device.startswith("cuda:"):
+            shared.cmd_opts.device_id = device.split(":", 1)[1]
+
+        # loaded below, so that the worker only reports being ready with its model in memory
+        shared.cmd_opts.skip_load_model_at_start = True
+
+        from modules import initialize
+        initialize.imports()
+        initialize.initialize()
+
+        from fastapi import FastAPI
+        from modules import call_queue
+        from modules.api.api import Api
+
+        self.api = Api(FastAPI(), call_queue.queue_lock)
+
+        shared.sd_model  # noqa: B018
+
+    def checkpoint(self):
+        from modules import sd_models
+
+        model = sd_models.model_data.sd_model
+        return model.sd_checkpoint_info.title if model is not None else None
+
+    def state(self):
+        """Progress of the job running now, for the dispatcher's /internal/progress"""
+        from modules import shared
+
+        state = shared.state
+        return {"job_count": state.job_count, "job_no": state.job_no, "sampling_steps": state.sampling_steps, "sampling_step": state.sampling_step, "time_start": state.time_start, "textinfo": state.textinfo}
+
+    def run(self, kind, request):
+        from modules import images
+        from modules.api import models
+        from modules.api.api import encode_pil_to_bytes
+
+        if kind == "txt2img":
+            processed = self.api.process_txt2img(models.StableDiffusionTxt2ImgProcessingAPI(**request))
+        else:
+            processed = self.api.process_img2img(models.StableDiffusionImg2ImgProcessingAPI(**request))
+
+        return {"images": list(images.encode_in_parallel(encode_pil_to_bytes, processed.images)), "info": processed.js()}
+
+
+def report_progress(conn, runner, done):
+    """Sends {"progress": runner.state()} every progress_interval seconds until done is set"""
+    while not done.wait(progress_interval):
+        try:
+            conn.send({"progress": runner.state()})
+        except Exception as e:
+            errors.display_once(e, "reporting progress to the dispatcher")
+
+
+def worker_main(device, conn, runner):
+    """Entry point of a worker process: sets up the runner, then answers (kind, request) messages until it gets None.
+    While a job runs, progress messages are sent ahead of its result."""
+
+    runner.setup(device)
+    conn.send({"checkpoint": runner.checkpoint()})
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+
+        kind, request = message
+        done = threading.Event()
+        reporter = threading.Thread(target=report_progress, args=(conn, runner, done), name="progress reporter", daemon=True)
+        reporter.start()
+
+        try:
+            result = runner.run(kind, request)
+        except Exception as e:
+            errors.display(e, f"{kind} on {device}")
+            result = {"error": getattr(e, "detail", None) or str(e) or type(e).__name__, "status_code": getattr(e, "status_code", 500)}
+        finally:
+            done.set()
+            reporter.join()
+
+        result["checkpoint"] = runner.checkpoint()
+        conn.send(result)
+
+
+class Worker:
+    def __init__(self, index, device, process, conn):
+        self.index = index
+        self.device = device
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.alive = True
+        self.busy = False
+        self.checkpoint = None
+        self.jobs = 0
+        self.swaps = 0
+        self.last_used = 0.0
+
+
+class WorkerPool:
+    """Worker processes, one per device, that run txt2img and img2img jobs for the API in the dispatcher process.
+
+    A job goes to a free worker that already has the requested checkpoint loaded; if there is none, to a free worker
+    without a model, and only then to any free worker, which has to swap its model.
+
+    Jobs wait for a worker in queue, which schedules them as queue_lock does in a single process (priorities, fair share,
+    checkpoint affinity) with one slot per live worker, and which admission control checks in --workers mode."""
+
+    def __init__(self, devices, runner=None, start_method="spawn"):
+        self.devices = devices
+        self.runner = runner or ApiRunner()
+        self.context = multiprocessing.get_context(start_method)
+        self.workers = []
+        self.condition = threading.Condition()
+        self.queue = job_scheduler.JobScheduler(
+            max_depth=lambda: getattr(shared.opts, "queue_max_depth", 0),
+            affinity_window=lambda: getattr(shared.opts, "queue_affinity_window", 0),
+            loaded_checkpoints=self.loaded_checkpoints,
+            slots=self.live_workers,
+        )
+
+    def start(self):
+        for index, device in enumerate(self.devices):
+            conn, child_conn = self.context.Pipe()
+            process = self.context.Process(target=worker_main, args=(device, child_conn, self.runner), name=f"webui worker {index} ({device})", daemon=True)
+            process.start()
+            child_conn.close()
+
+            worker = Worker(index, device, process, conn)
+            self.workers.append(worker)
+            threading.Thread(target=self.wait_until_ready, args=(worker,), daemon=True).start()
+
+    def wait_until_ready(self, worker):
+        try:
+            message = worker.conn.recv()
+        except (EOFError, OSError):
+            print(f"Worker {worker.index} ({worker.device}) exited during startup")
+            self.mark_dead(worker)
+            return
+
+        with self.condition:
+            worker.checkpoint = message["checkpoint"]
+            worker.ready = True
+            self.condition.notify_all()
+
+        print(f"Worker {worker.index} ({worker.device}) ready with {worker.checkpoint}")
+
+    def wait_for_workers(self, timeout=None):
+        """Blocks until every worker is ready or has exited; returns the number of ready workers"""
+        with self.condition:
+            self.condition.wait_for(lambda: all(x.ready or not x.alive for x in self.workers), timeout)
+            return sum(1 for x in self.workers if x.ready and x.alive)
+
+    def live_workers(self):
+        return sum(1 for x in self.workers if x.alive)
+
+    def loaded_checkpoints(self):
+        return [x.checkpoint for x in self.workers if x.alive and x.checkpoint is not None]
+
+    def mark_dead(self, worker):
+        with self.condition:
+            worker.alive = False
+            worker.busy = False
+            self.condition.notify_all()
+
+    def pick(self, checkpoint):
+        free = [x for x in self.workers if x.alive and x.ready and not x.busy]
+        if not free:
+            return None
+
+        return min(free, key=lambda x: (x.checkpoint != checkpoint, x.checkpoint is not None, x.last_used))
+
+    def run(self, kind, request, checkpoint, on_start=None, on_progress=None):
+        """Runs a job on a worker and returns its WorkerResult. Blocks until a worker is free and the job is done;
+        raises WorkerError if the job failed. Call with a slot in queue held, so that jobs are taken in its order. on_progress is called with the progress the worker reports while the
+        job runs, a dict as returned by ApiRunner.state."""
+
+        with self.condition:
+            while True:
+                if not any(x.alive for x in self.workers):
+                    raise WorkerError("No worker processes are running", status_code=503)
+
+                worker = self.pick(checkpoint)
+                if worker is not None:
+                    break
+
+                self.condition.wait()
+
+            worker.busy = True
+            worker.jobs += 1
+            if worker.checkpoint is not None and checkpoint is not None and worker.checkpoint != checkpoint:
+                worker.swaps += 1
+
+        if on_start is not None:
+            on_start()
+
+        try:
+            worker.conn.send((kind, request))
+            while True:
+                result = worker.conn.recv()
+                if "progress" not in result:
+                    break
+
+                if on_progress is not None:
+                    on_progress(result["progress"])
+        except (EOFError, OSError) as e:
+            self.mark_dead(worker)
+            raise WorkerError(f"Worker {worker.index} ({worker.device}) exited while running the job") from e
+
+        with self.condition:
+            worker.busy = False
+            worker.checkpoint = result.pop("checkpoint", worker.checkpoint)
+            worker.last_used = time.time()
+            self.condition.notify_all()
+
+        if "error" in result:
+            raise WorkerError(result["error"], status_code=result.get("status_code", 500))
+
+        return WorkerResult(result["images"], result["info"])
+
+    def info(self):
+        with self.condition:
+            return [{"index": x.index, "device": x.device, "ready": x.ready, "alive": x.alive, "busy": x.busy, "checkpoint": x.checkpoint, "jobs": x.jobs, "swaps": x.swaps} for x in self.workers]
+
+    def stop(self, timeout=10):
+        for worker in self.workers:
+            if worker.alive:
+                try:
+                    worker.conn.send(None)
+                except (OSError, ValueError):
+                    pass
+
+        for worker in self.workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+            self.mark_dead(worker)
+
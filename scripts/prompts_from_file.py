@@ -5,7 +5,7 @@ import shlex
 import modules.scripts as scripts
 import gradio as gr
 
-from modules import sd_samplers, errors, sd_models
+from modules import sd_samplers, errors, sd_models, chatgpt_integration, call_queue
 from modules.processing import Processed, process_images
 from modules.shared import state
 
@@ -107,6 +107,54 @@ def load_prompt_file(file):
         return None, "\n".join(lines), gr.update(lines=7)
 
 
+def enhance_prompt_lines(prompt_txt):
+    """Rewrites the prompt of every line with ChatGPT, in as few requests as possible; for lines with command line
+    options, only the --prompt value is changed. Runs from the Enhance button, so the requests are made before any
+    generation job is queued, not while one holds the GPU."""
+
+    lines = prompt_txt.splitlines()
+    targets = []
+
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+
+        if "--" not in line:
+            targets.append((i, None, 0, 0, line))
+            continue
+
+        try:
+            tokens = shlex.split(line)
+        except ValueError:
+            continue
+
+        if "--prompt" not in tokens:
+            continue
+
+        start = end = tokens.index("--prompt") + 1
+        while end < len(tokens) and not tokens[end].startswith("--"):
+            end += 1
+
+        targets.append((i, tokens, start, end, " ".join(tokens[start:end])))
+
+    results = chatgpt_integration.enhance_prompts([x[4] for x in targets])
+    for (i, tokens, start, end, prompt), result in zip(targets, results):
+        if result["error"] is not None:
+            print(f"Could not enhance prompt {prompt!r}: {result['error']}")
+            continue
+
+        # one prompt per line
+        enhanced = " ".join(result["prompt"].split())
+        if tokens is None:
+            lines[i] = enhanced
+        else:
+            tokens[start:end] = [enhanced]
+            lines[i] = shlex.join(tokens)
+
+    return "\n".join(lines)
+
+
 class Script(scripts.Script):
     def title(self):
         return "Prompts from file or textbox"
@@ -117,9 +165,11 @@ class Script(scripts.Script):
         prompt_position = gr.Radio(["start", "end"], label="Insert prompts at the", elem_id=self.elem_id("prompt_position"), value="start")
 
         prompt_txt = gr.Textbox(label="List of prompt inputs", lines=1, elem_id=self.elem_id("prompt_txt"))
+        enhance = gr.Button(value="Enhance prompts with ChatGPT", elem_id=self.elem_id("enhance"))
         file = gr.File(label="Upload prompt inputs", type='binary', elem_id=self.elem_id("file"))
 
         file.change(fn=load_prompt_file, inputs=[file], outputs=[file, prompt_txt, prompt_txt], show_progress=False)
+        enhance.click(fn=call_queue.wrap_remote_call(enhance_prompt_lines), inputs=[prompt_txt], outputs=[prompt_txt])
 
         # We start at one line. When the text changes, we jump to seven lines, or two lines if no \n.
         # We don't shrink back to 1, because that causes the control to ignore [enter], and it may
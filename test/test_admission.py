@@ -0,0 +1,94 @@
+import threading
+import types
+
+import pytest
+
+from modules import admission, job_scheduler, shared
+
+
+def request(width=512, height=512, batch_size=1, **kwargs):
+    return types.SimpleNamespace(prompt="cat", width=width, height=height, batch_size=batch_size, **kwargs)
+
+
+def test_estimate_peak_memory():
+    small = admission.estimate_peak_memory(512, 512, optimizer="xformers")
+
+    assert admission.estimate_peak_memory(1024, 1024, optimizer="xformers") > 3 * small
+    assert admission.estimate_peak_memory(512, 512, batch_size=4, optimizer="xformers") > 1.5 * small
+
+    # without a memory-efficient optimization the attention matrix makes large images far more expensive
+    assert admission.estimate_peak_memory(1024, 1024, optimizer="Doggettx") > admission.estimate_peak_memory(1024, 1024, optimizer="sdp")
+    assert admission.estimate_peak_memory(1024, 1024) > admission.estimate_peak_memory(1024, 1024, optimizer="Doggettx")
+
+    hires = request(enable_hr=True, hr_scale=2.0, hr_resize_x=0, hr_resize_y=0)
+    assert admission.request_passes(hires) == [(512, 512), (1024, 1024)]
+    assert admission.request_passes(request(enable_hr=True, hr_scale=2.0, hr_resize_x=768, hr_resize_y=0)) == [(512, 512), (768, 768)]
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(api_admission_control=True, api_admission_client_jobs=2, api_admission_vram_fraction=0.9))
+    monkeypatch.setattr(admission.AdmissionController, "optimizer", lambda self: "sdp")
+    monkeypatch.setattr(admission.AdmissionController, "budget", lambda self: 4 * 2**30)
+
+    return admission.AdmissionController(job_scheduler.JobScheduler(max_depth=3))
+
+
+def fill_queue(queue, clients):
+    """Holds the lock and puts a waiting job in the queue for each of clients; returns a function that empties it"""
+    queue.acquire(client="holder")
+
+    threads = [threading.Thread(target=queue.acquire, kwargs={"client": client}) for client in clients]
+    for thread in threads:
+        thread.start()
+    while len(queue.queue_info()) < len(clients):
+        pass
+
+    def release():
+        for _ in range(len(clients) + 1):
+            queue.release()
+        for thread in threads:
+            thread.join()
+
+    return release
+
+
+def test_admission(controller):
+    controller.check(request())
+
+    with pytest.raises(admission.AdmissionError) as e:
+        controller.check(request(2048, 2048, batch_size=8))
+    assert e.value.status_code == 413
+
+    release = fill_queue(controller.queue, ["a", "a"])
+    try:
+        with job_scheduler.job_context(client="a"):
+            with pytest.raises(admission.AdmissionError) as e:
+                controller.check(request())
+        assert e.value.status_code == 429
+        assert e.value.headers == {"Retry-After": "30"}
+
+        with job_scheduler.job_context(client="b"):
+            controller.check(request())
+    finally:
+        release()
+
+    release = fill_queue(controller.queue, ["a", "b", "c"])
+    try:
+        with pytest.raises(admission.AdmissionError) as e:
+            controller.check(request())
+        assert e.value.status_code == 503
+        assert e.value.headers == {"Retry-After": "40"}
+    finally:
+        release()
+
+
+def test_calibration(controller):
+    estimate = controller.estimate(request())
+
+    controller.observe(estimate, 2 * estimate, 5.0)
+    assert controller.estimate(request()) == pytest.approx(2 * estimate)
+    assert controller.retry_after(0) == 5.0
+
+    shared.opts.api_admission_control = False
+    controller.check(request(4096, 4096, batch_size=8))
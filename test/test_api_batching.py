@@ -0,0 +1,97 @@
+import threading
+import types
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from modules import shared
+from modules.api import batching
+
+
+class Request(BaseModel):
+    """The fields of StableDiffusionTxt2ImgProcessingAPI that the batcher looks at"""
+    prompt: object = ""
+    negative_prompt: object = ""
+    seed: object = -1
+    subseed: object = -1
+    steps: int = 20
+    batch_size: int = 1
+    n_iter: int = 1
+    save_images: bool = False
+    script_name: Optional[str] = None
+    alwayson_scripts: dict = {}
+    force_task_id: Optional[str] = None
+
+
+runs = []
+"""batch size of every call to run"""
+
+
+def run(req):
+    prompts = req.prompt if isinstance(req.prompt, list) else [req.prompt]
+    seeds = req.seed if isinstance(req.seed, list) else [req.seed]
+    runs.append(len(prompts))
+
+    return types.SimpleNamespace(
+        images=[f"image of {x}" for x in prompts],
+        all_prompts=prompts,
+        all_negative_prompts=[""] * len(prompts),
+        seed=seeds[0],
+        all_seeds=seeds,
+        all_subseeds=seeds,
+        infotexts=[f"{x}\nSeed: {seed}" for x, seed in zip(prompts, seeds)],
+        index_of_first_image=0,
+    )
+
+
+@pytest.fixture
+def batcher(monkeypatch):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(api_txt2img_batch_window_ms=200, api_txt2img_batch_max_size=3))
+    runs.clear()
+    return batching.Txt2ImgBatcher(run)
+
+
+def submit_all(batcher, requests):
+    results = [None] * len(requests)
+
+    def submit(i):
+        results[i] = batcher.submit(requests[i])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    return results
+
+
+def test_compatible_requests_are_batched(batcher):
+    requests = [Request(prompt=f"cat {i}", seed=100 + i) for i in range(4)] + [Request(prompt="dog", steps=30)]
+    assert all(batcher.accepts(x) for x in requests)
+
+    results = submit_all(batcher, requests)
+
+    # three cats fill a batch, the fourth runs in another one, the dog with other settings on its own
+    assert sorted(runs) == [1, 1, 3]
+
+    for i in range(4):
+        assert results[i].images == [f"image of cat {i}"]
+        assert results[i].seed == 100 + i
+        assert results[i].infotexts == [f"cat {i}\nSeed: {100 + i}"]
+
+    assert results[4].images == ["image of dog"]
+    assert results[4].seed != -1
+
+
+def test_not_batched():
+    assert not batching.Txt2ImgBatcher(run).accepts(Request())  # off by default
+
+    shared_opts = types.SimpleNamespace(api_txt2img_batch_window_ms=10, api_txt2img_batch_max_size=8)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(shared, "opts", shared_opts)
+        batcher = batching.Txt2ImgBatcher(run)
+        assert not batcher.accepts(Request(batch_size=2))
+        assert not batcher.accepts(Request(script_name="x/y/z plot"))
+        assert not batcher.accepts(Request(save_images=True))
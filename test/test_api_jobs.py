@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from modules import cache, job_scheduler
+from modules.api import jobs
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(cache, "caches", {})
+    return jobs.JobStore()
+
+
+def wait_for(store, id_task):
+    for _ in range(100):
+        entry = store.get(id_task)
+        if entry["status"] != "queued":
+            return entry
+        time.sleep(0.05)
+
+    raise AssertionError(f"job {id_task} did not finish")
+
+
+def test_job_result(store):
+    started = threading.Event()
+    proceed = threading.Event()
+
+    def run():
+        started.set()
+        proceed.wait(5)
+        return {"images": [b"png"], "parameters": {"prompt": "a cat"}, "info": "{}"}
+
+    store.submit("task(a)", run, kind="img2img")
+    started.wait(5)
+    assert store.get("task(a)")["status"] == "queued"
+
+    proceed.set()
+    entry = wait_for(store, "task(a)")
+    assert entry["status"] == "done"
+    assert entry["images"] == [b"png"]
+    assert entry["kind"] == "img2img"
+    assert entry["finished"] >= entry["created"]
+
+
+def test_job_failed(store):
+    def run():
+        raise RuntimeError("out of memory")
+
+    store.submit("task(b)", run)
+    entry = wait_for(store, "task(b)")
+    assert entry["status"] == "failed"
+    assert entry["error"] == "out of memory"
+
+
+def test_job_lost_in_restart(store):
+    store.put("task(c)", {"status": "queued", "created": 0})
+
+    # a job that was queued when the server stopped is reported as failed
+    restarted = jobs.JobStore()
+    assert restarted.get("task(c)")["status"] == "failed"
+
+    assert restarted.delete("task(c)")
+    assert restarted.get("task(c)") is None
+
+
+def test_job_deleted(store):
+    queue = job_scheduler.JobScheduler()
+    queue.acquire()
+    ran = []
+
+    def run():
+        queue.acquire(id_task="task(d)")
+        ran.append("task(d)")
+        queue.release()
+        return {"images": [], "parameters": {}, "info": "{}"}
+
+    store.submit("task(d)", run)
+    while not queue.queue_info():
+        time.sleep(0.01)
+
+    # a deleted job that is still waiting leaves the queue and does not come back when its thread ends
+    assert store.delete("task(d)")
+    assert queue.cancel("task(d)")
+    while "task(d)" in store.active:
+        time.sleep(0.01)
+
+    assert store.get("task(d)") is None and not ran and not queue.queue_info()
+    queue.release()
+
+
+def test_running_job_deleted(store):
+    started = threading.Event()
+    proceed = threading.Event()
+
+    def run():
+        started.set()
+        proceed.wait(5)
+        return {"images": [b"png"], "parameters": {}, "info": "{}"}
+
+    store.submit("task(e)", run)
+    started.wait(5)
+    assert store.delete("task(e)")
+
+    proceed.set()
+    while "task(e)" in store.active:
+        time.sleep(0.01)
+    assert store.get("task(e)") is None
@@ -0,0 +1,82 @@
+import threading
+
+from modules import call_queue
+
+
+def test_remote_call_does_not_hold_queue_lock():
+    started = threading.Event()
+    release = threading.Event()
+
+    def enhance_prompt(prompt):
+        started.set()
+        release.wait(timeout=10)
+        return prompt + ", enhanced"
+
+    results = []
+    enhance = call_queue.wrap_remote_call(enhance_prompt)
+    thread = threading.Thread(target=lambda: results.append(enhance("cat")))
+    thread.start()
+
+    try:
+        assert started.wait(timeout=10)
+
+        # a generation job must be able to take the lock while the enhancement call is still waiting on the network
+        assert call_queue.queue_lock.acquire(blocking=False)
+        call_queue.queue_lock.release()
+    finally:
+        release.set()
+        thread.join(timeout=10)
+
+    assert results == ["cat, enhanced"]
+
+
+def test_remote_call_generator():
+    def enhance_prompt(prompt):
+        yield prompt
+        yield threading.current_thread().name
+
+    parts = list(call_queue.wrap_remote_call(enhance_prompt)("cat"))
+
+    assert parts[0] == "cat"
+    assert parts[1].startswith("remote_call")
+
+
+def test_remote_call_streams_are_limited(monkeypatch):
+    monkeypatch.setattr(call_queue, "remote_call_executor", None)
+    monkeypatch.setattr(call_queue, "remote_call_slots", None)
+    monkeypatch.setattr(call_queue.shared, "opts", type("opts", (), {"chatgpt_concurrency_limit": 1}))
+
+    def stream(prompt):
+        yield prompt
+
+    first = call_queue.wrap_remote_call(stream)("cat")
+    assert next(first) == "cat"
+
+    # the first stream is still open and holds the only slot
+    assert not call_queue.remote_call_slots.acquire(blocking=False)
+
+    first.close()
+    assert list(call_queue.wrap_remote_call(stream)("dog")) == ["dog"]
+
+
+
+def test_queued_call_without_task_id():
+    scheduler = call_queue.job_scheduler.JobScheduler()
+    scheduler.acquire()
+
+    def job():
+        with call_queue.queued_task(None, scheduler):
+            pass
+
+    waiting = threading.Thread(target=job)
+    waiting.start()
+    while not scheduler.queue_info():
+        pass
+
+    # calls without a task id, such as "Check for updates", wait for the GPU but are not listed as pending tasks
+    try:
+        assert None not in call_queue.progress.pending_tasks
+        assert call_queue.progress.get_pending_tasks().tasks == []
+    finally:
+        scheduler.release()
+        waiting.join(timeout=10)
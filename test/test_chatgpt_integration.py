@@ -0,0 +1,329 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from modules import cache, chatgpt_integration, rate_limiter, shared
+from modules.chatgpt_integration import ChatGPTIntegration, iter_sse_deltas
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse can be observed
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.client_address, payload))
+        time.sleep(self.server.delay)
+
+        prompt = payload["messages"][-1]["content"]
+        if payload.get("stream"):
+            return self.send_stream(prompt)
+
+        if prompt.startswith("["):
+            prompts = json.loads(prompt)
+            content = json.dumps(["stub: " + x for x in prompts if x != "unparseable"])
+        else:
+            content = f" stub: {prompt} "
+        body = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, prompt):
+        if self.server.fail_streams:
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        events = [": keep-alive comment", ""]
+        for piece in [" stub:", " streamed", f" {prompt}"]:
+            events += ["data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": piece}}]}), ""]
+        events += ["data: [DONE]", ""]
+        body = "\n".join(events).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.requests = []
+    server.fail_streams = False
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def integration(stub_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(cache, "caches", {})
+
+    instance = ChatGPTIntegration(api_key="sk-test", base_url=f"http://127.0.0.1:{stub_server.server_port}/v1/chat/completions")
+    instance.rate_limiter = rate_limiter.RateLimiter(requests_per_minute=None)
+    return instance
+
+
+def test_enhance_prompt_async(stub_server, integration):
+    async def run():
+        try:
+            return [
+                await integration.enhance_prompt_async("cat"),
+                await integration.generate_alternative_prompt_async("dog"),
+            ]
+        finally:
+            await integration.aclose()
+
+    enhanced, alternatives = asyncio.run(run())
+
+    assert enhanced.startswith("stub: Original prompt: 'cat'")
+    assert alternatives.startswith("stub: Original prompt: 'dog'")
+
+    # both requests went over the same pooled connection
+    assert len({address for address, _ in stub_server.requests}) == 1
+
+
+def test_enhance_prompt_sync_reuses_connection(stub_server, integration):
+    integration.enhance_prompt("cat")
+    integration.improve_image_prompt("cat", "a cat")
+
+    assert len(stub_server.requests) == 2
+    assert len({address for address, _ in stub_server.requests}) == 1
+
+
+def test_enhance_prompt_async_empty_prompt(stub_server, integration):
+    assert asyncio.run(integration.enhance_prompt_async("  ")) == "Please enter a prompt to enhance."
+    assert stub_server.requests == []
+
+
+def test_enhance_prompt_cache(stub_server, integration):
+    first = integration.enhance_prompt("cat", "anime", 40)
+    integration.rate_limiter.block(3600)  # a cache hit must not wait for the rate limiter
+
+    assert integration.enhance_prompt("cat", "anime", 40) == first
+    assert asyncio.run(integration.enhance_prompt_async("cat", "anime", 40)) == first
+    assert len(stub_server.requests) == 1
+
+    assert integration.get_cache_stats() == {"hits": 2, "misses": 1, "hit_ratio": 2 / 3}
+
+    integration.rate_limiter = rate_limiter.RateLimiter(requests_per_minute=None)
+    integration.enhance_prompt("cat", "anime", 90)
+    assert len(stub_server.requests) == 2
+
+
+def test_enhance_prompts_batched(stub_server, integration, monkeypatch):
+    monkeypatch.setattr("modules.chatgpt_integration._opt", lambda name, default: 2 if name == "chatgpt_batch_size" else default)
+
+    prompts = ["cat", "", "dog", "fox", "owl"]
+    results = asyncio.run(integration.enhance_prompts_async(prompts))
+
+    assert results == [
+        {"prompt": "stub: cat", "error": None},
+        {"prompt": None, "error": "Please enter a prompt to enhance."},
+        {"prompt": "stub: dog", "error": None},
+        {"prompt": "stub: fox", "error": None},
+        {"prompt": "stub: owl", "error": None},
+    ]
+
+    # [cat, dog] and [fox, owl]; the empty prompt never leaves the process
+    assert len(stub_server.requests) == 2
+
+
+def test_enhance_prompts_falls_back_to_single_requests(stub_server, integration, monkeypatch):
+    monkeypatch.setattr("modules.chatgpt_integration._opt", lambda name, default: 10 if name == "chatgpt_batch_size" else default)
+
+    results = integration.enhance_prompts(["cat", "unparseable"])
+
+    assert [x["error"] for x in results] == [None, None]
+    assert results[1]["prompt"].startswith("stub: Original prompt: 'unparseable'")
+    assert len(stub_server.requests) == 3
+
+
+def test_api_key_validated_in_background(stub_server, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-env")
+    monkeypatch.setattr(shared.cmd_opts, "skip_chatgpt_validation", False, raising=False)
+
+    instance = ChatGPTIntegration(base_url=f"http://127.0.0.1:{stub_server.server_port}/v1/chat/completions")
+
+    assert instance.is_api_key_set()
+    instance.validation_thread.join(timeout=10)
+    assert instance.validation_status == "valid"
+    assert len(stub_server.requests) == 1
+
+
+def test_skip_validation_does_not_touch_network(stub_server, integration, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-env")
+    monkeypatch.setattr(shared.cmd_opts, "skip_chatgpt_validation", True, raising=False)
+
+    instance = ChatGPTIntegration(base_url=f"http://127.0.0.1:{stub_server.server_port}/v1/chat/completions")
+    assert instance.validation_status == "unchecked"
+    assert instance.validation_thread is None
+    assert stub_server.requests == []
+
+    # the first real request settles the status
+    instance.rate_limiter = rate_limiter.RateLimiter(requests_per_minute=None)
+    instance.enhance_prompt("cat")
+    assert instance.validation_status == "valid"
+
+
+def test_api_key_never_prompted(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(shared.cmd_opts, "openai_api_key", None, raising=False)
+    monkeypatch.setattr("sys.stdin.isatty", lambda: True, raising=False)
+    monkeypatch.setattr("builtins.input", lambda *args: pytest.fail("asked for the API key"))
+    settings = {"chatgpt_api_key": ""}
+    monkeypatch.setattr(chatgpt_integration, "_opt", lambda name, default: settings.get(name, default))
+
+    instance = ChatGPTIntegration()
+    assert not instance.is_api_key_set() and instance.validation_status == "missing"
+
+    # a key entered in settings later is picked up without a restart; the command line and the environment come first
+    monkeypatch.setattr(shared.cmd_opts, "skip_chatgpt_validation", True, raising=False)
+    settings["chatgpt_api_key"] = "sk-settings"
+    instance.reload_api_key()
+    assert instance.api_key == "sk-settings" and instance.validation_status == "unchecked"
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-env")
+    assert chatgpt_integration.find_api_key() == "sk-env"
+    monkeypatch.setattr(shared.cmd_opts, "openai_api_key", "sk-cmd")
+    assert chatgpt_integration.find_api_key() == "sk-cmd"
+
+
+def test_iter_sse_deltas():
+    lines = [
+        b": comment",
+        b"",
+        b'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+        b'data: {"choices": [{"delta": {"content": "a cat"}}]}',
+        "data: " + json.dumps({"choices": [{"delta": {"content": ", detailed"}}]}),
+        "data: [DONE]",
+        'data: {"choices": [{"delta": {"content": "after done"}}]}',
+    ]
+
+    assert list(iter_sse_deltas(lines)) == ["a cat", ", detailed"]
+
+    with pytest.raises(ValueError, match="overloaded"):
+        list(iter_sse_deltas(['data: {"error": {"message": "overloaded"}}']))
+
+
+def test_enhance_prompt_stream(stub_server, integration):
+    parts = list(integration.enhance_prompt_stream("cat"))
+
+    assert parts[:2] == ["stub:", "stub: streamed"]
+    assert parts[-1].startswith("stub: streamed Original prompt: 'cat'")
+    assert stub_server.requests[0][1]["stream"] is True
+
+    # the streamed text is cached like a regular response
+    assert integration.enhance_prompt("cat") == parts[-1]
+    assert len(stub_server.requests) == 1
+
+
+def test_enhance_prompt_stream_fallback(stub_server, integration):
+    stub_server.fail_streams = True
+
+    parts = list(integration.enhance_prompt_stream("cat"))
+
+    assert len(parts) == 1
+    assert parts[0].startswith("stub: Original prompt: 'cat'")
+    assert [payload.get("stream", False) for _, payload in stub_server.requests] == [True, False]
+
+
+def test_chat_completions_url():
+    assert chatgpt_integration.chat_completions_url("http://127.0.0.1:8080/v1/") == "http://127.0.0.1:8080/v1/chat/completions"
+    assert chatgpt_integration.chat_completions_url("http://gpu-01:8000/v1/chat/completions") == "http://gpu-01:8000/v1/chat/completions"
+
+
+def test_openai_compatible_server_backend(stub_server, monkeypatch):
+    settings = {
+        "chatgpt_backend": chatgpt_integration.backend_server,
+        "chatgpt_base_url": f"http://127.0.0.1:{stub_server.server_port}/v1",
+        "chatgpt_model": "qwen2.5-7b-instruct",
+        "chatgpt_stream": False,
+        "chatgpt_cache_enable": False,
+    }
+    monkeypatch.setattr(chatgpt_integration, "_opt", lambda name, default: settings.get(name, default))
+
+    instance = chatgpt_integration.create_chatgpt_instance()
+    instance.validation_thread.join(timeout=10)
+
+    assert instance.enhance_prompt("cat").startswith("stub: Original prompt: 'cat'")
+    assert [payload["model"] for _, payload in stub_server.requests] == ["qwen2.5-7b-instruct"] * 2
+    assert instance.validation_status == "valid"
+
+
+def test_local_model_backend(integration):
+    class FakeModel:
+        def __init__(self):
+            self.payloads = []
+
+        def complete(self, payload):
+            self.payloads.append(payload)
+            return {"choices": [{"message": {"content": " a cat, local "}}]}
+
+    model = FakeModel()
+    instance = ChatGPTIntegration(api_key="local", model="tiny", local_model=model)
+    instance.rate_limiter.block(3600)  # never consulted for a local model
+
+    assert instance.validation_status == "local"
+    assert instance.enhance_prompt("cat") == "a cat, local"
+    assert list(instance.enhance_prompt_stream("dog")) == ["a cat, local"]
+    assert asyncio.run(instance.enhance_prompt_async("cat")) == "a cat, local"  # cached
+    assert [payload["model"] for payload in model.payloads] == ["tiny", "tiny"]
+
+
+def test_identical_requests_are_coalesced(stub_server, integration):
+    stub_server.delay = 0.5
+    barrier = threading.Barrier(4)
+    results = []
+
+    def enhance():
+        barrier.wait()
+        results.append(integration.enhance_prompt("cat"))
+
+    threads = [threading.Thread(target=enhance) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    streamed = list(integration.enhance_prompt_stream("cat"))
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert len(stub_server.requests) == 1
+    assert results == [streamed[-1]] * 3
+    assert integration.get_request_stats() == {"coalesced": 3, "in_flight": 0}
+
+
+def test_identical_requests_are_coalesced_async(stub_server, integration):
+    stub_server.delay = 0.5
+
+    async def run():
+        try:
+            return await asyncio.gather(*[integration.enhance_prompt_async("dog") for _ in range(3)])
+        finally:
+            await integration.aclose()
+
+    results = asyncio.run(run())
+
+    assert len(set(results)) == 1
+    assert len(stub_server.requests) == 1
+    assert integration.get_request_stats()["coalesced"] == 2
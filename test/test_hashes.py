@@ -0,0 +1,101 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+from modules import cache, hashes
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "caches", {})
+    monkeypatch.setattr(hashes, "read_size", 64 * 1024)
+    monkeypatch.setattr(hashes, "checkpoint_every", 256 * 1024)
+    return hashes.HashingService()
+
+
+def make_file(path, size):
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return str(path), hashlib.sha256(data).hexdigest()
+
+
+def test_sha256_state():
+    data = bytearray(os.urandom(100_000))
+
+    first = hashes.Sha256()
+    first.update(data, 64 * 1000)
+
+    if first.state() is None:
+        pytest.skip("libcrypto is not available")
+
+    second = hashes.Sha256(first.state())
+    second.update(bytearray(data[64 * 1000:]), len(data) - 64 * 1000)
+
+    assert second.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_hashing_service(service, tmp_path):
+    filename, expected = make_file(tmp_path / "model.safetensors", 1024 * 1024 + 123)
+
+    assert service.submit(filename, "checkpoint/model").result(timeout=10) == expected
+    assert hashes.sha256_from_cache(filename, "checkpoint/model") == expected
+    assert service.progress() == []
+
+
+def test_resume(service, tmp_path):
+    if hashes.libcrypto is None:
+        pytest.skip("libcrypto is not available")
+
+    filename, expected = make_file(tmp_path / "model.safetensors", 1024 * 1024)
+    stat = os.stat(filename)
+
+    with open(filename, "rb") as file:
+        head = bytearray(file.read(512 * 1024))
+
+    hasher = hashes.Sha256()
+    hasher.update(head, len(head))
+    cache.cache("hashes-partial").set("checkpoint/model", {"mtime": stat.st_mtime, "size": stat.st_size, "offset": len(head), "state": hasher.state()})
+
+    assert service.submit(filename, "checkpoint/model").result(timeout=10) == expected
+    assert cache.cache("hashes-partial").get("checkpoint/model") is None
+
+
+def test_priority(service, tmp_path, monkeypatch):
+    big, big_hash = make_file(tmp_path / "big.safetensors", 4 * 1024 * 1024)
+    small, small_hash = make_file(tmp_path / "small.safetensors", 64 * 1024)
+
+    monkeypatch.setattr(service, "threads", lambda: 1)
+
+    order = []
+    started = threading.Event()
+    submitted = threading.Event()
+    run = service.run
+    update = hashes.Sha256.update
+
+    def record_run(job):
+        result = run(job)
+        if result is not None:
+            order.append(job.title)
+        return result
+
+    def gated_update(self, data, length):
+        # the big file does not get past its first chunk until the small one is queued
+        started.set()
+        submitted.wait(5)
+        update(self, data, length)
+
+    monkeypatch.setattr(service, "run", record_run)
+    monkeypatch.setattr(hashes.Sha256, "update", gated_update)
+
+    # the big file is paused for the one that is about to be loaded, and finishes afterwards
+    background = service.submit(big, "big")
+    started.wait(5)
+    load = service.submit(small, "small", priority="load")
+    submitted.set()
+
+    assert load.result(timeout=10) == small_hash
+    assert background.result(timeout=10) == big_hash
+    assert order == ["small", "big"]
@@ -0,0 +1,95 @@
+import os
+import threading
+import types
+
+import pytest
+from PIL import Image
+
+from modules import images, options, script_callbacks, shared, shared_options
+
+
+@pytest.fixture
+def opts(monkeypatch):
+    opts = options.Options(shared_options.options_templates, shared_options.restricted_opts)
+    monkeypatch.setattr(shared, "opts", opts)
+    monkeypatch.setattr(images, "opts", opts)
+    monkeypatch.setattr(images, "encoding_pool", None)
+    monkeypatch.setattr(images, "background_saves", {})
+    return opts
+
+
+def test_save_image_in_background(opts, tmp_path, monkeypatch):
+    saved = []
+    monkeypatch.setattr(script_callbacks, "image_saved_callback", lambda params: saved.append(os.path.basename(params.filename)))
+
+    # the first image is written last, but callbacks still come in the order images were saved
+    last_written = threading.Event()
+    save = images.save_image_with_geninfo
+
+    def save_image_with_geninfo(image, *args, **kwargs):
+        if image.width == 256:
+            assert last_written.wait(5)
+        save(image, *args, **kwargs)
+        if image.width == 128:
+            last_written.set()
+
+    monkeypatch.setattr(images, "save_image_with_geninfo", save_image_with_geninfo)
+
+    pil_images = [Image.new("RGB", (256 - i * 64, 64), "red") for i in range(3)]
+    filenames = [images.save_image(image, str(tmp_path), "", extension="png", info=f"image {i}", save_to_dirs=False, background=True)[0] for i, image in enumerate(pil_images)]
+
+    assert [os.path.basename(x) for x in filenames] == ["00000.png", "00001.png", "00002.png"]
+
+    images.wait_for_background_saves()
+
+    assert saved == ["00000.png", "00001.png", "00002.png"]
+    assert sorted(os.listdir(tmp_path)) == ["00000.png", "00001.png", "00002.png"]
+    for i, filename in enumerate(filenames):
+        with Image.open(filename) as image:
+            assert image.width == 256 - i * 64
+            assert image.info["parameters"] == f"image {i}"
+
+
+def test_background_save_errors(opts, tmp_path, monkeypatch):
+    def save_image_with_geninfo(image, *args, **kwargs):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(images, "save_image_with_geninfo", save_image_with_geninfo)
+
+    # each job waits only for its own images
+    job, other_job = types.SimpleNamespace(), types.SimpleNamespace()
+    filename, _ = images.save_image(Image.new("RGB", (64, 64)), str(tmp_path), "", extension="png", p=job, save_to_dirs=False, background=True)
+    images.save_image(Image.new("RGB", (64, 64)), str(tmp_path), "", extension="png", p=other_job, save_to_dirs=False, background=True)
+
+    assert images.wait_for_background_saves(job) == [filename]
+    assert other_job.background_saves_key in images.background_saves
+    assert len(images.wait_for_background_saves(other_job)) == 1
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("replace_action", ["Replace", "Add number suffix"])
+def test_background_saves_with_same_name(opts, tmp_path, replace_action):
+    opts.save_images_replace_action = replace_action
+
+    # without a sequence number, images of one batch can get the same name; each is written to its own .tmp file
+    filenames = [images.save_image(Image.new("RGB", (64 + i, 64)), str(tmp_path), "", extension="png", forced_filename="image", save_to_dirs=False, background=True)[0] for i in range(3)]
+    assert images.wait_for_background_saves() == []
+    assert not images.reserved_filenames
+
+    if replace_action == "Replace":
+        # the last image saved wins, as when saving them one by one
+        assert os.listdir(tmp_path) == ["image.png"]
+        with Image.open(tmp_path / "image.png") as image:
+            assert image.width == 66
+        return
+
+    assert [os.path.basename(x) for x in filenames] == ["image.png", "image-1.png", "image-2.png"]
+    assert sorted(os.listdir(tmp_path)) == ["image-1.png", "image-2.png", "image.png"]
+    for i, filename in enumerate(filenames):
+        with Image.open(filename) as image:
+            assert image.width == 64 + i
+
+
+def test_encode_in_parallel_keeps_order(opts):
+    pil_images = [Image.new("RGB", (8 + i, 8)) for i in range(10)]
+    assert list(images.encode_in_parallel(lambda x: x.width, pil_images)) == list(range(8, 18))
@@ -1,4 +1,7 @@
 
+import json
+import os
+
 import pytest
 import requests
 
@@ -66,3 +69,28 @@ def test_img2img_sd_upscale_performed(url_img2img, simple_img2img_request):
     simple_img2img_request["script_name"] = "sd upscale"
     simple_img2img_request["script_args"] = ["", 8, "Lanczos", 2.0]
     assert requests.post(url_img2img, json=simple_img2img_request).status_code == 200
+
+
+def test_img2img_multipart_upload(base_url, simple_img2img_request):
+    test_files_path = os.path.join(os.path.dirname(__file__), "test_files")
+
+    simple_img2img_request.pop("init_images")
+    with open(os.path.join(test_files_path, "img2img_basic.png"), "rb") as image, open(os.path.join(test_files_path, "mask_basic.png"), "rb") as mask:
+        response = requests.post(
+            f"{base_url}/sdapi/v1/img2img-multipart",
+            params={"response_format": "multipart"},
+            data={"payload": json.dumps(simple_img2img_request)},
+            files=[("init_images", image), ("mask", mask)],
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("multipart/mixed; boundary=")
+    assert response.content.count(b"Content-Type: image/") == 1
+
+
+def test_img2img_multipart_invalid_payload(base_url):
+    url = f"{base_url}/sdapi/v1/img2img-multipart"
+
+    assert requests.post(url, data={"payload": "{not json"}).status_code == 422
+    assert requests.post(url, data={"payload": "[]"}).status_code == 422
+    assert requests.post(url, data={"payload": json.dumps({"steps": "many"})}).status_code == 422
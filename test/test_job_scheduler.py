@@ -0,0 +1,103 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+from modules import job_scheduler
+
+
+def queue_job(scheduler, order, name, **kwargs):
+    """Starts a thread that waits for the scheduler, records its name when it gets the lock, and releases it;
+    the thread runs in a copy of the caller's context, like functions that anyio runs in a worker thread"""
+    count = len(scheduler.waiting)
+
+    def run():
+        scheduler.acquire(id_task=name, **kwargs)
+        order.append(name)
+        scheduler.release()
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    thread.start()
+
+    while len(scheduler.waiting) == count:
+        time.sleep(0.001)
+
+    return thread
+
+
+def test_priorities_and_fair_share():
+    scheduler = job_scheduler.JobScheduler()
+    order = []
+
+    scheduler.acquire(client="batch-client", priority="batch")
+    time.sleep(0.05)  # batch-client has used the GPU before anything else was queued
+
+    threads = [
+        queue_job(scheduler, order, "a1", priority="batch", client="batch-client"),
+        queue_job(scheduler, order, "a2", priority="batch", client="batch-client"),
+        queue_job(scheduler, order, "nightly", priority="background", client="cron"),
+        queue_job(scheduler, order, "b1", priority="batch", client="other-client"),
+        queue_job(scheduler, order, "ui", priority="interactive", client="ui"),
+    ]
+
+    assert [x["id_task"] for x in scheduler.queue_info()] == ["ui", "b1", "a1", "a2", "nightly"]
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert order == ["ui", "b1", "a1", "a2", "nightly"]
+    assert scheduler.holder is None and scheduler.usage == {}
+
+
+def test_context_sets_priority():
+    scheduler = job_scheduler.JobScheduler()
+    scheduler.acquire()
+
+    with job_scheduler.job_context(priority="background", client="hasher"):
+        thread = queue_job(scheduler, [], "hash")
+
+    assert scheduler.queue_info()[0]["priority"] == "background"
+    assert scheduler.queue_info()[0]["client"] == "hasher"
+
+    scheduler.release()
+    thread.join(timeout=10)
+
+
+def test_max_depth():
+    scheduler = job_scheduler.JobScheduler(max_depth=lambda: 1)
+    scheduler.acquire()
+    thread = queue_job(scheduler, [], "first")
+
+    with pytest.raises(job_scheduler.QueueFullError):
+        scheduler.acquire()
+
+    assert not scheduler.acquire(blocking=False)
+
+    scheduler.release()
+    thread.join(timeout=10)
+
+
+def test_checkpoint_affinity():
+    scheduler = job_scheduler.JobScheduler(affinity_window=2, loaded_checkpoints=lambda: ["a", "b"])
+    order = []
+
+    scheduler.acquire(model=("a", None, ()))
+
+    threads = [
+        queue_job(scheduler, order, "c1", model=("c", None, ())),
+        queue_job(scheduler, order, "b1", model=("b", None, ())),
+        queue_job(scheduler, order, "a1", model=("a", None, ())),
+        queue_job(scheduler, order, "a2", model=("a", None, ())),
+        queue_job(scheduler, order, "a3", model=("a", None, ())),
+        queue_job(scheduler, order, "later", priority="batch"),
+    ]
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    # jobs for the loaded model go first, but c1 is not passed over more than twice; the other priority is never mixed in
+    assert order == ["a1", "a2", "c1", "b1", "a3", "later"]
+    assert scheduler.swaps_avoided == 2
@@ -0,0 +1,51 @@
+from modules import job_scheduler, metrics
+
+
+def test_render():
+    registry = list(metrics.registry)
+    try:
+        counter = metrics.Counter("test_requests_total", "Requests", ["cache", "result"])
+        histogram = metrics.Histogram("test_seconds", "Durations", ["stage"], buckets=(0.1, 1))
+        gauge = metrics.Gauge("test_depth", "Depth", func=lambda: 3)
+
+        counter.inc(cache='a"b', result="hit")
+        counter.inc(2, cache='a"b', result="hit")
+        histogram.observe(0.05, stage="sampling")
+        histogram.observe(0.5, stage="sampling")
+        histogram.observe(5, stage="sampling")
+
+        text = metrics.render()
+    finally:
+        metrics.registry[:] = registry
+
+    assert "# TYPE test_requests_total counter\n" in text
+    assert 'test_requests_total{cache="a\\"b",result="hit"} 3\n' in text
+
+    assert 'test_seconds_bucket{stage="sampling",le="0.1"} 1\n' in text
+    assert 'test_seconds_bucket{stage="sampling",le="1"} 2\n' in text
+    assert 'test_seconds_bucket{stage="sampling",le="+Inf"} 3\n' in text
+    assert 'test_seconds_sum{stage="sampling"} 5.55\n' in text
+    assert 'test_seconds_count{stage="sampling"} 3\n' in text
+
+    assert "test_depth 3\n" in text
+    assert gauge not in metrics.registry
+
+
+def test_pipeline_metrics():
+    waits = metrics.queue_wait_seconds.samples
+    before = {(suffix, tuple(labels.items())): value for suffix, labels, value in waits()}
+
+    queue = job_scheduler.JobScheduler()
+    with queue:
+        pass
+
+    after = {(suffix, tuple(labels.items())): value for suffix, labels, value in waits()}
+    assert after[("_count", (("priority", "interactive"),))] == before.get(("_count", (("priority", "interactive"),)), 0) + 1
+
+    with metrics.stage("save"):
+        pass
+    assert 'sd_stage_seconds_count{stage="save"}' in metrics.render()
+
+    metrics.cache_lookup("test", hit=True)
+    metrics.cache_lookup("test", hit=False)
+    assert metrics.cache_hit_ratio()[("test",)] == 0.5
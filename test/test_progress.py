@@ -0,0 +1,124 @@
+import asyncio
+import json
+import threading
+import time
+import types
+
+import pytest
+from PIL import Image
+
+from modules import progress, shared, shared_state
+
+
+@pytest.fixture
+def opts(monkeypatch):
+    opts = types.SimpleNamespace(live_previews_enable=True, live_previews_image_format="png", live_preview_refresh_period=10, show_progress_every_n_steps=-1)
+    monkeypatch.setattr(progress, "opts", opts)
+    monkeypatch.setattr(shared, "opts", opts)
+    monkeypatch.setattr(shared, "state", shared_state.State())
+    return opts
+
+
+def test_live_preview_encoded_once_per_frame(opts, monkeypatch):
+    saves = []
+    image = Image.new("RGB", (64, 64), "red")
+    save = image.save
+    monkeypatch.setattr(image, "save", lambda *args, **kwargs: saves.append(1) or save(*args, **kwargs), raising=False)
+
+    shared.state.assign_current_image(image)
+    image_format, first = shared.state.current_image_base64()
+    assert image_format == "png"
+    assert shared.state.current_image_base64()[1] is first
+    assert len(saves) == 1
+
+    opts.live_previews_image_format = "jpeg"
+    assert shared.state.current_image_base64()[0] == "jpeg"
+    assert len(saves) == 2
+
+    shared.state.assign_current_image(image)
+    assert shared.state.current_image_encoded is None
+
+
+def test_live_preview_poll_cost(opts, monkeypatch):
+    """Micro-benchmark: CPU time of a progress poll that gets a new frame, first and later callers"""
+    monkeypatch.setattr(progress, "current_task", "task(a)")
+    shared.state.begin("benchmark")
+    shared.state.job_count = 1
+    shared.state.assign_current_image(Image.effect_noise((512, 512), 64).convert("RGB"))
+
+    def poll():
+        t = time.process_time()
+        res = progress.progressapi(progress.ProgressRequest(id_task="task(a)", id_live_preview=-1))
+        assert res.live_preview.startswith("data:image/png;base64,")
+        return time.process_time() - t
+
+    first = poll()
+    later = sorted(poll() for _ in range(20))[10]
+    print(f"\nlive preview poll, 512x512 png: first {first * 1000:.2f} ms, later {later * 1000:.3f} ms CPU")
+
+    assert later < first / 5
+
+
+def test_progress_events_end_with_task(opts, monkeypatch):
+    monkeypatch.setattr(progress, "finished_tasks", [])
+    monkeypatch.setattr(progress, "pending_tasks", {"task(a)": 0})
+    monkeypatch.setattr(progress, "queued_tasks_in_order", lambda: ["task(a)"])
+
+    async def run():
+        events = progress.progress_events("task(a)", live_preview=False)
+
+        first = json.loads((await anext(events)).removeprefix("data: "))
+        assert first["queued"] and not first["completed"]
+
+        progress.pending_tasks.clear()
+        progress.finished_tasks.append("task(a)")
+
+        last = json.loads((await anext(events)).removeprefix("data: "))
+        assert last["completed"]
+        assert await anext(events, None) is None
+
+    asyncio.run(run())
+
+
+def test_progress_events_give_up_on_unknown_task(opts):
+    async def run():
+        return [x async for x in progress.progress_events("task(unknown)", live_preview=False, inactivity_timeout=0)]
+
+    assert len(asyncio.run(run())) == 1
+
+
+def test_progress_stream_does_not_hold_threads(opts, monkeypatch):
+    monkeypatch.setattr(progress, "pending_tasks", {"task(a)": 0})
+    monkeypatch.setattr(progress, "queued_tasks_in_order", lambda: ["task(a)"])
+
+    async def run():
+        # many open streams share the event loop, and one thread, while the task waits in the queue
+        streams = [progress.progress_events("task(a)", live_preview=True) for _ in range(100)]
+        for _ in range(3):
+            await asyncio.gather(*[anext(x) for x in streams])
+
+        for x in streams:
+            await x.aclose()
+
+    threads = threading.active_count()
+    asyncio.run(run())
+    assert threading.active_count() == threads
+
+
+def test_worker_task_progress(opts, monkeypatch):
+    monkeypatch.setattr(progress, "worker_tasks", {})
+    monkeypatch.setattr(progress, "finished_tasks", [])
+
+    progress.start_worker_task("task(a)")
+    progress.start_worker_task("task(b)")
+    progress.update_worker_task("task(a)", {"job_count": 2, "job_no": 1, "sampling_steps": 20, "sampling_step": 10, "time_start": time.time() - 30, "textinfo": "sampling"})
+
+    # several worker tasks run at once, each with its own progress
+    a = progress.progressapi(progress.ProgressRequest(id_task="task(a)"))
+    assert a.active and a.progress == 0.75 and 9 < a.eta < 11 and a.textinfo == "sampling"
+    b = progress.progressapi(progress.ProgressRequest(id_task="task(b)"))
+    assert b.active and b.progress == 0
+
+    progress.finish_task("task(a)")
+    a = progress.progressapi(progress.ProgressRequest(id_task="task(a)"))
+    assert a.completed and not a.active
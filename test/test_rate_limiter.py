@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from modules import rate_limiter
+
+
+def test_parse_duration():
+    assert rate_limiter.parse_duration("17ms") == pytest.approx(0.017)
+    assert rate_limiter.parse_duration("6m0s") == pytest.approx(360)
+    assert rate_limiter.parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+    assert rate_limiter.parse_duration("20") == 20
+    assert rate_limiter.parse_duration(None) is None
+
+
+def test_burst_then_wait():
+    limiter = rate_limiter.RateLimiter(requests_per_minute=60)
+
+    waits = [limiter.reserve() for _ in range(62)]
+
+    assert waits[:60] == [0.0] * 60
+    assert waits[60] == pytest.approx(1, abs=0.1)
+    assert waits[61] == pytest.approx(2, abs=0.1)
+
+
+def test_reserve_from_threads():
+    limiter = rate_limiter.RateLimiter(requests_per_minute=600)
+    waits = []
+
+    def reserve():
+        for _ in range(100):
+            waits.append(limiter.reserve())
+
+    threads = [threading.Thread(target=reserve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # no reservation may be lost: 600 go through at once, the 200 others are spread over 20 seconds
+    assert sum(1 for x in waits if x == 0) == pytest.approx(600, abs=2)
+    assert max(waits) == pytest.approx(20, abs=0.5)
+
+
+def test_update_from_headers():
+    limiter = rate_limiter.RateLimiter(requests_per_minute=3)
+
+    limiter.update_from_headers({
+        "x-ratelimit-limit-requests": "3500",
+        "x-ratelimit-remaining-requests": "3499",
+        "x-ratelimit-reset-requests": "17ms",
+        "x-ratelimit-limit-tokens": "90000",
+        "x-ratelimit-remaining-tokens": "100",
+        "x-ratelimit-reset-tokens": "59s",
+    })
+
+    stats = limiter.stats()
+    assert stats["requests"]["capacity"] == 3500
+    assert stats["requests"]["available"] == pytest.approx(3499, abs=1)
+    assert stats["tokens"]["per_second"] == pytest.approx((90000 - 100) / 59)
+
+    assert limiter.reserve(tokens=50) == 0
+    assert limiter.reserve(tokens=1000) > 0
+
+
+def test_block():
+    limiter = rate_limiter.RateLimiter(requests_per_minute=None)
+    assert limiter.reserve() == 0
+
+    limiter.block(30)
+    assert limiter.reserve() == pytest.approx(30, abs=0.5)
+
+
+def test_sqlite_shared_between_limiters(tmp_path):
+    filename = str(tmp_path / "rate-limit.sqlite")
+    first = rate_limiter.SqliteRateLimiter(filename, requests_per_minute=60)
+    second = rate_limiter.SqliteRateLimiter(filename, requests_per_minute=60)
+
+    waits = [limiter.reserve() for _ in range(30) for limiter in (first, second)]
+
+    assert waits == [0.0] * 60
+    assert first.reserve() == pytest.approx(1, abs=0.1)
+
+    second.block(100)
+    assert first.reserve() == pytest.approx(100, abs=0.5)
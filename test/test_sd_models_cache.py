@@ -0,0 +1,88 @@
+import types
+
+import pytest
+import torch
+
+from modules import sd_models_cache, sd_models_mmap, shared
+
+
+@pytest.fixture
+def checkpoint_cache(monkeypatch):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(sd_checkpoint_cache=0, sd_checkpoint_cache_size=1, sd_checkpoint_cache_mapped=4, sd_checkpoint_cache_min_free_ram=0))
+    return sd_models_cache.CheckpointCache()
+
+
+class Checkpoint:
+    def __init__(self, name):
+        self.title = name
+        self.filename = f"{name}.safetensors"
+
+
+def test_budget(checkpoint_cache):
+    shared.opts.sd_checkpoint_cache_size = 2.5 * 1024 ** 2 / 1024 ** 3
+    first, second, third = Checkpoint("first"), Checkpoint("second"), Checkpoint("third")
+
+    for info in (first, second, third):
+        checkpoint_cache.put(info, {"weight": torch.zeros(256 * 1024)})
+        checkpoint_cache.trim()
+
+    # 1 MB each, the least recently used one does not fit
+    assert first not in checkpoint_cache and len(checkpoint_cache) == 2
+
+    assert checkpoint_cache.get(second) is not None
+    checkpoint_cache.put(first, {"weight": torch.zeros(256 * 1024)})
+    checkpoint_cache.trim()
+    assert third not in checkpoint_cache
+
+    info = checkpoint_cache.info()
+    assert [x["title"] for x in info["entries"]] == ["first", "second"]
+    assert info["used"] == 2 * 1024 ** 2 and info["entries"][1]["hits"] == 1
+
+
+def test_ram_pressure(checkpoint_cache, monkeypatch):
+    shared.opts.sd_checkpoint_cache_min_free_ram = 1
+    in_ram, mapped = Checkpoint("in_ram"), Checkpoint("mapped")
+
+    checkpoint_cache.put(mapped, sd_models_mmap.MappedStateDict(weight=torch.zeros(16)))
+    checkpoint_cache.put(in_ram, {"weight": torch.zeros(16)})
+
+    # copies in RAM are evicted when RAM is short, even if recently used; mapped views are left to the OS
+    monkeypatch.setattr(checkpoint_cache, "free_ram", lambda: 0)
+    checkpoint_cache.trim()
+    assert in_ram not in checkpoint_cache and mapped in checkpoint_cache
+
+
+def test_mapped_not_charged(checkpoint_cache):
+    shared.opts.sd_checkpoint_cache_size = 1.5 * 1024 ** 2 / 1024 ** 3
+    mapped, in_ram = Checkpoint("mapped"), Checkpoint("in_ram")
+
+    checkpoint_cache.put(mapped, sd_models_mmap.MappedStateDict(weight=torch.zeros(256 * 1024)))
+    checkpoint_cache.put(in_ram, {"weight": torch.zeros(256 * 1024)})
+    checkpoint_cache.trim()
+
+    # the mapped view takes no RAM of its own, so both fit in a budget for one copy
+    assert mapped in checkpoint_cache and in_ram in checkpoint_cache
+
+    info = checkpoint_cache.info()
+    assert info["used"] == 1024 ** 2 and info["mapped"] == 1024 ** 2
+
+
+def test_mapped_limit(checkpoint_cache):
+    shared.opts.sd_checkpoint_cache_mapped = 2
+    first, second, third = Checkpoint("first"), Checkpoint("second"), Checkpoint("third")
+
+    for info in (first, second, third):
+        checkpoint_cache.put(info, sd_models_mmap.MappedStateDict(weight=torch.zeros(16)))
+        checkpoint_cache.trim()
+
+    # mapped checkpoints are not charged against the budget, but there are only so many of them
+    assert first not in checkpoint_cache and len(checkpoint_cache) == 2
+
+    copied = sd_models_mmap.MappedStateDict(weight=torch.zeros(256 * 1024))
+    copied.copied_bytes = 1024 ** 2
+    shared.opts.sd_checkpoint_cache_size = 0.5 * 1024 ** 2 / 1024 ** 3
+    checkpoint_cache.put(first, copied)
+    checkpoint_cache.trim()
+
+    # tensors that had to be copied into RAM count
+    assert first not in checkpoint_cache
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from modules import cache, sd_models_manifest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "caches", {})
+
+
+def test_manifest(tmp_path):
+    filename = tmp_path / "model.safetensors"
+    filename.write_bytes(b"weights")
+
+    manifest = sd_models_manifest.Manifest("test-manifest")
+    entry = manifest.get(filename, os.stat(filename))
+    assert "hash" not in entry
+    entry["hash"] = "abcd1234"
+    manifest.save()
+
+    # an unchanged file is listed from the saved manifest
+    manifest = sd_models_manifest.Manifest("test-manifest")
+    assert manifest.get(filename, os.stat(filename))["hash"] == "abcd1234"
+
+    manifest.update(filename, sha256="ef" * 32)
+    assert sd_models_manifest.Manifest("test-manifest").get(filename, os.stat(filename))["sha256"] == "ef" * 32
+
+    # a changed file starts over
+    filename.write_bytes(b"other weights")
+    assert "hash" not in manifest.get(filename, os.stat(filename))
+
+    manifest.retain([])
+    manifest.save()
+    assert sd_models_manifest.Manifest("test-manifest").load() == {}
+
+
+def test_manifest_processes(tmp_path):
+    first, second = tmp_path / "first.safetensors", tmp_path / "second.safetensors"
+    first.write_bytes(b"weights")
+    second.write_bytes(b"other weights")
+
+    # two processes, each with its own view of the manifest, learn different things and save them
+    one, other = sd_models_manifest.Manifest("test-manifest"), sd_models_manifest.Manifest("test-manifest")
+    for manifest in (one, other):
+        manifest.get(first, os.stat(first))
+    other.get(second, os.stat(second))["hash"] = "abcd1234"
+    other.save()
+
+    one.update(first, sha256="ef" * 32)
+    other.update(first, config="v1-inference.yaml")
+    one.save()
+
+    manifest = sd_models_manifest.Manifest("test-manifest")
+    entry = manifest.get(first, os.stat(first))
+    assert entry["sha256"] == "ef" * 32 and entry["config"] == "v1-inference.yaml"
+    assert manifest.get(second, os.stat(second))["hash"] == "abcd1234"
@@ -0,0 +1,47 @@
+import safetensors.torch
+import torch
+
+from modules import shared  # noqa: F401 - sets up the path to ldm
+from modules import sd_disable_initialization, sd_models_mmap
+
+
+def test_read_mapped(tmp_path):
+    tensors = {
+        "a": torch.arange(12, dtype=torch.float16).reshape(3, 4),
+        "b": torch.tensor([1.5, -2], dtype=torch.bfloat16),
+        "c": torch.zeros(0, 4),
+        "d": torch.tensor(7, dtype=torch.int64),
+    }
+    filename = str(tmp_path / "model.safetensors")
+    safetensors.torch.save_file(tensors, filename)
+
+    mapped = sd_models_mmap.read_mapped(filename)
+    assert isinstance(mapped, sd_models_mmap.MappedStateDict)
+    assert mapped.keys() == tensors.keys()
+    for name, tensor in tensors.items():
+        assert mapped[name].dtype == tensor.dtype
+        assert torch.equal(mapped[name], tensor)
+
+    # the mapping is private
+    mapped["a"] += 1
+    assert torch.equal(sd_models_mmap.read_mapped(filename)["a"], tensors["a"])
+
+
+def test_load_on_meta(tmp_path):
+    filename = str(tmp_path / "model.safetensors")
+    safetensors.torch.save_file({"0.weight": torch.randn(8, 4), "0.bias": torch.randn(8), "1.weight": torch.randn(8)}, filename)
+    state_dict = sd_models_mmap.read_mapped(filename)
+    expected = {k: v.clone() for k, v in state_dict.items()}
+
+    with sd_disable_initialization.InitializeOnMeta():
+        model = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.LayerNorm(8, elementwise_affine=True))
+
+    # parameters are created in the target dtype and filled from the mapped file; tensors are taken out of the state dict
+    with sd_disable_initialization.LoadStateDictOnMeta(state_dict, device="cpu", weight_dtype_conversion={"": torch.float16}):
+        model.load_state_dict(state_dict, strict=False)
+
+    assert model[0].weight.dtype == torch.float16 and not model[0].weight.is_meta
+    assert torch.equal(model[0].weight, expected["0.weight"].half())
+    assert torch.equal(model[0].bias, expected["0.bias"].half())
+    assert torch.equal(model[1].weight, expected["1.weight"].half().float())
+    assert not state_dict
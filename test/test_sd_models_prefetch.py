@@ -0,0 +1,72 @@
+import threading
+import types
+
+import pytest
+
+from modules import job_scheduler, sd_models_prefetch, shared
+
+
+@pytest.fixture
+def prefetcher(monkeypatch, tmp_path):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(sd_checkpoint_prefetch="Page cache", sd_checkpoint_cache_size=0, sd_checkpoint_cache_min_free_ram=0))
+
+    filename = tmp_path / "next.safetensors"
+    filename.write_bytes(b"weights" * 1000)
+    checkpoint = types.SimpleNamespace(filename=str(filename), title="next.safetensors")
+
+    prefetcher = sd_models_prefetch.Prefetcher()
+    prefetcher.wanted_checkpoints = lambda: [checkpoint] if prefetcher.queue is not None and any(x["model"] for x in prefetcher.queue.queue_info()) else []
+    prefetcher.checkpoint = checkpoint
+    return prefetcher
+
+
+def test_prefetch(prefetcher):
+    queue = job_scheduler.JobScheduler()
+    prefetcher.attach(queue, lambda: [])
+
+    queue.acquire()
+    thread = threading.Thread(target=queue.acquire, kwargs={"model": ("next.safetensors", None, ())})
+    thread.start()
+
+    # queueing the job wakes up the prefetcher, which reads the file while the first job holds the lock
+    for _ in range(100):
+        with prefetcher.condition:
+            if prefetcher.condition.wait_for(lambda: prefetcher.prefetched is not None, timeout=0.1):
+                break
+
+    assert prefetcher.prefetched.checkpoint_info is prefetcher.checkpoint
+    assert prefetcher.prefetched.state_dict is None
+
+    queue.release()
+    thread.join(timeout=10)
+    queue.release()
+
+    prefetched = prefetcher.take(prefetcher.checkpoint)
+    assert prefetched is not None and prefetched.seconds >= 0
+    assert prefetcher.take(prefetcher.checkpoint) is None
+
+
+def test_prefetch_off(prefetcher):
+    shared.opts.sd_checkpoint_prefetch = "Off"
+    prefetcher.wake()
+
+    assert prefetcher.thread is None
+    assert prefetcher.take(prefetcher.checkpoint) is None
+
+
+def test_prefetch_dropped(prefetcher, monkeypatch):
+    prefetcher.prefetched = sd_models_prefetch.Prefetched(prefetcher.checkpoint, sd_models_prefetch.file_id(prefetcher.checkpoint.filename), {"weight": None}, 1.0)
+
+    # kept for a while in case a job that needs it is queued again
+    prefetcher.drop_stale()
+    assert prefetcher.prefetched is not None
+
+    monkeypatch.setattr(sd_models_prefetch, "max_age", 0)
+    prefetcher.drop_stale()
+    assert prefetcher.prefetched is None
+    assert prefetcher.take(prefetcher.checkpoint) is None
+
+
+def test_prefetch_into_ram_within_budget(prefetcher):
+    # without RAM for cached checkpoints, RAM mode only reads the file into the page cache
+    assert prefetcher.read(prefetcher.checkpoint.filename, "RAM") is None
@@ -88,3 +88,43 @@ def test_txt2img_multiple_batches_performed(url_txt2img, simple_txt2img_request)
 def test_txt2img_batch_performed(url_txt2img, simple_txt2img_request):
     simple_txt2img_request["batch_size"] = 2
     assert requests.post(url_txt2img, json=simple_txt2img_request).status_code == 200
+
+
+def test_txt2img_zip_response(url_txt2img, simple_txt2img_request):
+    import io
+    import json
+    import zipfile
+
+    simple_txt2img_request["batch_size"] = 2
+    response = requests.post(url_txt2img, params={"response_format": "zip"}, json=simple_txt2img_request)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        names = archive.namelist()
+        assert json.loads(archive.read("info.json"))["parameters"]["batch_size"] == 2
+
+    assert len(names) == 3
+
+
+def test_txt2img_job(base_url, simple_txt2img_request):
+    import time
+
+    response = requests.post(f"{base_url}/sdapi/v2/jobs/txt2img", json=simple_txt2img_request)
+    assert response.status_code == 200
+    id_task = response.json()["id_task"]
+
+    for _ in range(600):
+        status = requests.get(f"{base_url}/sdapi/v2/jobs/{id_task}").json()
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.1)
+
+    assert status["status"] == "done"
+
+    result = requests.get(f"{base_url}/sdapi/v2/jobs/{id_task}/result").json()
+    assert len(result["images"]) == 1
+    assert result["parameters"]["prompt"] == "example prompt"
+
+    assert requests.delete(f"{base_url}/sdapi/v2/jobs/{id_task}").status_code == 200
+    assert requests.get(f"{base_url}/sdapi/v2/jobs/{id_task}").status_code == 404
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+import types
+
+import pytest
+
+from modules import admission, shared, worker_pool
+
+
+class FakeRunner:
+    """Stands in for ApiRunner: "loads" the checkpoint named in the request and reports which process ran the job"""
+
+    def setup(self, device):
+        self.device = device
+        self.loaded = "a"
+
+    def checkpoint(self):
+        return self.loaded
+
+    def state(self):
+        return {"job_count": 1, "job_no": 0, "sampling_steps": 10, "sampling_step": 5, "time_start": time.time() - 1, "textinfo": os.getpid()}
+
+    def run(self, kind, request):
+        if request.get("fail"):
+            raise ValueError("bad request")
+
+        swapped = self.loaded != request["checkpoint"]
+        self.loaded = request["checkpoint"]
+        time.sleep(request.get("sleep", 0))
+
+        return {"images": [kind.encode()], "info": json.dumps({"pid": os.getpid(), "swapped": swapped})}
+
+
+@pytest.fixture
+def pool():
+    pool = worker_pool.WorkerPool(["cpu", "cpu"], runner=FakeRunner())
+    pool.start()
+    assert pool.wait_for_workers(timeout=60) == 2
+    yield pool
+    pool.stop()
+
+
+def run(pool, checkpoint, **kwargs):
+    result = pool.run("txt2img", {"checkpoint": checkpoint, **kwargs}, checkpoint)
+    return json.loads(result.js())
+
+
+def test_routes_by_checkpoint(pool):
+    first = run(pool, "b")
+    assert first["swapped"]
+
+    # the worker that has b loaded gets the next b job, the other one keeps a
+    assert run(pool, "b") == {**first, "swapped": False}
+    assert run(pool, "a")["pid"] != first["pid"]
+    assert run(pool, "a")["swapped"] is False
+
+    assert sum(x["swaps"] for x in pool.info()) == 1
+    assert sorted(x["checkpoint"] for x in pool.info()) == ["a", "b"]
+
+
+def test_runs_in_parallel(pool):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(run(pool, "a", sleep=1))) for _ in range(2)]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert time.time() - start < 1.9
+    assert len({x["pid"] for x in results}) == 2
+
+
+def test_error(pool):
+    with pytest.raises(worker_pool.WorkerError, match="bad request"):
+        pool.run("txt2img", {"checkpoint": "a", "fail": True}, "a")
+
+    assert run(pool, "a")["swapped"] is False
+
+
+def test_progress(pool):
+    reports = []
+    result = pool.run("txt2img", {"checkpoint": "a", "sleep": 1.2}, "a", on_progress=reports.append)
+
+    # reported while the job ran, by the process that ran it
+    assert len(reports) >= 2
+    assert {x["textinfo"] for x in reports} == {json.loads(result.js())["pid"]}
+
+
+def test_queue(pool, monkeypatch):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(queue_max_depth=1, queue_affinity_window=0, api_admission_control=True, api_admission_client_jobs=0))
+    controller = admission.AdmissionController(pool.queue)
+    results = []
+
+    def job():
+        pool.queue.acquire(model=("a", None, ()))
+        try:
+            results.append(run(pool, "a", sleep=1))
+        finally:
+            pool.queue.release()
+
+    threads = [threading.Thread(target=job) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while not pool.queue.queue_info():
+        time.sleep(0.01)
+
+    # one job per worker runs, the third waits in the queue, which admission control sees as full
+    assert len(pool.queue.holders) == 2
+    with pytest.raises(admission.AdmissionError) as e:
+        controller.check(types.SimpleNamespace(prompt="cat", width=512, height=512, batch_size=1), memory=False)
+    assert e.value.status_code == 503
+
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 3 and not pool.queue.holders
@@ -27,12 +27,22 @@ def api_only():
     from fastapi import FastAPI
     from modules.shared_cmd_options import cmd_opts
 
+    if cmd_opts.workers:
+        # models are loaded by the workers
+        cmd_opts.skip_load_model_at_start = True
+
     initialize.initialize()
 
     app = FastAPI()
     initialize_util.setup_middleware(app)
     api = create_api(app)
 
+    if cmd_opts.workers:
+        from modules import worker_pool
+        api.set_worker_pool(worker_pool.WorkerPool(cmd_opts.workers))
+        api.worker_pool.start()
+        startup_timer.record("start workers")
+
     from modules import script_callbacks
     script_callbacks.before_ui_callback()
     script_callbacks.app_started_callback(None, app)